@@ -0,0 +1,19 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:11
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountBd', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filerepository',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Время создания'),
+        ),
+    ]
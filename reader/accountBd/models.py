@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 from accountBd.collections import UserRank, UserPosition, NumberAppeal, UserStatus
 
@@ -13,6 +14,8 @@ class User(AbstractUser):
 
     third_name = models.CharField('Отчество', max_length=150, unique=False, blank=True)
     code = models.CharField('Код', max_length=30, unique=True)
+    # Время последнего изменения, по нему определяется версия данных отчетов (docs.statistic_docx.data_version)
+    updated_at = models.DateTimeField('Время изменения', auto_now=True, db_index=True)
 
     def get_full_name(self):
         full_name = '%s %s %s' % (self.last_name, self.first_name, self.third_name)
@@ -32,6 +35,8 @@ class Project(models.Model):
     """
 
     name = models.CharField('Шифр проекта', max_length=50)
+    # Время последнего изменения (см. User.updated_at)
+    updated_at = models.DateTimeField('Время изменения', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = 'Проект'
@@ -59,6 +64,9 @@ class Profile(models.Model):
     status = models.CharField('Статус пользователя', max_length=20, choices=UserStatus.STATUS_CHOICES,
                               default=UserStatus.ARMY_SERVICE)
     photo = models.ImageField('Фотография', upload_to='users', blank=True)
+    # Время последнего изменения (см. User.updated_at). Количество нарядов изменяется запросом update
+    # и время изменения не обновляет, так как в отчетах не выводится
+    updated_at = models.DateTimeField('Время изменения', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = 'Профиль'
@@ -73,6 +81,7 @@ class FileRepository(models.Model):
 
     name = models.CharField('Название файла', max_length=150, unique=True)
     file = models.FileField('Файл', upload_to='docs')
+    created_at = models.DateTimeField('Время создания', default=timezone.now, db_index=True)
 
     class Meta:
         verbose_name = 'Хранилище'
@@ -0,0 +1,119 @@
+import logging
+
+from reader.celery import app
+
+logger = logging.getLogger(__name__)
+
+
+@app.task
+def users_statistic_report(document_name, profile_ids, time_entry=None, time_exit=None):
+    """
+    Функция формирует отчет в формате .docx по операторам за период
+
+    :param document_name: Название документа
+    :param profile_ids: Список id профилей операторов
+    :param time_entry: Начальная дата периода в формате YYYY-MM-DD
+    :param time_exit: Конечная дата периода в формате YYYY-MM-DD
+    :return: id объекта FileRepository со сформированным отчетом
+    """
+
+    from accountBd.models import Profile
+    from api.public.accountBd.mixins import parse_statistic_period, user_statistic_queryset
+    from docs.statistic_docx import all_users_statistic_report
+
+    date_from, date_to = parse_statistic_period(time_entry, time_exit)
+    queryset = user_statistic_queryset(Profile.objects.filter(id__in=profile_ids).order_by('id'), date_from, date_to)
+
+    file_repository = all_users_statistic_report(queryset).save_report(document_name)
+    logger.info(f'Сформирован отчет {document_name}')
+    return file_repository.id
+
+
+@app.task
+def user_statistic_report(document_name, user_id, time_entry=None, time_exit=None):
+    """
+    Функция формирует отчет в формате .docx по одному оператору за период
+
+    :param document_name: Название документа
+    :param user_id: id пользователя
+    :param time_entry: Начальная дата периода в формате YYYY-MM-DD
+    :param time_exit: Конечная дата периода в формате YYYY-MM-DD
+    :return: id объекта FileRepository со сформированным отчетом
+    """
+
+    from accountBd.models import Profile
+    from api.public.accountBd.mixins import parse_statistic_period, user_statistic_queryset
+    from api.public.accountBd.serializers import UserStatisticDetailSerializer
+    from docs.statistic_docx import user_statistic_report as report
+
+    date_from, date_to = parse_statistic_period(time_entry, time_exit)
+    profile = user_statistic_queryset(Profile.objects.filter(user_id=user_id), date_from, date_to,
+                                      prefetch_days=True).get()
+
+    file_repository = report(UserStatisticDetailSerializer(profile).data, profile).save_report(document_name)
+    logger.info(f'Сформирован отчет {document_name}')
+    return file_repository.id
+
+
+@app.task
+def projects_statistic_report(document_name, project_ids, time_entry=None, time_exit=None):
+    """
+    Функция формирует отчет в формате .docx по проектам за период
+
+    :param document_name: Название документа
+    :param project_ids: Список id проектов
+    :param time_entry: Начальная дата периода в формате YYYY-MM-DD
+    :param time_exit: Конечная дата периода в формате YYYY-MM-DD
+    :return: id объекта FileRepository со сформированным отчетом
+    """
+
+    from accountBd.models import Project
+    from api.public.accountBd.mixins import parse_statistic_period, project_statistic_queryset
+    from docs.statistic_docx import projects_statistic_report as report
+
+    date_from, date_to = parse_statistic_period(time_entry, time_exit)
+    queryset = project_statistic_queryset(Project.objects.filter(id__in=project_ids).order_by('id'),
+                                          date_from, date_to).prefetch_related('profiles__user')
+
+    file_repository = report(queryset).save_report(document_name)
+    logger.info(f'Сформирован отчет {document_name}')
+    return file_repository.id
+
+
+@app.task
+def project_statistic_report(document_name, project_id, time_entry=None, time_exit=None):
+    """
+    Функция формирует отчет в формате .docx по одному проекту за период
+
+    :param document_name: Название документа
+    :param project_id: id проекта
+    :param time_entry: Начальная дата периода в формате YYYY-MM-DD
+    :param time_exit: Конечная дата периода в формате YYYY-MM-DD
+    :return: id объекта FileRepository со сформированным отчетом
+    """
+
+    from accountBd.models import Project
+    from api.public.accountBd.mixins import parse_statistic_period, project_statistic_queryset
+    from api.public.accountBd.serializers import ProjectsStatisticDetailSerializer
+    from docs.statistic_docx import project_statistic_report as report
+
+    date_from, date_to = parse_statistic_period(time_entry, time_exit)
+    project = project_statistic_queryset(Project.objects.filter(id=project_id), date_from, date_to,
+                                         prefetch_days=True).get()
+
+    file_repository = report(ProjectsStatisticDetailSerializer(project).data).save_report(document_name)
+    logger.info(f'Сформирован отчет {document_name}')
+    return file_repository.id
+
+
+@app.task
+def evict_reports():
+    """
+    Функция удаляет старые отчеты из каталога отчетов по возрасту и общему размеру
+    (settings.REPORTS_MAX_AGE_DAYS и settings.REPORTS_MAX_SIZE_MB)
+    """
+
+    from docs.statistic_docx import evict_reports as evict
+
+    count = evict()
+    logger.info(f'Удалено отчетов: {count}')
@@ -1,105 +1,219 @@
-from django.db.models import Sum, Q, Prefetch, Value, DurationField, F, When, Case
+from datetime import timedelta
+
+from django.db.models import Sum, Q, Prefetch, DurationField, OuterRef, Subquery, Func
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from api.public.readerBd.utils import month_start, next_month, month_statistics_months
+from accountBd.models import Profile
+from readerBd.models import Day, UserMonthStatistic, ProjectMonthStatistic
+
+
+# Поля статистики и поля дня (и помесячной статистики), по которым они считаются
+STATISTIC_FIELDS = {
+    'time_schedule': 'plan_working_hours',  # Время работы по графику
+    'time_work': 'real_working_hours',  # Время работы по факту
+    'real_overtime': 'real_overtime',  # Время переработки по факту
+    'time_of_respectful_absence_fact': 'time_of_respectful_absence_fact',
+    'time_of_not_respectful_absence_fact': 'time_of_not_respectful_absence_fact',
+}
+
+
+class DurationAddition(Func):
+    """
+    Класс позволяет складывать промежутки времени в запросе. Сложение через F() для SQLite преобразует результат
+    в строку, а в PostgreSQL и SQLite промежутки складываются обычным оператором +
+    """
+
+    arg_joiner = ' + '
+    template = '(%(expressions)s)'
+    output_field = DurationField()
+
+
+def get_statistic_period(request):
+    """
+    Функция возвращает период статистики из параметров запроса time_entry и time_exit (в формате YYYY-MM-DD).
+    Если период не указан, то статистика считается до текущей даты, чтобы не учитывать дни, созданные на будущее
+    """
+
+    return parse_statistic_period(request.query_params.get('time_entry'), request.query_params.get('time_exit'))
 
-from readerBd.models import Day
+
+def statistic_period_params(date_from, date_to):
+    """
+    Функция возвращает период статистики в формате YYYY-MM-DD для передачи в задачи celery
+    """
+
+    return date_from and date_from.isoformat(), date_to and date_to.isoformat()
+
+
+def parse_statistic_period(time_entry, time_exit):
+    """
+    Функция возвращает период статистики по датам в формате YYYY-MM-DD (используется и в задачах celery)
+
+    :param time_entry: Начальная дата периода
+    :param time_exit: Конечная дата периода
+    """
+
+    try:
+        date_from = parse_date(time_entry) if time_entry else None
+        date_to = parse_date(time_exit) if time_exit else None
+        if (time_entry and not date_from) or (time_exit and not date_to):
+            raise ValueError
+    except ValueError:
+        raise ValidationError({'message': 'Дата периода должна быть указана в формате YYYY-MM-DD'})
+
+    if not date_from and not date_to:
+        date_to = timezone.now().date()
+    return date_from, date_to
+
+
+def month_ranges(months):
+    """
+    Функция объединяет упорядоченные месяцы в промежутки подряд идущих месяцев
+
+    :param months: Упорядоченный список месяцев (первые числа месяцев)
+    :return: Список промежутков [начало, конец)
+    """
+
+    ranges = []
+    for month in months:
+        if ranges and ranges[-1][1] == month:
+            ranges[-1][1] = next_month(month)
+        else:
+            ranges.append([month, next_month(month)])
+    return ranges
+
+
+def statistic_annotations(month_statistic_model, field, outer_field, date_from, date_to):
+    """
+    Функция возвращает аннотации показателей статистики за период. Целые месяцы периода, по которым собрана
+    помесячная статистика, берутся из нее, а дни остальных месяцев (неполных, текущего и месяцев без статистики) -
+    из дней
+
+    :param month_statistic_model: Модель помесячной статистики (UserMonthStatistic или ProjectMonthStatistic)
+    :param field: Поле дня и помесячной статистики, по которому строится статистика (user или project)
+    :param outer_field: Поле основного запроса, с которым сравнивается field
+    :param date_from: Начальная дата периода (None - без ограничения)
+    :param date_to: Конечная дата периода (None - без ограничения)
+    """
+
+    # Целые месяцы периода, по которым собрана помесячная статистика. Месяцы без помесячной статистики
+    # (в том числе пропущенные) считаются по дням
+    months_from = None
+    if date_from:
+        months_from = date_from if date_from.day == 1 else next_month(date_from)
+    months_to = month_start(date_to + timedelta(days=1)) if date_to else None
+    months = sorted(month for month in month_statistics_months()
+                    if (months_from is None or month >= months_from) and (months_to is None or month < months_to))
+    use_months = bool(months)
+
+    query_days = Q(**{field: OuterRef(outer_field)})
+    if date_from:
+        query_days &= Q(date__gte=date_from)
+    if date_to:
+        query_days &= Q(date__lte=date_to)
+
+    query_months = Q(**{field: OuterRef(outer_field)})
+    if use_months:
+        query_months &= Q(month__in=months)
+        # Дни месяцев из помесячной статистики исключаются, подряд идущие месяцы объединяются в один промежуток
+        months_days = Q()
+        for start, end in month_ranges(months):
+            months_days |= Q(date__gte=start, date__lt=end)
+        query_days &= ~months_days
+
+    days = Day.objects.filter(query_days).order_by().values(field)
+    month_statistics = month_statistic_model.objects.filter(query_months).order_by().values(field)
+
+    annotations = {}
+    for name, day_field in STATISTIC_FIELDS.items():
+        days_sum = Subquery(days.annotate(total=Sum(day_field)).values('total'), output_field=DurationField())
+        if use_months:
+            months_sum = Subquery(month_statistics.annotate(total=Sum(day_field)).values('total'),
+                                  output_field=DurationField())
+            # Если за период нет ни дней, ни помесячной статистики, то показатель пустой (как у Sum)
+            annotations[name] = Coalesce(DurationAddition(months_sum, days_sum), months_sum, days_sum)
+        else:
+            annotations[name] = days_sum
+    return annotations
+
+
+def statistic_days(date_from, date_to):
+    """
+    Функция возвращает queryset дней за период для детальной информации и отчетов
+    """
+
+    query = Q()
+    if date_from:
+        query &= Q(date__gte=date_from)
+    if date_to:
+        query &= Q(date__lte=date_to)
+    return Day.objects.filter(query).select_related('project')
+
+
+def user_statistic_queryset(queryset, date_from, date_to, prefetch_days=False):
+    """
+    Функция добавляет к queryset профилей показатели статистики за период
+
+    :param queryset: queryset профилей
+    :param date_from: Начальная дата периода
+    :param date_to: Конечная дата периода
+    :param prefetch_days: Загружать ли дни пользователей за период
+    """
+
+    qs = queryset.select_related('user', 'project')
+    if prefetch_days:
+        qs = qs.prefetch_related(Prefetch('user__days', queryset=statistic_days(date_from, date_to)))
+
+    return qs.annotate(**statistic_annotations(UserMonthStatistic, 'user', 'user_id', date_from, date_to))
+
+
+def project_statistic_queryset(queryset, date_from, date_to, prefetch_days=False):
+    """
+    Функция добавляет к queryset проектов показатели статистики за период
+
+    :param queryset: queryset проектов
+    :param date_from: Начальная дата периода
+    :param date_to: Конечная дата периода
+    :param prefetch_days: Загружать ли профили и дни проектов за период
+    """
+
+    qs = queryset
+    if prefetch_days:
+        qs = qs.prefetch_related(Prefetch('profiles', queryset=Profile.objects.select_related('user', 'project')),
+                                 Prefetch('days', queryset=statistic_days(date_from, date_to)))
+
+    return qs.annotate(**statistic_annotations(ProjectMonthStatistic, 'project', 'id', date_from, date_to))
 
 
 class StatisticUserMixin:
     """
     Класс позволяет осуществлять расчет статистической информации по пользователям в совокупности и по отдельности,
-    позволяет применять фильтры к событиям по датам
+    позволяет применять фильтры к событиям по датам. Показатели считаются подзапросами по каждому пользователю,
+    а дни за период загружаются только для представлений, которые их отображают (prefetch_days)
     """
 
+    prefetch_days = False
+
     def get_queryset(self):
-        query = Q()
-        query_hours = Q(user__days__user_id=F('user_id'))
-        # Получаем атрибут запроса (данные из фильтра)
-        time_entry = self.request.query_params.get('time_entry')
-        time_exit = self.request.query_params.get('time_exit')
-        # Если начальная дата в фильтре указана то
-        if time_entry:
-            # Формируем первый запрос, где даты больше или равны,
-            # той дате, что указано в фильтре. Первый запрос нужен для Prefetch
-            query = Q(query & Q(date__gte=time_entry))
-            # Формируем второй запрос,
-            # с таким же условием, второй запрос нужен для агрегации
-            query_hours = Q(query_hours & Q(user__days__date__gte=time_entry))
-        # Тоже самое делаем для второй даты
-        if time_exit:
-            query = Q(query & Q(date__lte=time_exit))
-            query_hours = Q(query_hours & Q(user__days__date__lte=time_exit))
-        # Указываем текущую дату, чтобы если события созданы на будущие числа, они не учитывались в статистике
-        if not time_entry and not time_exit:
-            query = Q(query & Q(date__lte=timezone.now().date()))
-            query_hours = Q(query_hours & Q(user__days__date__lte=timezone.now().date()))
-
-        qs = super().get_queryset().prefetch_related(
-            Prefetch('user__days', queryset=Day.objects.filter(query).distinct()))
-
-        qs_time_schedule = Sum('user__days__plan_working_hours', filter=query_hours)
-        qs_time_work = Sum('user__days__real_working_hours', filter=query_hours)
-        qs_real_overtime = Sum('user__days__real_overtime', filter=query_hours)
-        qs_time_of_respectful_absence_fact = Sum('user__days__time_of_respectful_absence_fact', filter=query_hours)
-        qs_time_of_not_respectful_absence_fact = Sum('user__days__time_of_not_respectful_absence_fact',
-                                                     filter=query_hours)
-
-        return qs.annotate(
-            time_schedule=qs_time_schedule,  # Время работы по графику
-            # Время уважительных прогулов (планируемое)
-            time_work=qs_time_work,  # Время работы по факту
-            real_overtime=qs_real_overtime,  # Время переработки по факту
-            time_of_respectful_absence_fact=qs_time_of_respectful_absence_fact,
-            time_of_not_respectful_absence_fact=qs_time_of_not_respectful_absence_fact
-        )
+        date_from, date_to = get_statistic_period(self.request)
+        return user_statistic_queryset(super().get_queryset(), date_from, date_to, self.prefetch_days)
 
 
 class StatisticProjectMixin:
     """
     Класс позволяет осуществлять расчет статистической информации по проектам, позволяет применять фильтры к событиям
-    по датам
+    по датам. Дни за период загружаются только для представлений, которые их отображают (prefetch_days)
     """
 
+    prefetch_days = False
+
     def get_queryset(self):
-        query = Q()
-        query_hours = Q(days__project_id=F('id'))
-        # Получаем атрибут запроса (данные из фильтра)
-        time_entry = self.request.query_params.get('time_entry')
-        time_exit = self.request.query_params.get('time_exit')
-        # Если начальная дата в фильтре указана то
-        if time_entry:
-            # Формируем первый запрос, где даты больше или равны,
-            # той дате, что указано в фильтре. Первый запрос нужен для Prefetch
-            query = Q(query & Q(date__gte=time_entry))
-            # Формируем второй запрос,
-            # с таким же условием, второй запрос нужен для агрегации
-            query_hours = Q(query_hours & Q(days__date__gte=time_entry))
-        # Тоже самое делаем для второй даты
-        if time_exit:
-            query = Q(query & Q(date__lte=time_exit))
-            query_hours = Q(query_hours & Q(days__date__lte=time_exit))
-        # Указываем текущую дату, чтобы если события созданы на будущие числа, они не учитывались в статистике
-        if not time_entry and not time_exit:
-            query = Q(query & Q(date__lte=timezone.now().date()))
-            query_hours = Q(query_hours & Q(days__date__lte=timezone.now().date()))
-
-        qs = super().get_queryset().prefetch_related(
-            Prefetch('days', queryset=Day.objects.filter(query).distinct()))
-
-        qs_time_schedule = Sum('days__plan_working_hours', filter=query_hours)
-        qs_time_work = Sum('days__real_working_hours', filter=query_hours)
-        qs_real_overtime = Sum('days__real_overtime', filter=query_hours)
-        qs_time_of_respectful_absence_fact = Sum('days__time_of_respectful_absence_fact', filter=query_hours)
-        qs_time_of_not_respectful_absence_fact = Sum('days__time_of_not_respectful_absence_fact',
-                                                     filter=query_hours)
-
-        return qs.annotate(
-            time_schedule=qs_time_schedule,  # Время работы по графику
-            # Время уважительных прогулов (планируемое)
-            time_work=qs_time_work,  # Время работы по факту
-            real_overtime=qs_real_overtime,  # Время переработки по факту
-            time_of_respectful_absence_fact=qs_time_of_respectful_absence_fact,
-            time_of_not_respectful_absence_fact=qs_time_of_not_respectful_absence_fact
-        )
+        date_from, date_to = get_statistic_period(self.request)
+        return project_statistic_queryset(super().get_queryset(), date_from, date_to, self.prefetch_days)
 
 
 class SerializerGetPercentMixin:
@@ -45,6 +45,13 @@ class IsReport(permissions.BasePermission):
     Разрешение на скачивание статистических отчетов
     """
 
+    def has_permission(self, request, view):
+        # Проверяется и для запросов без объекта (отчеты по списку и состояние задачи формирования отчета)
+        if not request.user.is_authenticated:
+            return False
+
+        return request.user.profile.position == UserPosition.LEADER_LABORATORY or request.user.is_staff
+
     def has_object_permission(self, request, view, obj):
 
         if request.user.profile.position == UserPosition.LEADER_LABORATORY or request.user.is_staff:
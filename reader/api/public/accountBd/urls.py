@@ -3,7 +3,7 @@ from rest_framework import routers
 
 from .views import UsersStatisticUserViewSet, UserStatisticUserDetailAPIView, UserProfileRetrieveAPIView, \
     UsersViewSet, ProjectsStatisticUserViewSet, ProjectsStatisticDetailAPIView, UserStatisticReportAPIView, \
-    ProjectsStatisticReportAPIView
+    ProjectsStatisticReportAPIView, ReportStatusAPIView
 
 app_name = 'accountBd'
 
@@ -21,6 +21,7 @@ urlpatterns = [
     path('projects_statistic/<int:pk>/details/report/', ProjectsStatisticReportAPIView.as_view(),
          name='project_statistic_report'),
     path('profile/', UserProfileRetrieveAPIView.as_view(), name='user_profile'),
+    path('reports/<str:job_id>/', ReportStatusAPIView.as_view(), name='report_status'),
 ]
 
 urlpatterns += router.urls
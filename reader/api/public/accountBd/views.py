@@ -1,14 +1,16 @@
-from django.utils import timezone
 from rest_framework import generics, viewsets
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from accountBd.collections import UserPosition
+from accountBd import tasks
 from docs.statistic_docx import all_users_statistic_report, user_statistic_report, projects_statistic_report, \
-    project_statistic_report
+    project_statistic_report, report_job_response, report_name, cached_report, report_file_response
+from reader.celery import app
 from .filters import UserStatisticFilter, ProjectStatisticFilter
-from .mixins import StatisticUserMixin, StatisticProjectMixin
+from .mixins import StatisticUserMixin, StatisticProjectMixin, get_statistic_period, statistic_period_params
 from .permissions import IsUserOrReadOnly, IsAdminOrReadOnly, IsReport
 from .serializers import UsersStatisticSerializer, UserStatisticDetailSerializer, ProfileSerializer, UsersSerializer, \
     ProjectsStatisticSerializer, ProjectsStatisticDetailSerializer, UsersCreateUpdateSerializer
@@ -60,24 +62,33 @@ class UsersStatisticUserViewSet(StatisticUserMixin, viewsets.ModelViewSet):
         """
         Функция позвоялет получать отчеты по всем пользователя
 
-        :return: Возвращает путь на скачивание отчета в .docx формате
+        :return: Возвращает путь на скачивание уже сформированного отчета в .docx формате или номер задачи
+        его формирования (или файл, если указан download)
         """
 
-        queryset = self.filter_queryset(self.get_queryset())
-        queryset = queryset.filter(
+        date_from, date_to = get_statistic_period(request)
+        profile_ids = list(self.filter_queryset(Profile.objects.all()).filter(
             position__in=(UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR)
-        ).order_by('id').select_related('user', 'project')
+        ).order_by('id').values_list('id', flat=True))
 
-        document_name = f'users_statistic-{timezone.now().strftime("%Y-%m-%d")}.docx'
+        document_name = report_name('users_statistic', profile_ids=profile_ids, date_from=date_from, date_to=date_to)
 
-        # Функция по формированию отчета в .docx формате о всех операторах
-        all_users_statistic_report(queryset, document_name)
+        # Если отчет с такими параметрами уже сформирован и данные не изменились, то он не формируется заново
+        file_repository = cached_report(document_name)
+        if file_repository:
+            return report_file_response(request, file_repository)
 
-        file_repository, _ = FileRepository.objects.get_or_create(
-            name=document_name,
-            defaults={'file': f'docs/{document_name}'})
+        if request.query_params.get('download'):
+            queryset = self.filter_queryset(self.get_queryset())
+            queryset = queryset.filter(
+                position__in=(UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR)
+            ).order_by('id').select_related('user', 'project')
 
-        return Response({'url': file_repository.file.url})
+            # Функция по формированию отчета в .docx формате о всех операторах
+            return all_users_statistic_report(queryset).response(document_name)
+
+        return report_job_response(tasks.users_statistic_report.delay(
+            document_name, profile_ids, *statistic_period_params(date_from, date_to)))
 
 
 class UserStatisticUserDetailAPIView(StatisticUserMixin, generics.RetrieveAPIView):
@@ -92,6 +103,7 @@ class UserStatisticUserDetailAPIView(StatisticUserMixin, generics.RetrieveAPIVie
     permission_classes = (IsAdminOrReadOnly,)
     queryset = Profile.objects.all()
     serializer_class = UserStatisticDetailSerializer
+    prefetch_days = True
     # TODO: Можно убрать после завершения, необходима чтобы формировать фильтрацию в
     # TODO: дефолтной програме для тестирования API
     filter_class = UserStatisticFilter
@@ -113,25 +125,31 @@ class UserStatisticReportAPIView(StatisticUserMixin, generics.RetrieveAPIView):
     permission_classes = (IsReport,)
     queryset = Profile.objects.all()
     serializer_class = UserStatisticDetailSerializer
+    prefetch_days = True
 
     def get_queryset(self):
         return super().get_queryset().filter(user_id=self.kwargs['pk'])
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
         user_id = self.kwargs['pk']
+        date_from, date_to = get_statistic_period(request)
+        self.check_object_permissions(request, get_object_or_404(Profile, user_id=user_id))
+
+        document_name = report_name('user_statistic', user_id=user_id, date_from=date_from, date_to=date_to)
 
-        document_name = f'user_statistic-{timezone.now().strftime("%Y-%m-%d")}-user_id-{user_id}.docx'
+        file_repository = cached_report(document_name)
+        if file_repository:
+            return report_file_response(request, file_repository)
 
-        # Функция по формированию отчета в .docx формате об одном операторе
-        user_statistic_report(serializer.data, user_id, document_name)
+        if request.query_params.get('download'):
+            instance = self.get_object()
+            serializer = self.get_serializer(instance)
 
-        file_repository, _ = FileRepository.objects.get_or_create(
-            name=document_name,
-            defaults={'file': f'docs/{document_name}'})
+            # Функция по формированию отчета в .docx формате об одном операторе
+            return user_statistic_report(serializer.data, instance).response(document_name)
 
-        return Response({'url': file_repository.file.url})
+        return report_job_response(tasks.user_statistic_report.delay(
+            document_name, user_id, *statistic_period_params(date_from, date_to)))
 
 
 class UserProfileRetrieveAPIView(generics.RetrieveAPIView):
@@ -167,22 +185,29 @@ class ProjectsStatisticUserViewSet(StatisticProjectMixin, viewsets.ModelViewSet)
         """
         Функция позвоялет получать отчеты по всем проектам
 
-        :return: Возвращает путь на скачивание отчета в .docx формате
+        :return: Возвращает путь на скачивание уже сформированного отчета в .docx формате или номер задачи
+        его формирования (или файл, если указан download)
         """
 
-        queryset = self.filter_queryset(self.get_queryset())
-        queryset = queryset.order_by('id')
+        date_from, date_to = get_statistic_period(request)
+        project_ids = list(self.filter_queryset(Project.objects.all()).order_by('id').values_list('id', flat=True))
 
-        document_name = f'projects_statistic-{timezone.now().strftime("%Y-%m-%d")}.docx'
+        document_name = report_name('projects_statistic', project_ids=project_ids,
+                                    date_from=date_from, date_to=date_to)
 
-        # Функция по формированию отчета в .docx формате о всех операторах
-        projects_statistic_report(queryset, document_name)
+        file_repository = cached_report(document_name)
+        if file_repository:
+            return report_file_response(request, file_repository)
 
-        file_repository, _ = FileRepository.objects.get_or_create(
-            name=document_name,
-            defaults={'file': f'docs/{document_name}'})
+        if request.query_params.get('download'):
+            queryset = self.filter_queryset(self.get_queryset())
+            queryset = queryset.order_by('id').prefetch_related('profiles__user')
 
-        return Response({'url': file_repository.file.url})
+            # Функция по формированию отчета в .docx формате о всех проектах
+            return projects_statistic_report(queryset).response(document_name)
+
+        return report_job_response(tasks.projects_statistic_report.delay(
+            document_name, project_ids, *statistic_period_params(date_from, date_to)))
 
 
 class ProjectsStatisticDetailAPIView(StatisticProjectMixin, generics.RetrieveAPIView):
@@ -195,6 +220,7 @@ class ProjectsStatisticDetailAPIView(StatisticProjectMixin, generics.RetrieveAPI
     permission_classes = (IsAdminOrReadOnly,)
     queryset = Project.objects.all()
     serializer_class = ProjectsStatisticDetailSerializer
+    prefetch_days = True
     # TODO: Можно убрать после завершения, по тем же основаниям что и выше описаны
     filter_class = ProjectStatisticFilter
 
@@ -214,23 +240,49 @@ class ProjectsStatisticReportAPIView(StatisticProjectMixin, generics.RetrieveAPI
     permission_classes = (IsReport,)
     queryset = Project.objects.all()
     serializer_class = ProjectsStatisticDetailSerializer
+    prefetch_days = True
 
     def get_queryset(self):
         return super().get_queryset().filter(id=self.kwargs['pk'])
 
     def retrieve(self, request, *args, **kwargs):
-
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
         project_id = self.kwargs['pk']
+        date_from, date_to = get_statistic_period(request)
+        self.check_object_permissions(request, get_object_or_404(Project, id=project_id))
+
+        document_name = report_name('project_statistic', project_id=project_id, date_from=date_from, date_to=date_to)
+
+        file_repository = cached_report(document_name)
+        if file_repository:
+            return report_file_response(request, file_repository)
+
+        if request.query_params.get('download'):
+            instance = self.get_object()
+            serializer = self.get_serializer(instance)
 
-        document_name = f'project_statistic-{timezone.now().strftime("%Y-%m-%d")}-project_id-{project_id}.docx'
+            # Функция по формированию отчета в .docx формате об одном проекте
+            return project_statistic_report(serializer.data).response(document_name)
+
+        return report_job_response(tasks.project_statistic_report.delay(
+            document_name, project_id, *statistic_period_params(date_from, date_to)))
+
+
+class ReportStatusAPIView(APIView):
+    """
+    Представление позволяет получать состояние задачи формирования отчета. Когда отчет сформирован,
+    возвращается путь на скачивание (или сам файл, если указан параметр download)
+    """
+
+    permission_classes = (IsReport,)
 
-        # Функция по формированию отчета в .docx формате об одном операторе
-        project_statistic_report(serializer.data, document_name)
+    def get(self, request, *args, **kwargs):
+        result = app.AsyncResult(self.kwargs['job_id'])
 
-        file_repository, _ = FileRepository.objects.get_or_create(
-            name=document_name,
-            defaults={'file': f'docs/{document_name}'})
+        if result.failed():
+            return Response({'status': result.state, 'message': 'Не удалось сформировать отчет'})
+        if not result.successful():
+            # Задача ожидает выполнения или выполняется (неизвестный номер задачи также имеет состояние PENDING)
+            return Response({'status': result.state})
 
-        return Response({'url': file_repository.file.url})
+        file_repository = get_object_or_404(FileRepository, id=result.result)
+        return report_file_response(request, file_repository)
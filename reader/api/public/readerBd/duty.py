@@ -0,0 +1,150 @@
+import datetime
+
+from django.db import transaction
+
+from accountBd.collections import UserStatus
+from accountBd.models import Profile
+from readerBd.collections import TypeOfDay
+from readerBd.models import Day, ScheduleDuty
+from .utils import AppealRotation, change_count_duty
+
+
+class DutyScheduler:
+    """
+    Класс формирует график дежурств по лаборатории. Все данные, необходимые для расчета (профили дежурящих,
+    количество нарядов, уже назначенные дежурства и дни, в которые пользователи не могут дежурить), загружаются
+    несколькими запросами, очередность дежурств рассчитывается в памяти, а результат сохраняется одной транзакцией
+    """
+
+    def __init__(self, priority_duty, date_start, horizon):
+        """
+        :param priority_duty: Объект OrderOfDuty, который содержит информацию о текущем дежурном призыве
+        :param date_start: Дата, с которой формируется график
+        :param horizon: Количество дней, на которые формируется график
+        """
+
+        self.priority_duty = priority_duty
+        # Границы призывов запоминаются на время формирования графика
+        self.appeal_rotation = AppealRotation()
+        self.dates = [date_start + datetime.timedelta(days=days_week) for days_week in range(horizon)]
+        # Сформированные дежурства и изменение количества нарядов пользователей
+        self.schedule_list = []
+        self.increments = {}
+        self.priority_changed = False
+
+    def load(self):
+        """
+        Функция загружает данные для расчета графика
+        """
+
+        # Если в графике уже есть запись на дату или дата выпадает на выходной, то дату пропускаем
+        busy_dates = set(ScheduleDuty.objects.filter(date__in=self.dates).values_list('date', flat=True))
+        self.dates = [date for date in self.dates if date not in busy_dates and date.weekday() not in (5, 6)]
+
+        self.profiles = list(Profile.objects.exclude(status=UserStatus.DEMOB).order_by('user__last_name', 'user_id')
+                             .only('id', 'user_id', 'number_appeal', 'count_duty'))
+
+        # Пары (id пользователя, дата), в которые пользователь не может дежурить (госпиталь, командировка и другое)
+        self.absent = set(Day.objects.filter(
+            date__in=self.dates, user_id__in=[profile.user_id for profile in self.profiles]
+        ).exclude(type_of_day=TypeOfDay.WORK).values_list('user_id', 'date'))
+
+    def appeal_profiles(self, number_appeal):
+        """
+        Функция возвращает профили дежурного призыва в алфавитном порядке
+        """
+
+        return [profile for profile in self.profiles if profile.number_appeal == number_appeal]
+
+    def change_appeal(self):
+        """
+        Функция изменяет приоритет дежурства
+        """
+
+        self.appeal_rotation.change(self.priority_duty)
+        self.priority_changed = True
+        return self.priority_duty.number_appeal
+
+    def assign(self, profile, date):
+        """
+        Функция назначает пользователя дежурным на дату и увеличивает количество его нарядов
+        """
+
+        self.schedule_list.append(ScheduleDuty(user_id=profile.user_id, date=date))
+        profile.count_duty += 1
+        self.increments[profile.user_id] = self.increments.get(profile.user_id, 0) + 1
+
+    def solve(self):
+        """
+        Функция рассчитывает график дежурств
+
+        :return: Возвращает список несохраненных объектов ScheduleDuty
+        """
+
+        # Переменная для запоминания id тех, кто уже подежурил.
+        remember_count_duty = []
+        number_appeal = self.priority_duty.number_appeal
+
+        for date_days_week in self.dates:
+            qs_profile = self.appeal_profiles(number_appeal)
+            # Узнаем максимальное и минимальное количество нарядов у операторов дежурного призыва.
+            count_duty = [profile.count_duty for profile in qs_profile]
+            max_count_duty = max(count_duty, default=None)
+            min_count_duty = min(count_duty, default=None)
+
+            # Пользователи, которые не входят в список тех, кто уже подежурил
+            users_yes_duty = [profile.user_id for profile in qs_profile
+                              if profile.user_id not in remember_count_duty]
+
+            # Пользователи, которые не могут дежурить на текущую дату
+            users_not_duty = [profile.user_id for profile in qs_profile
+                              if (profile.user_id, date_days_week) in self.absent]
+
+            # Проверяем совпадает ли список тех кто не дежурил с теми кто не может дежурить или с пустым списком
+            # (то есть все дежурили) если совпадает, то меняем приоритет призыва для дежурства.
+            if users_yes_duty in (users_not_duty, []):
+                number_appeal = self.change_appeal()
+                remember_count_duty = []
+                qs_profile = self.appeal_profiles(number_appeal)
+
+            # Проверяем у всех ли в призыве равное количество нарядов и в списке дежурств пусто.
+            # Если равно и пусто, то мы берем первого пользователя, предварительно отсортировав по алфавиту.
+            if max_count_duty == min_count_duty:
+
+                if not remember_count_duty:
+                    # Если в призыве никого нет, то дату пропускаем
+                    if not qs_profile:
+                        continue
+                    profile_user = qs_profile[0]
+                    self.assign(profile_user, date_days_week)
+                    remember_count_duty.append(profile_user.user_id)
+
+                # Если количество нарядов равное список дежурств не пустой, то изменяем приоритет дежурства
+                # Проверка количества отдежуривших с списке remember_count_duty необходима для того,
+                # чтобы не получилось так, что у 1 человека нарядов меньше чем у остальных, он 1 раз отдежурит и
+                # приоритет дежурства поменяется. Это условие сделет так, что он подежурит и его призыв также
+                # дальше пойдет дежурить
+                elif len(remember_count_duty) > 2:
+                    number_appeal = self.change_appeal()
+                    remember_count_duty = []
+
+            # Если количество нарядов не равное, то ищем пользователя, у котороторого количетсво нарядов минимально
+            else:
+                profile_user = next((profile for profile in qs_profile if profile.count_duty == min_count_duty), None)
+                if profile_user is None:
+                    continue
+                self.assign(profile_user, date_days_week)
+                remember_count_duty.append(profile_user.user_id)
+
+        return self.schedule_list
+
+    def save(self):
+        """
+        Функция сохраняет график дежурств, количество нарядов и приоритет дежурства в одной транзакции
+        """
+
+        with transaction.atomic():
+            ScheduleDuty.objects.bulk_create(self.schedule_list)
+            change_count_duty(self.increments)
+            if self.priority_changed:
+                self.priority_duty.save()
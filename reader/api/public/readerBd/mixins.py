@@ -0,0 +1,22 @@
+class QuerysetOptimizationMixin:
+    """
+    Класс позволяет указывать для каждого действия связанные объекты, которые необходимо получить вместе
+    с queryset (select_related) или отдельными запросами (prefetch_related), чтобы количество запросов к БД
+    не зависело от количества объектов
+    """
+
+    action_to_select_related = {}
+    action_to_prefetch_related = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        select_related = self.action_to_select_related.get(self.action)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+
+        prefetch_related = self.action_to_prefetch_related.get(self.action)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+
+        return queryset
@@ -0,0 +1,127 @@
+import calendar
+import datetime
+
+import numpy as np
+
+from readerBd.collections import TypeOfDay, Times, WorkSchedule
+from readerBd.models import ControlTime
+from .utils import recalculation_days
+
+
+SECONDS_IN_DAY = 24 * 60 * 60
+
+
+def _seconds(value):
+    """
+    Функция переводит время суток (datetime.time) или промежуток времени (datetime.timedelta) в секунды
+    """
+
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds())
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _windows_array(day_start, position):
+    """
+    Функция строит рабочие промежутки распорядка для каждого элемента массива
+
+    :param day_start: массив начала суток в секундах unix-времени (UTC)
+    :param position: массив должностей пользователей
+    :return: Возвращает два массива (начало и конец промежутков) размером (количество элементов, число промежутков).
+    Если у распорядка промежутков меньше, то последний промежуток повторяется (повтор не влияет на расчет)
+    """
+
+    count = max(len(windows) for _, schedule in WorkSchedule.VERSIONS for windows in schedule.values())
+    starts = np.zeros((len(day_start), count), dtype=np.int64)
+    ends = np.zeros((len(day_start), count), dtype=np.int64)
+
+    # Для каждого элемента определяем версию распорядка, которая действовала в эту дату
+    versions_start = np.array([calendar.timegm(date_from.timetuple()) for date_from, _ in WorkSchedule.VERSIONS],
+                              dtype=np.int64)
+    version = np.searchsorted(versions_start, day_start, side='right') - 1
+
+    for index, (_, schedule) in enumerate(WorkSchedule.VERSIONS):
+        in_version = version == index
+        other_positions = [key for key in schedule if key is not None]
+        for key, windows in schedule.items():
+            if key is None:
+                mask = in_version & ~np.isin(position, other_positions)
+            else:
+                mask = in_version & (position == key)
+
+            windows = list(windows) + [windows[-1]] * (count - len(windows))
+            for number, (start, end) in enumerate(windows):
+                starts[mask, number] = day_start[mask] + _seconds(start)
+                ends[mask, number] = day_start[mask] + _seconds(end)
+
+    return starts, ends
+
+
+def overtime_array(time_entry, time_exit, position, type_of_day):
+    """
+    Функция рассчитывает время переработки сразу для массива control_time. Результат совпадает с результатом
+    функции overtime_calculation для каждого элемента массива.
+
+    :param time_entry: массив времени входа в секундах unix-времени (UTC), без долей секунды
+    :param time_exit: массив времени выхода в секундах unix-времени (UTC), без долей секунды
+    :param position: массив должностей пользователей (UserPosition)
+    :param type_of_day: массив типов дней (TypeOfDay)
+    :return: Возвращает массив np.int64 с временем переработки в секундах
+    """
+
+    entry = np.asarray(time_entry, dtype=np.int64)
+    exit_ = np.asarray(time_exit, dtype=np.int64)
+    position = np.asarray(position, dtype=object)
+    is_work = np.asarray(type_of_day, dtype=object) == TypeOfDay.WORK
+    delay = _seconds(Times.TIME_DELAY)
+
+    overtime = np.zeros(len(entry), dtype=np.int64)
+    cursor = entry.copy()
+
+    # Перебираем рабочие промежутки всех дат от даты входа до даты выхода (так же как в overtime_calculation)
+    entry_date = entry - entry % SECONDS_IN_DAY
+    days_count = int(((exit_ - exit_ % SECONDS_IN_DAY - entry_date) // SECONDS_IN_DAY).max(initial=0)) + 1
+    for day_number in range(days_count):
+        starts, ends = _windows_array(entry_date + day_number * SECONDS_IN_DAY, position)
+        for number in range(starts.shape[1]):
+            window_start, window_end = starts[:, number], ends[:, number]
+            active = (window_end > cursor) & (window_start < exit_)
+            gap = window_start - cursor
+            overtime += np.where(active & (gap > delay), gap, 0)
+            cursor = np.where(active, np.maximum(cursor, window_end), cursor)
+
+    gap = exit_ - cursor
+    overtime += np.where(gap > delay, gap, 0)
+
+    # В нерабочий день все время присутствия считается переработкой
+    return np.where(is_work, overtime, exit_ - entry).astype(np.int64)
+
+
+def recalculation_overtime(date_from, date_to):
+    """
+    Функция пересчитывает время переработки всех закрытых control_time за период (например, после изменения
+    распорядка рабочего дня) и затем пересчитывает показатели дней за этот период
+
+    :param date_from: Начальная дата периода (включительно)
+    :param date_to: Конечная дата периода (включительно)
+    :return: Возвращает количество control_time, у которых изменилось время переработки
+    """
+
+    rows = list(ControlTime.objects.filter(day__date__range=(date_from, date_to), time_exit__isnull=False).values_list(
+        'id', 'time_entry', 'time_exit', 'overtime', 'day__type_of_day', 'user__profile__position'))
+
+    control_times = []
+    if rows:
+        ids, time_entry, time_exit, overtime, type_of_day, position = zip(*rows)
+        new_overtime = overtime_array([int(value.timestamp()) for value in time_entry],
+                                      [int(value.timestamp()) for value in time_exit],
+                                      position, type_of_day)
+
+        for control_time_id, old_overtime, seconds in zip(ids, overtime, new_overtime.tolist()):
+            value = datetime.timedelta(seconds=seconds)
+            if value != old_overtime:
+                control_times.append(ControlTime(id=control_time_id, overtime=value))
+
+    ControlTime.objects.bulk_update(control_times, ['overtime'], batch_size=500)
+    recalculation_days(date_from, date_to)
+    return len(control_times)
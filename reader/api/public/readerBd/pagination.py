@@ -0,0 +1,110 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Класс реализует постраничный вывод по ключу (keyset). Курсор содержит значения всех полей сортировки последнего
+    (первого) объекта страницы, поэтому следующая страница выбирается условием по индексу, а не смещением,
+    и время получения страницы не зависит от ее номера. Последним полем сортировки должно быть уникальное поле (id).
+    """
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor.reverse if self.cursor else False
+        # Для предыдущей страницы выбираем объекты в обратном порядке, а затем разворачиваем страницу
+        ordering = [self._reverse_field(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.cursor:
+            values = self._decode_position(queryset.model, self.cursor.position)
+            queryset = queryset.filter(self._keyset_filter(ordering, values))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False,
+                                         position=self._get_position_from_instance(self.page[-1], self.ordering)))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True,
+                                         position=self._get_position_from_instance(self.page[0], self.ordering)))
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return json.dumps(values)
+
+    def _decode_position(self, model, position):
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field.lstrip('-')).to_python(value)
+                    for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _keyset_filter(ordering, values):
+        """
+        Метод строит условие выбора объектов, которые следуют за позицией курсора:
+        (a < x) or (a = x and b < y) or ... Условие по первому полю добавляется отдельно, чтобы БД
+        использовала его как границу просмотра индекса
+        """
+
+        lookups = [(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt') for field in ordering]
+
+        keyset = Q()
+        for index, (name, lookup) in enumerate(lookups):
+            condition = Q(**{f'{name}__{lookup}': values[index]})
+            for (previous_name, _), value in zip(lookups[:index], values):
+                condition &= Q(**{previous_name: value})
+            keyset |= condition
+
+        name, lookup = lookups[0]
+        return Q(**{f'{name}__{lookup}e': values[0]}) & keyset
+
+
+class DayCursorPagination(KeysetCursorPagination):
+    ordering = ('-date', '-id')
+
+
+class ControlTimeCursorPagination(KeysetCursorPagination):
+    ordering = ('-time_entry', '-id')
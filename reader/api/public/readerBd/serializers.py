@@ -25,6 +25,15 @@ class ControlTimeReaderSerializer(serializers.ModelSerializer):
         fields = ('id', 'code')
 
 
+class ControlTimeSwipeSerializer(serializers.Serializer):
+    """
+    Класс позволяет принимать пакет RFID-меток (код и время считывания), накопленных считывателем
+    """
+
+    code = serializers.CharField(max_length=150)
+    timestamp = serializers.DateTimeField()
+
+
 class EventSerializer(serializers.ModelSerializer):
     """
     Класс позволяет работать с событиями, детализировать их и добавлять к объекту Day
@@ -51,7 +60,7 @@ class ControlTimeSerializer(serializers.ModelSerializer):
      Класс позволяет получать информацию о времени входа и выхода.
     """
 
-    id_user = serializers.IntegerField(source='day.user.id')
+    id_user = serializers.IntegerField(source='user_id')
     time_entry = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S')
     time_exit = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S')
     full_name = serializers.SerializerMethodField()
@@ -62,7 +71,7 @@ class ControlTimeSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_full_name(self, obj):
-        return obj.day.user.get_full_name()
+        return obj.user.get_full_name()
 
 
 class UpdateControlTimeSerializer(serializers.ModelSerializer):
@@ -1,198 +1,156 @@
 import datetime
+import functools
 
-from django.db.models import Max, Min, Sum
+from django.db import transaction
+from django.db.models import Max, Min, Sum, Count, Q, F, OuterRef, Subquery
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
 from django.utils.timezone import utc
 
 from accountBd.collections import UserPosition, NumberAppeal, UserStatus
-from accountBd.models import Profile
-from readerBd.collections import TypeOfDay, Times
-from readerBd.models import Event
+from accountBd.models import Profile, User
+from readerBd.collections import TypeOfDay, Times, WorkSchedule
+from readerBd.models import Event, ControlTime, Day, Presence, UserMonthStatistic, ProjectMonthStatistic
+from ws.utils import send_event
+
+
+@functools.lru_cache(maxsize=1024)
+def work_windows(date, position):
+    """
+    Функция возвращает рабочие промежутки распорядка дня для должности на дату. Результат запоминается,
+    поэтому промежутки для каждой даты и должности строятся один раз.
+
+    :param date: Дата
+    :param position: Должность пользователя (UserPosition)
+    :return: Возвращает кортеж пар datetime (начало, конец) рабочих промежутков в порядке возрастания
+    """
+
+    # Берем последнюю версию распорядка, которая начала действовать не позже указанной даты
+    schedule = WorkSchedule.VERSIONS[0][1]
+    for date_from, version_schedule in WorkSchedule.VERSIONS:
+        if date_from > date:
+            break
+        schedule = version_schedule
+
+    windows = schedule.get(position, schedule[None])
+    return tuple((datetime.datetime.combine(date, start, tzinfo=utc), datetime.datetime.combine(date, end, tzinfo=utc))
+                 for start, end in windows)
 
 
 # Функция позвоялет расчитывать время переработки пользователя
-def overtime_calculation(time_entry, time_exit, user, day):
+def overtime_calculation(time_entry, time_exit, position, day):
     """
     :param time_entry: переменная типа datetime без microsecond, содержащая время и дату входа
     :param time_exit: переменная типа datetime без microsecond, содержащая время и дату выхода
-    :param user: объект пользователя, которому принадлежит событие
+    :param position: должность пользователя, которому принадлежит событие (UserPosition)
     :param day: объект события, которому принадлежит control_time
     :return: Возвращает переменную overtime типа timedelta, которая содержит информацию о времени переработки
     """
 
-    # Ниже идут переменные для подсчета разницы между фактическим временем входа и выхода и временем рабочего дня
-    # по плану. Необходимо для контролирования переработок.
+    # В нерабочий день все время присутствия считается переработкой
+    if day.type_of_day != TypeOfDay.WORK:
+        return time_exit - time_entry
+
+    # Переработка - это время присутствия вне рабочих промежутков распорядка. Каждый отрезок вне рабочих
+    # промежутков учитывается, только если он больше времени, отведенного для резерва (10 минут)
     overtime = datetime.timedelta(0)
+    cursor = time_entry
+    date = time_entry.date()
+    while date <= time_exit.date():
+        for window_start, window_end in work_windows(date, position):
+            if window_end <= cursor:
+                continue
+            if window_start >= time_exit:
+                break
+            gap = window_start - cursor
+            if gap > Times.TIME_DELAY:
+                overtime += gap
+            cursor = max(cursor, window_end)
+        date += datetime.timedelta(days=1)
+
+    gap = time_exit - cursor
+    if gap > Times.TIME_DELAY:
+        overtime += gap
+    return overtime
 
-    # Переменные для приведение установленного распорядка рабочего дня, к текущей дате для операторов и персонала.
-
-    # Расчет показателей для операторов с учетом дня (для возможности вычитания и расчетов)
-    # 9:00 текущего дня
-    datetime_entry_morning_operator = datetime.datetime.combine(time_entry.date(),
-                                                                Times.TIME_ENTRY_MORNING_OPERATOR, tzinfo=utc)
-    # 13:00 текущего дня
-    datetime_exit_morning_operator = datetime.datetime.combine(time_exit.date(),
-                                                               Times.TIME_EXIT_MORNING_OPERATOR, tzinfo=utc)
-    # 15:00 текущего дня
-    datetime_entry_evening_operator = datetime.datetime.combine(time_entry.date(),
-                                                                Times.TIME_ENTRY_EVENING_OPERATOR, tzinfo=utc)
-    # 17:00 текущего дня
-    datetime_exit_evening_operator = datetime.datetime.combine(time_exit.date(),
-                                                               Times.TIME_EXIT_EVENING_OPERATOR, tzinfo=utc)
-
-    # Расчет показателей для персонала с учетом дня (для возможности вычитания и расчетов)
-    # 9:00 текущего дня
-    datetime_entry_morning_personal = datetime.datetime.combine(time_entry.date(),
-                                                                Times.TIME_ENTRY_MORNING_PERSONAL, tzinfo=utc)
-    # 18:00 текущего дня
-    datetime_exit_evening_personal = datetime.datetime.combine(time_exit.date(),
-                                                               Times.TIME_EXIT_EVENING_PERSONAL, tzinfo=utc)
-
-    # Переменные, приведеные ниже необходимы для осуществления контроля времени переработки.
-    # Название переменной формируется из название константы, например Times.TIME_ENTRY_MORNING_OPERATOR
-    # и действи пользователя (вход - entry или выход - exit). Перемнные имеют тип - timedelta
-
-    # Переменные необходимы для подсчета времени переработки, когда оператор прибыл в лабораторию до 9:00
-    # Из 9:00 вычитаем время входа
-    datetime_entry_morning_operator_difference_entry = datetime_entry_morning_operator - time_entry
-
-    # Переменная необходима для подсчета времени переработки, когда оператор уходит из лаборатории после 13:00
-    # Из текущего времени вхоа и выхода вычитаем 13:00
-    datetime_exit_morning_operator_difference_entry = time_entry - datetime_exit_morning_operator
-    datetime_exit_morning_operator_difference_exit = time_exit - datetime_exit_morning_operator
-
-    # Переменные необходимы для подсчета переработки если оператор пришел с 13:00 до 15:00
-    # Из 15:00 вычитаем текущее время входа и выхода
-    datetime_entry_evening_operator_difference_entry = datetime_entry_evening_operator - time_entry
-    datetime_entry_evening_operator_difference_exit = datetime_entry_evening_operator - time_exit
-
-    # Переменная необходима для подсчета времени переработки, когда оператор уходит из лаборатории после 17:00
-    # Из текущего времени выхода вычитаем 17:00
-    datetime_exit_evening_operator_difference_exit = time_exit - datetime_exit_evening_operator
-
-    # Для персонала дополнителные переменные не вводятся по скольку время обеда они могут проводить на рабочем месте
-    # и оно не засчитывается в переработку.
-    datetime_entry_morning_personal_difference = datetime_entry_morning_personal - time_entry
-    datetime_exit_evening_personal_difference = time_exit - datetime_exit_evening_personal
-
-    # Проверяем кто входит в лабораторию, если оператор, то:
-    if user.profile.position in (UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR):
-        if day.type_of_day == TypeOfDay.WORK:
 
-            # Проверяем если время входа и выхода оператора меньше чем 9:00 (то есть пользователь работал до начала
-            # рабочего дня), и его разница времени входа и 9:00 больше чем время, отведенное для резерва (10 минут)
-            if time_entry < datetime_entry_morning_operator and time_exit < datetime_entry_morning_operator and \
-                    datetime_entry_morning_operator_difference_entry > Times.TIME_DELAY:
-                overtime = time_exit - time_entry
-
-            # Проверяем, ели оператор пришел до 9:00 и его разница времени входа и 9:00 больше чем время,
-            # отведенное для резерва (10 минут), и ушел оператор до 13:00
-            elif time_entry < datetime_entry_morning_operator < time_exit <= datetime_exit_morning_operator and \
-                    datetime_entry_morning_operator_difference_entry > Times.TIME_DELAY:
-                overtime = datetime_entry_morning_operator_difference_entry
-
-            # Проверяем если оператор пришел до 9:00 и ушел c 13:00 до 15:00 и его разница времени
-            # входа и 9:00 больше чем время, отведенное для резерва (10 минут)
-            elif time_entry < datetime_entry_morning_operator and \
-                    datetime_entry_morning_operator_difference_entry > Times.TIME_DELAY and \
-                    datetime_exit_morning_operator < time_exit <= datetime_entry_evening_operator:
-                overtime = datetime_entry_morning_operator_difference_entry + \
-                           datetime_exit_morning_operator_difference_exit
-
-            # Проверяем если оператор пришел после 9:00 и ушел c 13:00 до 15:00 и его разница времени
-            # выхода и 13:00 больше чем время, отведенное для резерва (10 минут)
-            elif datetime_entry_morning_operator <= time_entry < datetime_exit_morning_operator \
-                    < time_exit <= datetime_entry_evening_operator and \
-                    datetime_exit_morning_operator_difference_exit > Times.TIME_DELAY:
-                overtime = datetime_exit_morning_operator_difference_exit
-
-            # Проверяем если оператор пришел и ушел c 13:00 до 15:00
-            elif datetime_exit_morning_operator_difference_entry > Times.TIME_DELAY and \
-                    datetime_exit_morning_operator < time_entry < datetime_entry_evening_operator and \
-                    datetime_entry_evening_operator_difference_exit < datetime.timedelta(0) and \
-                    datetime_exit_morning_operator < time_exit <= datetime_entry_evening_operator:
-                overtime = time_exit - time_entry
-
-            # Проверяем если оператор пришел с 13:00 до 15:00 и ушел до 17:00
-            elif datetime_exit_morning_operator < time_entry < datetime_entry_evening_operator and \
-                    datetime_entry_evening_operator_difference_entry > Times.TIME_DELAY and \
-                    datetime_entry_evening_operator_difference_exit < datetime.timedelta(0) and \
-                    datetime_exit_evening_operator_difference_exit < datetime.timedelta(0) and \
-                    time_exit <= datetime_exit_evening_operator:
-                overtime = datetime_entry_evening_operator_difference_entry
-
-            # Проверяем если оператор пришел с 13:00 до 15:00 и ушел после 17:00
-            elif datetime_exit_morning_operator < time_entry < datetime_entry_evening_operator and \
-                    datetime_entry_evening_operator_difference_entry > Times.TIME_DELAY and \
-                    datetime_exit_evening_operator_difference_exit > datetime.timedelta(0) and \
-                    datetime_exit_evening_operator < time_exit:
-                overtime = datetime_entry_evening_operator_difference_entry + \
-                           datetime_exit_evening_operator_difference_exit
-
-            # Проверяем если оператор пришел с 15:00 и ушел после 17:00
-            elif datetime_entry_evening_operator <= time_entry < datetime_exit_evening_operator < time_exit and \
-                    datetime_exit_evening_operator_difference_exit > datetime.timedelta(0):
-                overtime = datetime_exit_evening_operator_difference_exit
-
-            # Проверяем если оператор пришел с 17:00
-            elif datetime_exit_evening_operator <= time_entry and \
-                    datetime_exit_evening_operator_difference_exit > datetime.timedelta(0):
-                overtime = time_exit - time_entry
-
-            # Проверяем если оператор пришел до 9:00 и ушел после 17:00
-            elif time_entry < datetime_entry_morning_operator and datetime_exit_evening_operator < time_exit:
-                overtime = datetime_entry_morning_operator_difference_entry +\
-                           datetime_exit_evening_operator_difference_exit + datetime.timedelta(hours=2)
+def change_count_duty(increments):
+    """
+    Функция атомарно изменяет количество нарядов пользователей. Значение увеличивается в самой БД (F-выражение),
+    поэтому одновременные изменения не теряются, а остальные поля профиля не перезаписываются
 
-        else:
-            overtime = time_exit - time_entry
+    :param increments: Словарь {id пользователя: изменение количества нарядов}
+    """
 
-    # Если персонал, то проверяем всего 2 события:
-    else:
-        if day.type_of_day == TypeOfDay.WORK:
-            if datetime_entry_morning_personal_difference > Times.TIME_DELAY:
-                overtime += datetime_entry_morning_personal_difference
-            if datetime_exit_evening_personal_difference > Times.TIME_DELAY:
-                overtime += datetime_exit_evening_personal_difference
-        else:
-            overtime = time_exit - time_entry
-    return overtime
+    # Пользователи группируются по величине изменения, чтобы выполнить по одному запросу на каждую величину
+    users_by_value = {}
+    for user_id, value in increments.items():
+        if value:
+            users_by_value.setdefault(value, []).append(user_id)
 
+    for value, user_ids in users_by_value.items():
+        Profile.objects.filter(user_id__in=user_ids).update(count_duty=F('count_duty') + value)
 
-def change_appeal(priority_duty):
+
+class AppealRotation:
     """
-    :param priority_duty: Объект OfferOfDuty, который содержит информацию о текущем дежурном призыве
-    :return: Возвращает priority_duty, содержащую информацию о призыве, который должен дежурить
+    Класс рассчитывает смену дежурного призыва. Границы годов и номеров призывов операторов считаются одним запросом
+    и запоминаются в объекте, поэтому объект создается на одно формирование графика дежурств (см. DutyScheduler)
     """
-    # Получаем профили тех пользователй, которые не демобилизованы
-    qs = Profile.objects.filter(position__in=(UserPosition.OPERATOR,
-                                              UserPosition.SENIOR_OPERATOR)).exclude(status=UserStatus.DEMOB)
-    # Переменные необходимы для проверки 2х призывов в системе и корректного расчета призыва для дежурства.
-    # Один призыв находится в системе, когда второй призыв уходит на дембель
-    min_year_appeal = qs.aggregate(min_year=Min('year_appeal'))['min_year']
-    max_year_appeal = qs.aggregate(max_year=Max('year_appeal'))['max_year']
-
-    min_number_appeal = qs.aggregate(min_number_appeal=Min('number_appeal'))['min_number_appeal']
-    max_number_appeal = qs.aggregate(max_number_appeal=Max('number_appeal'))['max_number_appeal']
 
-    # Условия для смены приоритета дежурства (1 проверка нужна, для того чтобы возвращать тот же самый призыв,
-    # когда он остается один)
-    if min_number_appeal != max_number_appeal:
-        if priority_duty.number_appeal == NumberAppeal.ONE:
-            priority_duty.number_appeal = NumberAppeal.TWO
-            priority_duty.year_appeal = min_year_appeal
-        else:
-            if priority_duty.year_appeal == min_year_appeal:
-                priority_duty.number_appeal = NumberAppeal.ONE
-                priority_duty.year_appeal = min_year_appeal
+    def __init__(self):
+        self._bounds = None
+
+    def bounds(self):
+        """
+        Функция возвращает минимальный и максимальный год и номер призыва у операторов, которые не демобилизованы
+
+        :return: Возвращает словарь с ключами min_year, max_year, min_number, max_number
+        """
+
+        if self._bounds is None:
+            self._bounds = Profile.objects.filter(
+                position__in=(UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR)
+            ).exclude(status=UserStatus.DEMOB).aggregate(
+                min_year=Min('year_appeal'), max_year=Max('year_appeal'),
+                min_number=Min('number_appeal'), max_number=Max('number_appeal'),
+            )
+        return self._bounds
+
+    def change(self, priority_duty):
+        """
+        :param priority_duty: Объект OfferOfDuty, который содержит информацию о текущем дежурном призыве
+        :return: Возвращает priority_duty, содержащую информацию о призыве, который должен дежурить
+        """
+
+        # Границы необходимы для проверки 2х призывов в системе и корректного расчета призыва для дежурства.
+        # Один призыв находится в системе, когда второй призыв уходит на дембель
+        bounds = self.bounds()
+
+        # Условия для смены приоритета дежурства (1 проверка нужна, для того чтобы возвращать тот же самый призыв,
+        # когда он остается один)
+        if bounds['min_number'] != bounds['max_number']:
+            if priority_duty.number_appeal == NumberAppeal.ONE:
+                priority_duty.number_appeal = NumberAppeal.TWO
+                priority_duty.year_appeal = bounds['min_year']
             else:
-                priority_duty.number_appeal = NumberAppeal.ONE
-                priority_duty.year_appeal = max_year_appeal
-    return priority_duty
+                if priority_duty.year_appeal == bounds['min_year']:
+                    priority_duty.number_appeal = NumberAppeal.ONE
+                    priority_duty.year_appeal = bounds['min_year']
+                else:
+                    priority_duty.number_appeal = NumberAppeal.ONE
+                    priority_duty.year_appeal = bounds['max_year']
+        return priority_duty
 
 
 def calculation_time_variable(day):
-    # Список хранит id всех событий, которые относятся к дню
-    list_day_event_id = []
+    """
+    Функция полностью пересчитывает показатели дня по всем control_time и событиям дня
+
+    :param day: Объект Day
+    :return: Возвращает day с пересчитанными показателями (без сохранения в БД)
+    """
+
     # Переменные храянят временные значия количесва общего времени в лаборатории и переработки
     time_difference = datetime.timedelta(0)
     overtime = datetime.timedelta(0)
@@ -210,60 +168,519 @@ def calculation_time_variable(day):
         day.real_working_hours = datetime.timedelta(0)
         day.real_overtime = overtime
 
-    # Получаем id событий, которые относятся к текущему дню
-    for day_event_id in day.event.all().values('id'):
-        list_day_event_id.append(day_event_id['id'])
+    # Пересчитываем время событий дня и распределяем время отсутствия
+    events_absence_time(day)
+    return absence_calculation(day)
+
+
+def increment_time_variable(day, time_difference, overtime):
+    """
+    Функция пересчитывает показатели дня по изменению одного control_time без обращения к БД
+
+    :param day: Объект Day, к которому относится control_time
+    :param time_difference: Изменение времени присутствия control_time (новое значение минус старое)
+    :param overtime: Изменение времени переработки control_time (новое значение минус старое)
+    :return: Возвращает day с пересчитанными показателями (без сохранения в БД)
+    """
+
+    if day.type_of_day == TypeOfDay.WORK:
+        day.real_working_hours += time_difference - overtime
+    else:
+        day.real_working_hours = datetime.timedelta(0)
+    day.real_overtime += overtime
+
+    # Время событий берется из сохраненных в дне значений, которые пересчитываются только при изменении событий
+    return absence_calculation(day)
+
+
+def apply_time_increment(day_id, time_difference, overtime):
+    """
+    Функция сохраняет изменение показателей дня по изменению одного control_time. День блокируется и читается заново,
+    поэтому одновременные метки и изменения событий дня не теряются, а сохраняются только пересчитанные поля
+
+    :param day_id: id дня, к которому относится control_time
+    :param time_difference: Изменение времени присутствия control_time (новое значение минус старое)
+    :param overtime: Изменение времени переработки control_time (новое значение минус старое)
+    :return: Возвращает day с сохраненными показателями
+    """
+
+    with transaction.atomic():
+        day = Day.objects.select_for_update().get(id=day_id)
+        increment_time_variable(day, time_difference, overtime)
+        day.save(update_fields=['real_working_hours', 'real_overtime', 'time_of_respectful_absence_fact',
+                                'time_of_not_respectful_absence_fact', 'updated_at'])
+    return day
+
+
+def events_absence_time(day):
+    """
+    Функция пересчитывает суммарное плановое время уважительных и не уважительных событий дня одним запросом
+
+    :param day: Объект Day
+    :return: Возвращает day с заполненными полями time_of_respectful_absence_plan
+    и time_of_not_respectful_absence_plan (без сохранения в БД)
+    """
+
+    events = day.event.aggregate(
+        count=Count('id'),
+        respectful=Sum('time_plan', filter=Q(respectful_absence=True)),
+        not_respectful=Sum('time_plan', filter=Q(respectful_absence=False)))
+
+    # Если у дня нет событий, то время событий не заполняется
+    if events['count']:
+        day.time_of_respectful_absence_plan = events['respectful'] or datetime.timedelta(0)
+        day.time_of_not_respectful_absence_plan = events['not_respectful'] or datetime.timedelta(0)
+    else:
+        day.time_of_respectful_absence_plan = None
+        day.time_of_not_respectful_absence_plan = None
+    return day
+
+
+def absence_calculation(day):
+    """
+    Функция распределяет время отсутствия дня на уважительное и не уважительное
+
+    :param day: Объект Day с заполненными показателями работы и временем событий
+    :return: Возвращает day с пересчитанными полями time_of_respectful_absence_fact и
+    time_of_not_respectful_absence_fact (без сохранения в БД)
+    """
 
     # Проверяем есть ли события, если есть то разделяем такие события на уважительные и не уважительные
-    if list_day_event_id:
-        event_respectful_absence = Event.objects.filter(id__in=list_day_event_id, respectful_absence=True).aggregate(
-            sum_time=Sum('time_plan'))['sum_time']
-
-        event_not_respectful_absence = \
-            Event.objects.filter(id__in=list_day_event_id, respectful_absence=False).aggregate(
-                sum_time=Sum('time_plan'))['sum_time']
-
-        if not event_respectful_absence:
-            event_respectful_absence = datetime.timedelta(0)
-        if not event_not_respectful_absence:
-            event_not_respectful_absence = datetime.timedelta(0)
-
-        # Рабочее время + уважительное время событий + не уважительное время событий
-        count_time_all = event_respectful_absence + event_not_respectful_absence + day.real_working_hours
-
-        # Уважительное время событий + не уважительное время событий
-        events_all_time = event_respectful_absence + event_not_respectful_absence
-
-        # Если плановое время работы больше фактического времени работы, то в уважительное время отсуствия заносим,
-        # (то время что указано в событиях), а в неуважительное, (то что указано в событиях и время которое осталось
-        # из планового времени за вычетом фактически отработанного времени)
-        if day.plan_working_hours >= count_time_all:
-            day.time_of_respectful_absence_fact = event_respectful_absence
-            day.time_of_not_respectful_absence_fact = day.plan_working_hours - count_time_all + event_not_respectful_absence
-
-        # Если плановое время работы меньше фактического времени работы, то проверяем
-        elif day.plan_working_hours < count_time_all:
-
-            # Если уважительное время события равно 0, то оставшееся время записывается в неуважительное
-            if event_respectful_absence == datetime.timedelta(0) and \
-                    event_not_respectful_absence != datetime.timedelta(0):
-                day.time_of_respectful_absence_fact = datetime.timedelta(0)
-                day.time_of_not_respectful_absence_fact = day.plan_working_hours - day.real_working_hours
-
-            # Если не уважительное время события равно 0, то оставшееся время записывается в уважительное
-            elif event_not_respectful_absence == datetime.timedelta(0) and \
-                    event_respectful_absence != datetime.timedelta(0):
-                day.time_of_respectful_absence_fact = day.plan_working_hours - day.real_working_hours
-                day.time_of_not_respectful_absence_fact = datetime.timedelta(0)
-
-            # Если не уважительное и уважительное время не равно нулю, то записывается в оба времени пропорционально,
-            # тому времени, которое указано в плановом времени события. То есть если уважительных событий было на
-            # 2 часа, а неуажиметльных на 1, то пропрции буту 66,6 к уважительным и 33,3 к неуважительным
-            elif event_not_respectful_absence != datetime.timedelta(0) and \
-                    event_respectful_absence != datetime.timedelta(0):
-                day.time_of_respectful_absence_fact = ((event_respectful_absence / events_all_time) *
-                                                       (day.plan_working_hours - day.real_working_hours))
-                day.time_of_not_respectful_absence_fact = (day.plan_working_hours - day.real_working_hours -
-                                                           day.time_of_respectful_absence_fact)
+    if day.time_of_respectful_absence_plan is None and day.time_of_not_respectful_absence_plan is None:
+        return day
+
+    event_respectful_absence = day.time_of_respectful_absence_plan or datetime.timedelta(0)
+    event_not_respectful_absence = day.time_of_not_respectful_absence_plan or datetime.timedelta(0)
+
+    # Рабочее время + уважительное время событий + не уважительное время событий
+    count_time_all = event_respectful_absence + event_not_respectful_absence + day.real_working_hours
+
+    # Уважительное время событий + не уважительное время событий
+    events_all_time = event_respectful_absence + event_not_respectful_absence
+
+    # Если плановое время работы больше фактического времени работы, то в уважительное время отсуствия заносим,
+    # (то время что указано в событиях), а в неуважительное, (то что указано в событиях и время которое осталось
+    # из планового времени за вычетом фактически отработанного времени)
+    if day.plan_working_hours >= count_time_all:
+        day.time_of_respectful_absence_fact = event_respectful_absence
+        day.time_of_not_respectful_absence_fact = day.plan_working_hours - count_time_all + event_not_respectful_absence
+
+    # Если плановое время работы меньше фактического времени работы, то проверяем
+    elif day.plan_working_hours < count_time_all:
+
+        # Если уважительное время события равно 0, то оставшееся время записывается в неуважительное
+        if event_respectful_absence == datetime.timedelta(0) and \
+                event_not_respectful_absence != datetime.timedelta(0):
+            day.time_of_respectful_absence_fact = datetime.timedelta(0)
+            day.time_of_not_respectful_absence_fact = day.plan_working_hours - day.real_working_hours
+
+        # Если не уважительное время события равно 0, то оставшееся время записывается в уважительное
+        elif event_not_respectful_absence == datetime.timedelta(0) and \
+                event_respectful_absence != datetime.timedelta(0):
+            day.time_of_respectful_absence_fact = day.plan_working_hours - day.real_working_hours
+            day.time_of_not_respectful_absence_fact = datetime.timedelta(0)
+
+        # Если не уважительное и уважительное время не равно нулю, то записывается в оба времени пропорционально,
+        # тому времени, которое указано в плановом времени события. То есть если уважительных событий было на
+        # 2 часа, а неуажиметльных на 1, то пропрции буту 66,6 к уважительным и 33,3 к неуважительным
+        elif event_not_respectful_absence != datetime.timedelta(0) and \
+                event_respectful_absence != datetime.timedelta(0):
+            day.time_of_respectful_absence_fact = ((event_respectful_absence / events_all_time) *
+                                                   (day.plan_working_hours - day.real_working_hours))
+            day.time_of_not_respectful_absence_fact = (day.plan_working_hours - day.real_working_hours -
+                                                       day.time_of_respectful_absence_fact)
 
     return day
+
+
+def recalculation_days(date_from, date_to):
+    """
+    Функция полностью пересчитывает показатели всех дней за период одним агрегирующим запросом
+
+    :param date_from: Начальная дата периода (включительно)
+    :param date_to: Конечная дата периода (включительно)
+    :return: Возвращает количество пересчитанных дней
+    """
+
+    # Подзапросы считают суммы по control_time и событиям каждого дня, чтобы не размножать строки соединениями
+    control_times = ControlTime.objects.filter(day=OuterRef('pk')).order_by().values('day')
+    events = Event.objects.filter(days=OuterRef('pk')).order_by().values('days')
+
+    days = list(Day.objects.filter(date__range=(date_from, date_to)).annotate(
+        sum_time_difference=Subquery(control_times.annotate(sum_time=Sum('time_difference')).values('sum_time')),
+        sum_overtime=Subquery(control_times.annotate(sum_time=Sum('overtime')).values('sum_time')),
+        events_count=Subquery(events.annotate(count=Count('id')).values('count')),
+        respectful=Subquery(events.filter(respectful_absence=True).annotate(
+            sum_time=Sum('time_plan')).values('sum_time')),
+        not_respectful=Subquery(events.filter(respectful_absence=False).annotate(
+            sum_time=Sum('time_plan')).values('sum_time')),
+    ))
+
+    for day in days:
+        time_difference = day.sum_time_difference or datetime.timedelta(0)
+        overtime = day.sum_overtime or datetime.timedelta(0)
+
+        if day.type_of_day == TypeOfDay.WORK:
+            day.real_working_hours = time_difference - overtime
+        else:
+            day.real_working_hours = datetime.timedelta(0)
+        day.real_overtime = overtime
+
+        if day.events_count:
+            day.time_of_respectful_absence_plan = day.respectful or datetime.timedelta(0)
+            day.time_of_not_respectful_absence_plan = day.not_respectful or datetime.timedelta(0)
+        else:
+            day.time_of_respectful_absence_plan = None
+            day.time_of_not_respectful_absence_plan = None
+
+        absence_calculation(day)
+
+    Day.objects.bulk_update(days, ['real_working_hours', 'real_overtime',
+                                   'time_of_respectful_absence_plan', 'time_of_not_respectful_absence_plan',
+                                   'time_of_respectful_absence_fact', 'time_of_not_respectful_absence_fact'],
+                            batch_size=500)
+    update_month_statistics((day.user_id, day.project_id, day.date) for day in days)
+    return len(days)
+
+
+def update_days_events(day_ids):
+    """
+    Функция пересчитывает время событий и время отсутствия для дней, у которых изменились события
+
+    :param day_ids: Список id дней
+    """
+
+    days = list(Day.objects.filter(id__in=day_ids).annotate(
+        events_count=Count('event'),
+        respectful=Sum('event__time_plan', filter=Q(event__respectful_absence=True)),
+        not_respectful=Sum('event__time_plan', filter=Q(event__respectful_absence=False))))
+
+    for day in days:
+        if day.events_count:
+            day.time_of_respectful_absence_plan = day.respectful or datetime.timedelta(0)
+            day.time_of_not_respectful_absence_plan = day.not_respectful or datetime.timedelta(0)
+        else:
+            day.time_of_respectful_absence_plan = None
+            day.time_of_not_respectful_absence_plan = None
+        absence_calculation(day)
+
+    Day.objects.bulk_update(days, ['time_of_respectful_absence_plan', 'time_of_not_respectful_absence_plan',
+                                   'time_of_respectful_absence_fact', 'time_of_not_respectful_absence_fact'])
+    update_month_statistics((day.user_id, day.project_id, day.date) for day in days)
+
+
+def day_defaults(profile, date, type_of_day=None):
+    """
+    Функция возвращает значения полей нового дня пользователя: тип дня, проект и плановое время работы
+
+    :param profile: Профиль пользователя
+    :param date: Дата дня
+    :param type_of_day: Тип дня, если не указан, то для субботы и воскресенья - выходной, иначе рабочий день
+    :return: Словарь значений полей объекта Day
+    """
+
+    if type_of_day is None:
+        type_of_day = TypeOfDay.OUTPUT if date.weekday() in (5, 6) else TypeOfDay.WORK
+
+    # Плановое время работы есть только у рабочего дня и зависит от должности пользователя
+    if type_of_day != TypeOfDay.WORK:
+        plan_working_hours = datetime.timedelta(0)
+    elif profile.position in (UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR):
+        plan_working_hours = Times.TIME_WORK_OPERATOR
+    else:
+        plan_working_hours = Times.TIME_WORK_PERSONAL
+
+    return {
+        'type_of_day': type_of_day,
+        'project_id': profile.project_id,
+        'real_working_hours': datetime.timedelta(0),
+        'plan_working_hours': plan_working_hours,
+    }
+
+
+def get_or_create_day(user, date, **defaults):
+    """
+    Функция возвращает день пользователя на дату, если дня нет, то создает его. Одновременное создание дня
+    в нескольких процессах не приводит к дублям: ограничение уникальности (user, date) не даст вставить второй день,
+    и get_or_create вернет уже созданный
+
+    :param user: Пользователь (с загруженным профилем)
+    :param date: Дата дня
+    :param defaults: Значения полей нового дня, которые заменяют значения по умолчанию (например, type_of_day)
+    :return: Кортеж (день, создан ли день)
+    """
+
+    values = day_defaults(user.profile, date, defaults.pop('type_of_day', None))
+    values.update(defaults)
+    return Day.objects.get_or_create(user=user, date=date, defaults=values)
+
+
+def create_days(users_dates):
+    """
+    Функция создает дни пользователей, которых еще нет. Существующие дни проверяются одним запросом,
+    а новые дни вставляются одним запросом с пропуском конфликтов по (user, date)
+
+    :param users_dates: Список пар (пользователь с загруженным профилем, дата)
+    :return: Количество дней, которые были отправлены на создание
+    """
+
+    users_dates = list(users_dates)
+    if not users_dates:
+        return 0
+
+    existing = set(Day.objects.filter(user_id__in={user.id for user, _ in users_dates},
+                                      date__range=(min(date for _, date in users_dates),
+                                                   max(date for _, date in users_dates))).values_list('user_id', 'date'))
+
+    day_list = []
+    for user, date in users_dates:
+        if (user.id, date) in existing:
+            continue
+        existing.add((user.id, date))
+        day_list.append(Day(user_id=user.id, date=date, **day_defaults(user.profile, date)))
+
+    # Дни, созданные одновременно в другом процессе, пропускаются ограничением уникальности (user, date)
+    Day.objects.bulk_create(day_list, batch_size=1000, ignore_conflicts=True)
+    return len(day_list)
+
+
+def record_swipes(swipes):
+    """
+    Функция фиксирует пакет RFID-меток, накопленных считывателем, за несколько запросов к БД
+
+    :param swipes: Упорядоченный по времени список словарей с ключами code и timestamp
+    :return: Возвращает словарь с количеством созданных и закрытых control_time и списком отклоненных меток
+    """
+
+    codes = {swipe['code'] for swipe in swipes}
+    # Время меток приводим к UTC, так же как и при фиксации одной метки
+    timestamps = [swipe['timestamp'].astimezone(utc).replace(microsecond=0) for swipe in swipes]
+
+    # Получаем одним запросом всех пользователей, которым принадлежат коды
+    users = {user.code: user for user in User.objects.filter(code__in=codes).select_related('profile')}
+
+    # Создаем дни, которых еще нет, и получаем одним запросом дни пользователей на даты, которые встречаются в пакете
+    create_days({(users[swipe['code']], timestamp.date()) for swipe, timestamp in zip(swipes, timestamps)
+                 if swipe['code'] in users})
+    # Дни блокируются до конца транзакции, чтобы одновременные изменения их показателей не терялись
+    with transaction.atomic():
+        days = {(day.user_id, day.date): day for day in Day.objects.select_for_update().filter(
+            user_id__in=[user.id for user in users.values()],
+            date__in={timestamp.date() for timestamp in timestamps})}
+        # Один и тот же день должен быть представлен одним объектом, чтобы изменения показателей накапливались
+        days_by_id = {day.id: day for day in days.values()}
+
+        # Получаем одним запросом открытые control_time. Для каждого кода запоминаем самый ранний открытый
+        # control_time, так же как при фиксации одной метки
+        open_control_times = {}
+        for control_time in ControlTime.objects.filter(code__in=codes, time_exit__isnull=True).select_related(
+                'day').order_by('-time_entry'):
+            control_time.day = days_by_id.setdefault(control_time.day_id, control_time.day)
+            open_control_times[control_time.code] = control_time
+
+        control_times_create = []
+        control_times_update = []
+        changed_days = {}
+        rejected = []
+
+        for swipe, timestamp in zip(swipes, timestamps):
+            user = users.get(swipe['code'])
+            if not user:
+                rejected.append({'code': swipe['code'], 'timestamp': swipe['timestamp'],
+                                 'message': 'RFID код не зарегистрирован в системе'})
+                continue
+
+            control_time = open_control_times.pop(user.code, None)
+
+            # Метка раньше времени входа открытого control_time не может быть выходом, такую метку отклоняем,
+            # а control_time остается открытым
+            if control_time and timestamp < control_time.time_entry:
+                open_control_times[user.code] = control_time
+                rejected.append({'code': swipe['code'], 'timestamp': swipe['timestamp'],
+                                 'message': 'Время метки раньше времени входа'})
+                continue
+
+            # Если у кода есть открытый control_time, то записываем время выхода и считаем время переработки
+            if control_time:
+                old_time_difference = control_time.time_difference or datetime.timedelta(0)
+                old_overtime = control_time.overtime or datetime.timedelta(0)
+
+                control_time.time_exit = timestamp
+                control_time.time_difference = control_time.time_exit - control_time.time_entry
+
+                if control_time.day.type_of_day == TypeOfDay.WORK:
+                    control_time.overtime = overtime_calculation(control_time.time_entry, control_time.time_exit,
+                                                                 user.profile.position, control_time.day)
+                else:
+                    control_time.overtime = control_time.time_difference
+
+                # control_time, созданный в этом же пакете, еще не сохранен и будет создан вместе с остальными
+                if control_time.pk:
+                    control_times_update.append(control_time)
+
+                # Пересчитываем показатели дня по изменению control_time
+                increment_time_variable(control_time.day, control_time.time_difference - old_time_difference,
+                                        control_time.overtime - old_overtime)
+                changed_days[control_time.day.id] = control_time.day
+
+            # Иначе создаем новый control_time с временем входа
+            else:
+                day = days[(user.id, timestamp.date())]
+                control_time = ControlTime(day=day, user=user, code=user.code, time_entry=timestamp)
+                control_times_create.append(control_time)
+                open_control_times[user.code] = control_time
+
+        ControlTime.objects.bulk_create(control_times_create)
+        ControlTime.objects.bulk_update(control_times_update, ['time_exit', 'time_difference', 'overtime'])
+
+        # Сохраняем показатели дней, к которым относятся закрытые control_time
+        Day.objects.bulk_update(changed_days.values(), ['real_working_hours', 'real_overtime',
+                                                        'time_of_respectful_absence_fact',
+                                                        'time_of_not_respectful_absence_fact'])
+        update_month_statistics((day.user_id, day.project_id, day.date) for day in changed_days.values())
+
+    # bulk_create и bulk_update не вызывают save(), поэтому обновляем последние метки пользователей
+    # и отправляем одно событие на весь пакет
+    Presence.refresh({control_time.user_id for control_time in control_times_create})
+    if control_times_create or control_times_update:
+        send_event(message='update')
+
+    return {
+        'created': len(control_times_create),
+        'closed': len(control_times_update) + sum(1 for control_time in control_times_create
+                                                  if control_time.time_exit),
+        'rejected': rejected,
+    }
+
+
+def month_start(date):
+    """
+    Функция возвращает первое число месяца даты
+    """
+
+    return date.replace(day=1)
+
+
+def next_month(date):
+    """
+    Функция возвращает первое число следующего месяца
+    """
+
+    return (date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def month_statistics_months():
+    """
+    Функция возвращает месяцы, по которым собрана помесячная статистика. Месяцы берутся из самой статистики,
+    поэтому месяц, статистика за который не собиралась (например, пропущен запуск задачи), считается по дням
+
+    :return: Множество дат (первые числа месяцев)
+    """
+
+    return set(UserMonthStatistic.objects.order_by().values_list('month', flat=True).distinct())
+
+
+def missing_month_statistics():
+    """
+    Функция возвращает закрытые месяцы, в которых есть дни, но не собрана помесячная статистика
+
+    :return: Множество дат (первые числа месяцев)
+    """
+
+    months = set(Day.objects.filter(date__lt=month_start(timezone.now().date())).annotate(
+        month=TruncMonth('date')).order_by().values_list('month', flat=True).distinct())
+    return months - month_statistics_months()
+
+
+def rebuild_month_statistics(months, user_ids=None, project_ids=None):
+    """
+    Функция заново считает помесячную статистику пользователей и проектов за указанные месяцы
+
+    :param months: Список месяцев (первые числа месяцев)
+    :param user_ids: Список id пользователей. Если не указан, то статистика считается для всех пользователей
+    :param project_ids: Список id проектов. Если не указан, то статистика считается для всех проектов
+    """
+
+    months = set(months)
+    if not months:
+        return
+
+    for model, field, ids in ((UserMonthStatistic, 'user_id', user_ids),
+                              (ProjectMonthStatistic, 'project_id', project_ids)):
+        days = Day.objects.filter(date__gte=min(months), date__lt=next_month(max(months)), **{
+            f'{field}__isnull': False})
+        statistics = model.objects.filter(month__in=months)
+        if ids is not None:
+            days = days.filter(**{f'{field}__in': ids})
+            statistics = statistics.filter(**{f'{field}__in': ids})
+
+        rows = days.annotate(month=TruncMonth('date')).order_by().values(field, 'month').annotate(
+            plan_working_hours_sum=Sum('plan_working_hours'),
+            real_working_hours_sum=Sum('real_working_hours'),
+            real_overtime_sum=Sum('real_overtime'),
+            time_of_respectful_absence_fact_sum=Sum('time_of_respectful_absence_fact'),
+            time_of_not_respectful_absence_fact_sum=Sum('time_of_not_respectful_absence_fact'),
+        )
+
+        with transaction.atomic():
+            statistics.delete()
+            model.objects.bulk_create([model(**{
+                field: row[field],
+                'month': row['month'],
+                'plan_working_hours': row['plan_working_hours_sum'],
+                'real_working_hours': row['real_working_hours_sum'],
+                'real_overtime': row['real_overtime_sum'],
+                'time_of_respectful_absence_fact': row['time_of_respectful_absence_fact_sum'],
+                'time_of_not_respectful_absence_fact': row['time_of_not_respectful_absence_fact_sum'],
+            }) for row in rows if row['month'] in months], batch_size=1000)
+
+
+def update_month_statistics(days):
+    """
+    Функция пересчитывает помесячную статистику после изменения дней. Пересчитываются только месяцы,
+    статистика по которым уже собрана, дни текущего месяца в статистике не учитываются
+
+    :param days: Список кортежей (id пользователя, id проекта, дата дня)
+    """
+
+    current_month = month_start(timezone.now().date())
+    days = [(user_id, project_id, month_start(date)) for user_id, project_id, date in days
+            if date and date < current_month]
+    if not days:
+        return
+
+    # Пересчитываются только месяцы, статистика за которые уже собрана. Иначе статистика месяца появилась бы только
+    # у части пользователей, а дни остальных перестали бы учитываться
+    months = month_statistics_months()
+    days = [day for day in days if day[2] in months]
+    if not days:
+        return
+
+    rebuild_month_statistics({month for _, _, month in days},
+                             user_ids={user_id for user_id, _, _ in days},
+                             project_ids={project_id for _, project_id, _ in days if project_id})
+
+
+def journal_users(date):
+    """
+    Функция возвращает список операторов для журнала инструктажа, у которых на дату рабочий день
+
+    :param date: Дата журнала
+    :return: Список с пользователями (дата, звание, должность, ФИО)
+    """
+
+    # Список для всех пользователй, которые пришли в лабораторию
+    list_user = []
+    # ПОлучам дни рабочих дней оператора на дату
+    days = Day.objects.filter(user__profile__position__in=(UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR),
+                              date=date,
+                              type_of_day=TypeOfDay.WORK).select_related('user__profile')
+
+    # Формируем список операторов, которые пришли в лабораторию
+    for day in days:
+        user = day.user
+        list_user.append([date.strftime("%Y-%m-%d"),
+                          user.profile.get_rank_display(),
+                          user.profile.get_position_display(),
+                          user.get_full_name()])
+    return list_user
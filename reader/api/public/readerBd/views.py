@@ -1,126 +1,149 @@
 import datetime
 import logging
 
-from django.db import IntegrityError
-from django.db.models import Max, Min
+from django.db import IntegrityError, transaction
 from django.utils import timezone
+from django.utils.timezone import utc
 from rest_framework import viewsets, generics, status, exceptions
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from accountBd.collections import UserPosition, UserStatus
-from accountBd.models import User, Profile, FileRepository
-from docs.statistic_docx import event_statistic, journal
-from readerBd.collections import Times, TypeOfDay
+from accountBd.models import User, Profile
+from docs.statistic_docx import journal, report_job_response, report_name, cached_report, report_file_response
+from readerBd.cache import resolve_code
+from readerBd.collections import TypeOfDay
 from readerBd.models import ControlTime, Day, ScheduleDuty, OrderOfDuty, ListEvents, Event
+from readerBd.tasks import journal_report
+from .duty import DutyScheduler
 from .filters import ControlTimeFilter
+from .mixins import QuerysetOptimizationMixin
+from .pagination import DayCursorPagination, ControlTimeCursorPagination
 from .permissions import IsPersonalOrReadOnly
 from .serializers import ControlTimeReaderSerializer, DaySerializer, ControlTimeSerializer, EventSerializer, \
-    ControlTimeScheduleDutySerializer, ListEventsSerializer, UpdateControlTimeSerializer, CreateUpdateDaySerializer
-from .utils import overtime_calculation, change_appeal, calculation_time_variable
+    ControlTimeScheduleDutySerializer, ListEventsSerializer, UpdateControlTimeSerializer, CreateUpdateDaySerializer, \
+    ControlTimeSwipeSerializer
+from .utils import overtime_calculation, calculation_time_variable, record_swipes, \
+    apply_time_increment, journal_users, get_or_create_day, change_count_duty
 
 logging.basicConfig(level='INFO')
 
 
-class ControlTimeViewSet(viewsets.ModelViewSet):
+class ControlTimeViewSet(QuerysetOptimizationMixin, viewsets.ModelViewSet):
     """
     Класс позволяет работать с информацией о времени входа/выхода по RFID-метке
     """
 
     permission_classes = (IsPersonalOrReadOnly,)
-    queryset = ControlTime.objects.all().order_by('-time_entry')
+    queryset = ControlTime.objects.all().order_by('-time_entry', '-id')
     serializer_class = ControlTimeReaderSerializer
     filter_class = ControlTimeFilter
+    pagination_class = ControlTimeCursorPagination
 
     action_to_serializers = {
         'list': ControlTimeSerializer,
         'retrieve': ControlTimeSerializer,
-        'update': UpdateControlTimeSerializer
+        'update': UpdateControlTimeSerializer,
+        'partial_update': UpdateControlTimeSerializer,
+        'batch': ControlTimeSwipeSerializer,
+    }
+    action_to_select_related = {
+        'list': ('user',),
+        'retrieve': ('user',),
+        'update': ('day', 'user'),
+        'partial_update': ('day', 'user'),
+        'destroy': ('day', 'user'),
     }
 
     def perform_create(self, serializer):
-        # Проверяем, создается ли объект с кодом впервые или нет. Если в первый раз,
-        # то ищем пользователя которому принадлежит код, иначе возвращаем предупреждение, что код не найден и код 200
+        # Пользователь, его должность и текущий день берутся из кэша RFID-кодов (без запросов к БД при повторных
+        # метках в течение дня). Если код не найден, то возвращаем предупреждение и код 200,
         # чтобы программа по принятию RFID-меток не выдавала ошибку и не останавливала работу считывателя
-        control_time = ControlTime.objects.order_by('-time_entry').filter(code=serializer.validated_data.get('code'),
-                                                                          time_exit__isnull=True).last()
-        try:
-            user = User.objects.get(code=serializer.validated_data.get('code'))
-        except User.DoesNotExist:
+        rfid_entry = resolve_code(serializer.validated_data.get('code'))
+        if not rfid_entry:
             return Response(status=status.HTTP_200_OK, data={
                 'message': 'Вы ввели RFID код, который не зарегистрирован в системе. '
                            'Создайте пользователя и установите ему используемый RFID код'})
 
-        # Если объект уже был создан, то есть пользователь уже заходил в лабораторию, то записывается время выхода,
-        # считается разница между временем входа и выхода и ищется событие, к которому относится анализируемая
-        # временная метка
-        if control_time:
-            control_time.time_exit = timezone.now().replace(microsecond=0)
-            control_time.time_difference = control_time.time_exit - control_time.time_entry
-            day = Day.objects.get(id=control_time.day.id)
-
-            # Проверяем тип дня и высчитваем время переработки
-            if day.type_of_day == TypeOfDay.WORK:
-                control_time.overtime = overtime_calculation(control_time.time_entry,
-                                                             control_time.time_exit, user, day)
+        with transaction.atomic():
+            # Проверяем, есть ли у кода открытый control_time. Он блокируется до конца транзакции, поэтому
+            # одновременная метка выхода дождется этой метки и уже не найдет его открытым
+            control_time = ControlTime.objects.select_for_update(of=('self',)).filter(
+                code=serializer.validated_data.get('code'), time_exit__isnull=True).select_related(
+                'day', 'user').order_by('time_entry').first()
+
+            # Если объект уже был создан, то есть пользователь уже заходил в лабораторию, то записывается время
+            # выхода, считается разница между временем входа и выхода и ищется событие, к которому относится
+            # анализируемая временная метка
+            if control_time:
+                control_time.time_exit = timezone.now().replace(microsecond=0)
+                control_time.time_difference = control_time.time_exit - control_time.time_entry
+                day = control_time.day
+
+                # Проверяем тип дня и высчитваем время переработки
+                if day.type_of_day == TypeOfDay.WORK:
+                    control_time.overtime = overtime_calculation(control_time.time_entry,
+                                                                 control_time.time_exit, rfid_entry.position, day)
+                else:
+                    control_time.overtime = control_time.time_difference
+
+                control_time.save()
+                # Пересчитываем показатели дня по изменению control_time (до выхода время присутствия и переработки
+                # равны нулю)
+                apply_time_increment(day.id, control_time.time_difference, control_time.overtime)
+
+            # Если объект создается в первый раз, то к control_time привязывается текущий день пользователя
+            # (создается при первой метке за день, если еще не создан) и сохраняется в БД время входа
             else:
-                control_time.overtime = control_time.time_difference
-
-            control_time.save()
-            # Пересчитываем показатели дня, к которому относится control_time
-            day = calculation_time_variable(day)
-            day.save()
-
-        # Если объект создается в первый раз, то ищется день, к которому относится control_time и сохраняется в БД
-        # время входа, и приввязывается день к control_time
-        else:
-            try:
-                day = Day.objects.get(user=user, date=timezone.now().date())
-            except Day.DoesNotExist:
-                raise exceptions.NotFound(detail={'message': 'Для фиксации времени необходимо создать текущий день.'})
-
-            serializer.save(time_entry=timezone.now().replace(microsecond=0), day=day)
+                serializer.save(time_entry=timezone.now().replace(microsecond=0), day_id=rfid_entry.day_id,
+                                user=rfid_entry.user)
 
     def perform_update(self, serializer):
         # Перед изменением объекта control_time мы изменяем данные об этом control_time в объекте Day
-        control_time = self.get_object()
-        print(serializer.validated_data.get('time_exit'))
+        control_time = serializer.instance
+        day = control_time.day
+
+        new_time_entry = serializer.validated_data.get('time_entry', control_time.time_entry)
+        new_time_exit = serializer.validated_data.get('time_exit', control_time.time_exit)
+        if new_time_exit is None:
+            raise exceptions.ValidationError(detail={'message': 'Укажите время выхода'})
 
-        if serializer.validated_data.get('time_exit').day() != control_time.time_exit.day() or \
-                serializer.validated_data.get('time_entry').day() != control_time.time_entry.day():
+        # Дата дня определяется по времени в UTC так же, как при фиксации метки
+        if new_time_entry.astimezone(utc).date() != day.date or new_time_exit.astimezone(utc).date() != day.date:
             raise exceptions.ValidationError(detail={
-                'message': f'Данная временная метка привязана к дате {control_time.time_exit.day()}. '
+                'message': f'Данная временная метка привязана к дате {day.date:%d.%m.%Y}. '
                            f'Укажите либо данную дату, либо выберите временную метку с интерисующей датой'})
-        else:
-            new_time_entry = serializer.validated_data.get('time_entry')
-            new_time_exit = serializer.validated_data.get('time_exit')
+        if new_time_exit < new_time_entry:
+            raise exceptions.ValidationError(detail={'message': 'Время выхода раньше времени входа'})
 
         new_time_difference = new_time_exit - new_time_entry
-
-        day = control_time.day
-        user = get_object_or_404(User, id=day.user.id)
+        profile_user = get_object_or_404(Profile, user_id=day.user_id)
 
         # Пересчитываем время переработки с учетом новых показателей
         if day.type_of_day == TypeOfDay.WORK:
-            new_overtime = overtime_calculation(new_time_entry, new_time_exit, user, day)
+            new_overtime = overtime_calculation(new_time_entry, new_time_exit, profile_user.position, day)
         else:
             new_overtime = new_time_difference
 
-        serializer.save(time_difference=new_time_difference, overtime=new_overtime)
+        # Запоминаем прежние показатели control_time, чтобы пересчитать день только на их изменение
+        old_time_difference = control_time.time_difference or datetime.timedelta(0)
+        old_overtime = control_time.overtime or datetime.timedelta(0)
 
-        # Пересчитываем показатели дня, к которому относится control_time
-        day = calculation_time_variable(day)
-        day.save()
+        with transaction.atomic():
+            serializer.save(time_difference=new_time_difference, overtime=new_overtime)
+
+            # Пересчитываем показатели дня, к которому относится control_time
+            apply_time_increment(day.id, new_time_difference - old_time_difference, new_overtime - old_overtime)
 
     def perform_destroy(self, instance):
         # Перед удалением объекта control_time мы удаляем данные об этом control_time из объекта Day
-        control_time = self.get_object()
-        control_time.delete()
+        with transaction.atomic():
+            instance.delete()
 
-        # Пересчитываем показатели дня, к которому относится control_time
-        day = calculation_time_variable(control_time.day)
-        day.save()
+            # Пересчитываем показатели дня, к которому относится control_time, вычитая показатели удаленного
+            # control_time
+            apply_time_increment(instance.day_id, -(instance.time_difference or datetime.timedelta(0)),
+                                 -(instance.overtime or datetime.timedelta(0)))
 
     def get_serializer_class(self):
         return self.action_to_serializers.get(
@@ -128,6 +151,21 @@ class ControlTimeViewSet(viewsets.ModelViewSet):
             self.serializer_class
         )
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request, *args, **kwargs):
+        """
+        Функция позволяет зафиксировать пакет RFID-меток, накопленных считывателем (например, при смене)
+
+        :return: Количество созданных и закрытых control_time и список меток, которые не удалось зафиксировать
+        """
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        # Метки обрабатываются в том порядке, в котором их передал считыватель. Код 200 возвращается даже при
+        # наличии отклоненных меток, чтобы считыватель не останавливал работу
+        return Response(record_swipes(serializer.validated_data), status=status.HTTP_200_OK)
+
 
 class ControlTimeTodayList(generics.ListAPIView):
     """
@@ -139,13 +177,9 @@ class ControlTimeTodayList(generics.ListAPIView):
     serializer_class = ControlTimeSerializer
 
     def get_queryset(self):
-        # Получаем все метки с текущей датой
-        qs = super().get_queryset().filter(time_entry__date=timezone.now().date())
-        # Берем пользователей, к которым относятся control_time, получаем максимальное время входа данных пользователей,
-        # то есть самые последнии метки.
-        return qs.filter(
-            time_entry__in=qs.values('day__user').annotate(time_entry=Max('time_entry')).values('time_entry')).order_by(
-            'time_exit')
+        # Последние метки пользователей за текущую дату хранятся в таблице присутствия (Presence)
+        return super().get_queryset().filter(presence__date=timezone.now().date()).select_related(
+            'user').order_by('time_exit')
 
 
 class ListEventsViewSet(viewsets.ModelViewSet):
@@ -168,57 +202,55 @@ class EventViewSet(viewsets.ModelViewSet):
     serializer_class = EventSerializer
 
 
-class DayViewSet(viewsets.ModelViewSet):
+class DayViewSet(QuerysetOptimizationMixin, viewsets.ModelViewSet):
     """
     Класс позволяет отображать информацию о днях
     """
 
     permission_classes = (IsPersonalOrReadOnly,)
-    queryset = Day.objects.all().order_by('-date',)
+    queryset = Day.objects.all().order_by('-date', '-id')
     serializer_class = DaySerializer
+    pagination_class = DayCursorPagination
     filterset_fields = ('user', 'date', 'type_of_day')
     action_to_serializers = {
         'create': CreateUpdateDaySerializer,
         'update': CreateUpdateDaySerializer,
         'journal': DaySerializer,
     }
+    action_to_select_related = {
+        'list': ('user', 'project'),
+        'retrieve': ('user', 'project'),
+        'update': ('user',),
+        'partial_update': ('user',),
+    }
+    action_to_prefetch_related = {
+        'list': ('event',),
+        'retrieve': ('event',),
+    }
 
-    def perform_create(self, serializer):
-        # Устанавливаем проект, который указан в профиле пользователя, если не указан в форме
-        if serializer.validated_data.get('project'):
-            user_project = serializer.validated_data.get('project')
-        else:
-            user_project = Profile.objects.get(user_id=serializer.validated_data.get('user')).project
-
-        # Автоматически устанавливаем поля plan_working_hours в зависимости от типа дня и пользователя
-        if serializer.validated_data.get('user').profile.position in (UserPosition.OPERATOR,
-                                                                      UserPosition.SENIOR_OPERATOR):
-            plan_working_hours = Times.TIME_WORK_OPERATOR
-        else:
-            plan_working_hours = Times.TIME_WORK_PERSONAL
-
-        if serializer.validated_data.get('type_of_day') in (TypeOfDay.DUTY, TypeOfDay.HOSPITAL,
-                                                            TypeOfDay.BUSINESS_TRIP, TypeOfDay.OUTPUT):
-            serializer.save(plan_working_hours=datetime.timedelta(0),
-                            project=user_project)
-
-        elif serializer.validated_data.get('type_of_day') == TypeOfDay.WORK:
-            serializer.save(plan_working_hours=plan_working_hours,
-                            project=user_project)
-
-    # Функция необходима для проверки, создан ли день на указанную дату или нет.
+    # Функция необходима для проверки, создан ли день на указанную дату или нет. День создается тем же способом,
+    # что и в задаче add_day и при фиксации RFID-меток, поэтому одновременное создание не приводит к дублям
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        day = Day.objects.filter(user_id=serializer.validated_data.get('user'),
-                                 date=serializer.validated_data.get('date')).first()
-        if day:
+        user = serializer.validated_data.get('user')
+
+        defaults = {'type_of_day': serializer.validated_data.get('type_of_day')}
+        # Устанавливаем проект, который указан в форме, иначе будет установлен проект из профиля пользователя
+        if serializer.validated_data.get('project'):
+            defaults['project_id'] = serializer.validated_data.get('project').id
+
+        day, created = get_or_create_day(user, serializer.validated_data.get('date'), **defaults)
+        if not created:
             return Response(status=status.HTTP_400_BAD_REQUEST,
                             data={'message': 'День на указанную дату уже создан. Удалите его или отредактируйте'})
-        else:
-            self.perform_create(serializer)
-            headers = self.get_success_headers(serializer.data)
-            return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+        if serializer.validated_data.get('event'):
+            day.event.set(serializer.validated_data.get('event'))
+
+        serializer = self.get_serializer(day)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def perform_update(self, serializer):
         day = self.get_object()
@@ -236,8 +268,14 @@ class DayViewSet(viewsets.ModelViewSet):
                 day.type_of_day = TypeOfDay.WORK
                 day = calculation_time_variable(day)
 
-        day.save()
-        serializer.save()
+        # При изменении даты на дату, на которую у пользователя уже есть день, срабатывает ограничение (user, date)
+        try:
+            with transaction.atomic():
+                day.save()
+                serializer.save()
+        except IntegrityError:
+            raise exceptions.ValidationError(detail={
+                'message': 'День на указанную дату уже создан. Удалите его или отредактируйте'})
 
     def get_serializer_class(self):
         return self.action_to_serializers.get(
@@ -250,35 +288,21 @@ class DayViewSet(viewsets.ModelViewSet):
         """
         Функия необходима для формирования журнала дежурств, тот который ТБ в лаборатории
 
-        :return: Файл для скачивания журнала дежурств
+        :return: Номер задачи формирования журнала дежурств (или файл для скачивания, если указан download)
         """
 
-        # Список для всех пользователй, которые пришли в лабораторию
-        list_user = []
-        # ПОлучам дни рабочих дней оператора на текущую дату
-        days = Day.objects.filter(user__profile__position__in=(UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR),
-                                  date=timezone.now().date(),
-                                  type_of_day=TypeOfDay.WORK)
-        # Функция для создания макета документа
-        document_name = f'visit_log-{timezone.now().strftime("%Y-%m-%d")}.docx'
-        journal(document_name)
-
-        # Формируем список операторов, которые пришли в лабораторию
-        for day in days:
-            user = day.user
-            # Функция для добавления в ранее созданный документ инфомрации о пользователях
-            list_user.append([timezone.now().date().strftime("%Y-%m-%d"),
-                              user.profile.get_rank_display(),
-                              user.profile.get_position_display(),
-                              user.get_full_name()])
-        event_statistic(list_user, document_name)
-
-        # Добавляет в бд инфомрацию о сформированном файле
-        file_repository, _ = FileRepository.objects.get_or_create(
-            name=document_name,
-            defaults={'file': f'docs/{document_name}'})
-
-        return Response({'url': file_repository.file.url})
+        date = timezone.now().date()
+        document_name = report_name('visit_log', date=date)
+
+        file_repository = cached_report(document_name)
+        if file_repository:
+            return report_file_response(request, file_repository)
+
+        # Журнал небольшой, поэтому по параметру download формируется сразу в ответе
+        if request.query_params.get('download'):
+            return journal(journal_users(date)).response(document_name)
+
+        return report_job_response(journal_report.delay(document_name, date.isoformat()))
 
 
 class ScheduleDutyViewSet(viewsets.ModelViewSet):
@@ -302,10 +326,6 @@ class ScheduleDutyViewSet(viewsets.ModelViewSet):
         :return: Автоматически сформированный список дежурств по лаборатории
         """
 
-        # Переменная для запоминания id тех, кто уже подежурил.
-        remember_count_duty = []
-        # Переменная для создания конечного графика.
-        schedule_list = []
         # Получаем очередь дежурства.
         try:
             priority_duty = OrderOfDuty.load()
@@ -315,120 +335,33 @@ class ScheduleDutyViewSet(viewsets.ModelViewSet):
                                                          'номер и год призыва. Для указания дежурного призыва '
                                                          'обратитесь к администратуру.'})
 
-        number_appeal = priority_duty.number_appeal
-
         # Создаем график на количество пользователей.
-        for days_week in range(0, len(User.objects.all())):
+        scheduler = DutyScheduler(priority_duty, timezone.now().date(), User.objects.count())
+        scheduler.load()
+        scheduler.solve()
+        scheduler.save()
 
-            # Получаем дату, с учетом итерации цикла.
-            date_days_week = timezone.now().date() + datetime.timedelta(days=days_week)
-
-            # Если в графике уже есть запись на дату, которая попала в цикл, то пропускаем данную дату
-            if ScheduleDuty.objects.filter(date=date_days_week).first():
-                continue
-
-            # Если выходной день пропускаем
-            elif date_days_week.weekday() in (5, 6):
-                continue
-
-            else:
-                qs_profile = Profile.objects.filter(number_appeal=number_appeal).exclude(
-                    status=UserStatus.DEMOB).order_by('user__last_name')
-                # Узнаем максимальное и минимальное количество нарядов у операторов дежурного призыва.
-                max_count_duty = qs_profile.aggregate(max=Max('count_duty'))['max']
-                min_count_duty = qs_profile.aggregate(min=Min('count_duty'))['min']
-
-                # Получаем всех пользователей, которые не входят в список тех, кто уже подежурил
-                users_yes_duty = list(qs_profile.exclude(user_id__in=set(remember_count_duty)).values('user_id'))
-
-                # Получаем всех пользователей на текущую дату, кто не может дежурить (госпиталь, командировка и другое)
-                users_not_duty = list(qs_profile.filter(user__days__date=date_days_week).exclude(
-                    user__days__type_of_day=TypeOfDay.WORK).values('user_id').distinct())
-
-                # Проверяем совпадает ли список тех кто не дежурил с теми кто не может дежурить или с пустым списком
-                # (то есть все дежурили) если совпадает, то меняем приоритет призыва для дежурства.
-
-                if users_yes_duty in (users_not_duty, []):
-                    # Вызываем функцию, которая изменяет приоритет дежурства
-                    change_appeal(priority_duty)
-                    # Сохраняем приоритет, обновляем переменную, которая отвечает за информацию о призыве,
-                    # обновляем переменную, отвечающую за запоминание id тех, кто уже подежурил
-                    priority_duty.save()
-                    number_appeal = priority_duty.number_appeal
-                    remember_count_duty = []
-                    # Снова формируем запрос на профили новых пользователей
-                    qs_profile = Profile.objects.filter(number_appeal=number_appeal).exclude(
-                        status=UserStatus.DEMOB).order_by('user__last_name')
-
-                # Проверяем у всех ли в призыве равное количество нарядов и в списке дежурств пусто.
-                # Если равно и пусто, то мы берем первого пользователя, который присуствует в лаборатории,
-                # предварительно отсортировав по алфавиту.
-                if max_count_duty == min_count_duty:
-
-                    if not remember_count_duty:
-                        # Получаем профиль первого пользователя
-                        profile_user = qs_profile.first()
-
-                        schedule_list.append(ScheduleDuty(
-                            user_id=profile_user.user.id,
-                            date=date_days_week,
-                        ))
-                        # Изменяем количество нарядов в профиле пользователя
-                        profile_user.count_duty += 1
-                        profile_user.save()
-                        # Формируем список подежуривших пользователей
-                        remember_count_duty.append(profile_user.user.id)
-
-                    # Если количество нарядов равное список дежурств не пустой, то изменяем приоритет дежурства
-                    # Проверка количества отдежуривших с списке remember_count_duty необходима для того,
-                    # чтобы не получилось так, что у 1 человека нарядов меньше чем у остальных, он 1 раз отдежурит и
-                    # приоритет дежурства поменяется. Это условие сделет так, что он подежурит и его призыв также
-                    # дальше пойдет дежурить
-
-                    elif remember_count_duty and len(remember_count_duty) > 2:
-                        change_appeal(priority_duty)
-                        # Сохраняем приоритет, обновляем переменную, которая отвечает за информацию о призыву,
-                        # обновляем переменную, отвечающую за запоминание id тех, кто уже подежурил
-                        priority_duty.save()
-                        number_appeal = priority_duty.number_appeal
-                        remember_count_duty = []
-
-                # Если количество нарядов не равное
-                elif max_count_duty != min_count_duty:
-                    # Ищем пользователя, у котороторого количетсво нарядов минимально
-                    profile_user = qs_profile.filter(count_duty=min_count_duty).first()
-
-                    schedule_list.append(ScheduleDuty(
-                        user_id=profile_user.user_id,
-                        date=date_days_week,
-                    ))
-
-                    profile_user.count_duty += 1
-                    profile_user.save()
-                    # Формируем список подежуривших пользователей
-                    remember_count_duty.append(profile_user.user_id)
-
-        ScheduleDuty.objects.bulk_create(schedule_list)
         serializer = self.get_serializer(ScheduleDuty.objects.all(), many=True)
         return Response(serializer.data)
 
     def perform_create(self, serializer):
-        schedule_duty = ScheduleDuty.objects.filter(date=serializer.validated_data.get('date')).first()
-        if schedule_duty:
-            profile_user = Profile.objects.filter(user_id=schedule_duty.user.id).first()
-            profile_user.count_duty += 1
-            profile_user.save()
-        serializer.save()
+        # Количество нарядов изменяется атомарно в одной транзакции с сохранением дежурства
+        with transaction.atomic():
+            duty_user_id = ScheduleDuty.objects.filter(
+                date=serializer.validated_data.get('date')).values_list('user_id', flat=True).first()
+            if duty_user_id:
+                change_count_duty({duty_user_id: 1})
+            serializer.save()
 
     def perform_update(self, serializer):
-        schedule_duty = ScheduleDuty.objects.filter(date=serializer.validated_data.get('date')).first()
-        if schedule_duty:
-            profile_old_user = Profile.objects.filter(user_id=schedule_duty.user.id).first()
-            profile_old_user.count_duty -= 1
-            profile_old_user.save()
-
-            profile_new_user = Profile.objects.filter(user_id=serializer.validated_data.get('user')).first()
-            profile_new_user.count_duty += 1
-            profile_new_user.save()
-
-        serializer.save()
+        # При частичном изменении (PATCH) не указанные дата и пользователь берутся из дежурства
+        date = serializer.validated_data.get('date', serializer.instance.date)
+        with transaction.atomic():
+            duty_user_id = ScheduleDuty.objects.filter(date=date).values_list('user_id', flat=True).first()
+            if duty_user_id:
+                new_user = serializer.validated_data.get('user', serializer.instance.user)
+                increments = {duty_user_id: -1}
+                increments[new_user.id] = increments.get(new_user.id, 0) + 1
+                change_count_duty(increments)
+
+            serializer.save()
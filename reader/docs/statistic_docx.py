@@ -1,160 +1,378 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+
 from django.conf import settings
-from django.core.files import File
+from django.db.models import Max, Count
+from django.http import FileResponse
+from django.utils import timezone
 from docx import Document
 from docx.enum.section import WD_ORIENTATION
-from datetime import datetime
+from rest_framework import status
+from rest_framework.response import Response
 
-from accountBd.models import Profile, User, FileRepository, Project
+from accountBd.models import FileRepository, User, Profile, Project
+from readerBd.models import Day
 
+# Каталог, в котором сохраняются сформированные отчеты. Путь не зависит от текущего каталога процесса,
+# так как отчеты формируются и в задачах celery
+REPORTS_PATH = os.path.join(settings.MEDIA_ROOT, 'docs')
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+# Файлы без записи в FileRepository младше этого возраста не удаляются: запись отчета может еще сохраняться
+ORPHAN_REPORT_AGE = datetime.timedelta(minutes=10)
 
-def journal(document_name):
-    """
-    Функция для создания шаблона документа для инструктожа
 
-    :return: Шаблон документа для инструктажа
+def percent(value, total):
+    """
+    Функция возвращает процентное отношение промежутков времени, если общее время не указано, то 0
     """
 
-    document = Document()
+    if not value or not total:
+        return 0
+    return value / total * 100
 
-    # Для альбомногй ориентации
-    section = document.sections[-1]
-    new_width, new_height = section.page_height, section.page_width
-    section.orientation = WD_ORIENTATION.LANDSCAPE
-    section.page_width = new_width
-    section.page_height = new_height
-    document.add_heading('Список личного состава', 0)
 
-    table = document.add_table(rows=1, cols=7)
-    table.style = 'Table Grid'
+class ReportBuilder:
+    """
+    Класс формирует документ .docx. Все разделы добавляются в один открытый документ, который сохраняется
+    один раз в файл (save_report) или в память для отправки в ответе (response)
+    """
+
+    def __init__(self):
+        self.document = Document()
 
-    c = table.rows[0].cells
-    c[0].text = 'Дата'
-    c[1].text = 'Должность и звание'
-    c[2].text = 'ФИО'
-    c[3].text = 'Вид инструктажа'
-    c[4].text = 'Подпись инструктирующего'
-    c[5].text = 'Подпись инструктируемого'
-    c[6].text = 'Примечание'
+    def add_journal_header(self):
+        """
+        Метод создает шаблон документа для инструктажа
+        """
 
-    document.save(f'media/docs/{document_name}')
+        # Для альбомногй ориентации
+        section = self.document.sections[-1]
+        new_width, new_height = section.page_height, section.page_width
+        section.orientation = WD_ORIENTATION.LANDSCAPE
+        section.page_width = new_width
+        section.page_height = new_height
+        self.document.add_heading('Список личного состава', 0)
 
+        table = self.document.add_table(rows=1, cols=7)
+        table.style = 'Table Grid'
 
-def event_statistic(list_user, document_name):
+        c = table.rows[0].cells
+        c[0].text = 'Дата'
+        c[1].text = 'Должность и звание'
+        c[2].text = 'ФИО'
+        c[3].text = 'Вид инструктажа'
+        c[4].text = 'Подпись инструктирующего'
+        c[5].text = 'Подпись инструктируемого'
+        c[6].text = 'Примечание'
+
+    def add_journal_rows(self, list_user):
+        """
+        Метод для внесения записей в журнал
+
+        :param list_user: Список с пользователями (дата, звание, должность, ФИО)
+        """
+
+        for user in list_user:
+            table = self.document.add_table(rows=1, cols=7)
+            table.style = 'Table Grid'
+            c = table.rows[0].cells
+            c[0].text = f'{user[0]}'
+            c[1].text = f'{user[1]}\n{user[2]}'
+            c[2].text = f'{user[3]}'
+            c[3].text = 'целевой'
+            c[4].text = ''
+            c[5].text = ''
+            c[6].text = ''
+
+    def add_user_section(self, time_schedule, time_work, real_overtime,
+                         time_of_respectful_absence_fact, time_of_not_respectful_absence_fact,
+                         percent_time_work, percent_time_of_respectful_absence,
+                         percent_time_of_not_respectful_absence,
+                         position, rank, full_name, project):
+        """
+        Метод добавляет сводный отчет по одному оператору
+
+        :param time_schedule: Время работы по графику (плану)
+        :param time_work: Реальное время работы
+        :param real_overtime: Время переработок
+        :param time_of_respectful_absence_fact: Уважительное время отсутствия
+        :param time_of_not_respectful_absence_fact: Не уважительное время отсутствия
+        :param percent_time_work: Процент рабочего времени
+        :param percent_time_of_respectful_absence: Процент уважительного отсутствия
+        :param percent_time_of_not_respectful_absence: Процент не уважительного отсутствия
+        :param position: Должность оператора
+        :param rank: Звание оператора
+        :param full_name: Полное имя оператора
+        :param project: Проект за которым закреплен оператор
+        """
+
+        self.document.add_paragraph(
+            f'Отчет по деятельности: {str(position).lower()} {str(rank).lower()} {full_name}\n\n', style='Heading 1')
+
+        self._add_statistic_table(time_schedule, time_work, real_overtime,
+                                  time_of_respectful_absence_fact, time_of_not_respectful_absence_fact,
+                                  percent_time_work, percent_time_of_respectful_absence,
+                                  percent_time_of_not_respectful_absence)
+
+        self.document.add_paragraph(f'\n\n{position} {full_name} находится на проекте {project}')
+
+        # Разрыв старницы
+        self.document.add_page_break()
+
+    def add_project_section(self, time_schedule, time_work, real_overtime,
+                            time_of_respectful_absence_fact, time_of_not_respectful_absence_fact,
+                            percent_time_work, percent_time_of_respectful_absence,
+                            percent_time_of_not_respectful_absence,
+                            name, full_names):
+        """
+        Метод добавляет сводный отчет по одному проекту
+
+        :param time_schedule: Время работы по графику (плану)
+        :param time_work: Реальное время работы
+        :param real_overtime: Время переработок
+        :param time_of_respectful_absence_fact: Уважительное время отсутствия
+        :param time_of_not_respectful_absence_fact: Не уважительное время отсутствия
+        :param percent_time_work: Процент рабочего времени
+        :param percent_time_of_respectful_absence: Процент уважительного отсутствия
+        :param percent_time_of_not_respectful_absence: Процент не уважительного отсутствия
+        :param name: Название проекта
+        :param full_names: Список ФИО операторов, которые закреплены за проектом
+        """
+
+        self.document.add_paragraph(f'Отчет по проекту: {str(name)}\n\n', style='Heading 1')
+        self.document.add_paragraph(f'Операторы, которые закреплены за проектом: {", ".join(full_names)}\n\n',
+                                    style='Heading 1')
+
+        self._add_statistic_table(time_schedule, time_work, real_overtime,
+                                  time_of_respectful_absence_fact, time_of_not_respectful_absence_fact,
+                                  percent_time_work, percent_time_of_respectful_absence,
+                                  percent_time_of_not_respectful_absence)
+
+        # Разрыв старницы
+        self.document.add_page_break()
+
+    def _add_statistic_table(self, time_schedule, time_work, real_overtime,
+                             time_of_respectful_absence_fact, time_of_not_respectful_absence_fact,
+                             percent_time_work, percent_time_of_respectful_absence,
+                             percent_time_of_not_respectful_absence):
+        table = self.document.add_table(rows=1, cols=2)
+        table.style = 'Medium List 1 Accent 1'
+
+        hdr_cells = table.rows[0].cells
+        hdr_cells[0].text = 'Название показателя'
+        hdr_cells[1].text = 'Данные'
+
+        for title, value in (
+                ('Время работы по плану ', time_schedule),
+                ('Время фактической работы ', time_work),
+                ('Время фактической переработки ', real_overtime),
+                ('Время фактических уважительных прогулов ', time_of_respectful_absence_fact),
+                ('Время фактических не уважительных прогулов ', time_of_not_respectful_absence_fact),
+                ('Процент фактической работы в общем количестве времени ', percent_time_work),
+                ('Процент уважительных прогулов в общем количестве времени ', percent_time_of_respectful_absence),
+                ('Процент не уважительных прогулов в общем количестве времени ',
+                 percent_time_of_not_respectful_absence)):
+            row_cells = table.add_row().cells
+            row_cells[0].text = title
+            row_cells[1].text = str(value)
+
+    def save(self, file):
+        """
+        Метод сохраняет документ
+
+        :param file: Путь к файлу или файловый объект
+        """
+
+        self.document.save(file)
+
+    def to_buffer(self):
+        """
+        Метод сохраняет документ в память
+
+        :return: Возвращает io.BytesIO с документом, позиция установлена на начало
+        """
+
+        buffer = io.BytesIO()
+        self.save(buffer)
+        buffer.seek(0)
+        return buffer
+
+    def save_report(self, document_name):
+        """
+        Метод сохраняет документ в каталог отчетов и добавляет в БД информацию о сформированном файле
+
+        :param document_name: Название документа
+        :return: Возвращает объект FileRepository
+        """
+
+        os.makedirs(REPORTS_PATH, exist_ok=True)
+        self.save(os.path.join(REPORTS_PATH, document_name))
+        # Время создания обновляется, так как файл мог быть удален при очистке и сформирован заново
+        file_repository, _ = FileRepository.objects.update_or_create(
+            name=document_name,
+            defaults={'file': f'docs/{document_name}', 'created_at': timezone.now()})
+        return file_repository
+
+    def response(self, document_name):
+        """
+        Метод формирует ответ с документом для скачивания без сохранения на диск
+
+        :param document_name: Название документа
+        """
+
+        return FileResponse(self.to_buffer(), as_attachment=True, filename=document_name,
+                            content_type=DOCX_CONTENT_TYPE)
+
+
+def data_version(date_from=None, date_to=None):
     """
-    Функция для внесения записей в журнал
+    Функция возвращает версию данных, по которым формируется отчет за период: время последнего изменения
+    и количество дней периода (количество меняется при удалении), а также время последнего изменения пользователей,
+    профилей и проектов. Показатели control_time сохраняются в дни, поэтому метки меняют версию, только если
+    изменяют показатели дней периода. Все поля времени изменения индексированы
 
-    :param list_user: Список с пользователями
-    :param document_name: Название файла
-    :return: Добавляет список пользоваетелй в таблицу, которая создается в функции journal()
+    :param date_from: Начальная дата периода (None - без ограничения)
+    :param date_to: Конечная дата периода (None - без ограничения)
     """
 
-    document = Document(f'media/docs/{document_name}')
+    days = Day.objects.all()
+    if date_from:
+        days = days.filter(date__gte=date_from)
+    if date_to:
+        days = days.filter(date__lte=date_to)
 
-    for user in list_user:
-        table = document.add_table(rows=1, cols=7)
-        table.style = 'Table Grid'
-        c = table.rows[0].cells
-        c[0].text = f'{user[0]}'
-        c[1].text = f'{user[1]}\n{user[2]}'
-        c[2].text = f'{user[3]}'
-        c[3].text = 'целевой'
-        c[4].text = ''
-        c[5].text = ''
-        c[6].text = ''
-
-    document.save(f'media/docs/{document_name}')
-
-
-def user_statistic(time_schedule, time_work, real_overtime,
-                   time_of_respectful_absence_fact, time_of_not_respectful_absence_fact,
-                   percent_time_work, percent_time_of_respectful_absence,
-                   percent_time_of_not_respectful_absence,
-                   position, rank, full_name, project, document_name):
+    version = [list(days.aggregate(updated_at=Max('updated_at'), count=Count('id')).values())]
+    for model in (User, Profile, Project):
+        version.append(model.objects.aggregate(updated_at=Max('updated_at'))['updated_at'])
+    return version
+
+
+def report_name(report_type, **params):
     """
-    Функция формирует сводный отчет по одному оператору
-
-    :param time_schedule: Время работы по графику (плану)
-    :param time_work: Реальное время работы
-    :param real_overtime: Время переработок
-    :param time_of_respectful_absence_fact: Уважительное время отсутствия
-    :param time_of_not_respectful_absence_fact: Не уважительное время отсутствия
-    :param percent_time_work: Процент рабочего времени
-    :param percent_time_of_respectful_absence: Процент уважительного отсутствия
-    :param percent_time_of_not_respectful_absence: Процент не уважительного отсутствия
-    :param position: Должность оператора
-    :param rank: Звание оператора
-    :param full_name: Полное имя оператора
-    :param project: Проект за которым закреплен оператор
-    :param document_name: Название докмуента куда сохранять информацию
+    Функция возвращает название отчета по хэшу типа отчета, параметров (фильтров и периода) и версии данных.
+    Пока данные не изменились, одинаковые запросы получают один и тот же уже сформированный отчет
+
+    :param report_type: Тип отчета (например, users_statistic)
+    :param params: Параметры отчета, значения должны сериализоваться в json (даты - в формате YYYY-MM-DD)
     """
 
-    document = Document(f'media/docs/{document_name}')
-    document.add_paragraph(f'Отчет по деятельности: {str(position).lower()} {str(rank).lower()} {full_name}\n\n',
-                           style='Heading 1')
+    # Версия данных берется за период отчета (отчеты за дату, например журнал, строятся по дням этой даты)
+    version = data_version(params.get('date_from', params.get('date')), params.get('date_to', params.get('date')))
+    key = json.dumps([report_type, params, version], sort_keys=True, default=str)
+    return f'{report_type}-{hashlib.sha256(key.encode()).hexdigest()[:32]}.docx'
 
-    table = document.add_table(rows=1, cols=2)
 
-    table.style = 'Medium List 1 Accent 1'
+def cached_report(document_name):
+    """
+    Функция возвращает объект FileRepository уже сформированного отчета, если файл отчета существует
 
-    hdr_cells = table.rows[0].cells
-    hdr_cells[0].text = 'Название показателя'
-    hdr_cells[1].text = 'Данные'
+    :param document_name: Название документа
+    """
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время работы по плану '
-    row_cells[1].text = str(time_schedule)
+    file_repository = FileRepository.objects.filter(name=document_name).first()
+    if file_repository and os.path.exists(os.path.join(REPORTS_PATH, document_name)):
+        return file_repository
+    return None
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактической работы '
-    row_cells[1].text = str(time_work)
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактической переработки '
-    row_cells[1].text = str(real_overtime)
+def report_file_response(request, file_repository):
+    """
+    Функция возвращает ответ со сформированным отчетом: путь на скачивание или файл, если указан параметр download
+    """
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактических уважительных прогулов '
-    row_cells[1].text = str(time_of_respectful_absence_fact)
+    if request.query_params.get('download'):
+        return FileResponse(file_repository.file.open('rb'), as_attachment=True, filename=file_repository.name,
+                            content_type=DOCX_CONTENT_TYPE)
+    return Response({'status': 'SUCCESS', 'url': file_repository.file.url})
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактических не уважительных прогулов '
-    row_cells[1].text = str(time_of_not_respectful_absence_fact)
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Процент фактической работы в общем количестве времени '
-    row_cells[1].text = str(percent_time_work)
+def evict_reports(max_age=None, max_size=None):
+    """
+    Функция удаляет старые отчеты: сформированные раньше max_age назад, а затем самые старые, пока общий
+    размер отчетов превышает max_size. Удаляются и файлы каталога отчетов, которых нет в FileRepository
+    (старше ORPHAN_REPORT_AGE)
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Процент уважительных прогулов в общем количестве времени '
-    row_cells[1].text = str(percent_time_of_respectful_absence)
+    :param max_age: Максимальный возраст отчета (timedelta), по умолчанию settings.REPORTS_MAX_AGE_DAYS
+    :param max_size: Максимальный общий размер отчетов в байтах, по умолчанию settings.REPORTS_MAX_SIZE_MB
+    :return: Количество удаленных файлов
+    """
 
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Процент не уважительных прогулов в общем количестве времени '
-    row_cells[1].text = str(percent_time_of_not_respectful_absence)
+    if max_age is None:
+        max_age = datetime.timedelta(days=settings.REPORTS_MAX_AGE_DAYS)
+    if max_size is None:
+        max_size = settings.REPORTS_MAX_SIZE_MB * 1024 * 1024
+    if not os.path.isdir(REPORTS_PATH):
+        return 0
+
+    # Отчет может сохраняться одновременно с очисткой: сначала записывается файл, затем запись в FileRepository.
+    # Поэтому удаляются только записи, созданные до начала очистки, и файлы без записей старше ORPHAN_REPORT_AGE
+    started = timezone.now()
+    files = {entry.name: entry.stat() for entry in os.scandir(REPORTS_PATH) if entry.is_file()}
+    reports = list(FileRepository.objects.filter(name__in=files).order_by('created_at').values_list(
+        'name', 'created_at'))
+    known = {name for name, _ in reports}
+
+    # Файлы без записи в FileRepository удаляются в первую очередь
+    orphan_before = (started - ORPHAN_REPORT_AGE).timestamp()
+    evict = [name for name, stat in files.items() if name not in known and stat.st_mtime < orphan_before]
+    total_size = sum(stat.st_size for name, stat in files.items() if name in known)
+    created_from = started - max_age
+    for name, created_at in reports:
+        if created_at < started and (created_at < created_from or total_size > max_size):
+            evict.append(name)
+            total_size -= files[name].st_size
+
+    for name in evict:
+        try:
+            os.remove(os.path.join(REPORTS_PATH, name))
+        except FileNotFoundError:
+            pass
+    # Записи удаляются вместе с файлами, а также записи, файлов которых уже нет
+    FileRepository.objects.filter(name__in=evict, created_at__lt=started).delete()
+    FileRepository.objects.filter(file__startswith='docs/', created_at__lt=started).exclude(name__in=files).delete()
+    return len(evict)
+
+
+def report_job_response(result):
+    """
+    Функция возвращает ответ с номером задачи формирования отчета. Состояние задачи и путь на скачивание
+    готового отчета можно получить по адресу reports/<job_id>/
+
+    :param result: Результат запуска задачи celery (AsyncResult)
+    """
 
-    document.add_paragraph(f'\n\n{position} {full_name} находится на проекте {project}')
+    return Response({'job_id': result.id}, status=status.HTTP_202_ACCEPTED)
 
-    # Разрыв старницы
-    document.add_page_break()
 
-    document.save(f'media/docs/{document_name}')
+def journal(list_user):
+    """
+    Функция формирует журнал инструктажа
+
+    :param list_user: Список с пользователями (дата, звание, должность, ФИО)
+    :return: Возвращает ReportBuilder с документом
+    """
+
+    builder = ReportBuilder()
+    builder.add_journal_header()
+    builder.add_journal_rows(list_user)
+    return builder
 
 
 # Функция для получения docx файла по одному пользователю
-def user_statistic_report(serializer, user_id, document_name):
+def user_statistic_report(serializer, profile):
     """
-    Функция позволяет привести данные к необходимому формату и пересать в функцию
-     по формированию документа по одному пользователю.
+    Функция позволяет привести данные к необходимому формату и сформировать документ по одному пользователю.
 
     :param serializer: Получаем все данные из сериализатора
-    :param user_id: id пользователя по которому необходима статистика
-    :param document_name: Название документа
+    :param profile: Профиль пользователя по которому необходима статистика
+    :return: Возвращает ReportBuilder с документом
     """
 
-    document = Document()
-    document.save(f'media/docs/{document_name}')
-
-    user_statistic(
+    builder = ReportBuilder()
+    builder.add_user_section(
         serializer['time_schedule'],
         serializer['time_work'],
         serializer['real_overtime'],
@@ -163,142 +381,54 @@ def user_statistic_report(serializer, user_id, document_name):
         serializer['percent_time_work'],
         serializer['percent_time_of_respectful_absence'],
         serializer['percent_time_of_not_respectful_absence'],
-        Profile.objects.get(user_id=user_id).get_position_display(),
-        Profile.objects.get(user_id=user_id).get_rank_display(),
+        profile.get_position_display(),
+        profile.get_rank_display(),
         serializer['full_name'],
-        serializer['project'], document_name
+        serializer['project'],
     )
+    return builder
 
 
 # Функция для получения docx файла по всем пользователям
-def all_users_statistic_report(queryset, document_name):
+def all_users_statistic_report(queryset):
     """
-    Функция отправляет обработанную информацию в функцию,
-    которая формрует сводный отчет по всем операторам
+    Функция формирует сводный отчет по всем операторам в одном документе
 
     :param queryset: Получаем queryset, который содержит всех операторов
-    :param document_name: Получаем название документа, куда необходимо сохранить отчет
+    :return: Возвращает ReportBuilder с документом
     """
 
-    document = Document()
-    document.save(f'media/docs/{document_name}')
-    profiles = list(queryset)
+    builder = ReportBuilder()
 
-    for profile in profiles:
-        user_statistic(
+    for profile in queryset:
+        builder.add_user_section(
             profile.time_schedule,
             profile.time_work,
             profile.real_overtime,
             profile.time_of_respectful_absence_fact,
             profile.time_of_not_respectful_absence_fact,
-            profile.time_work / profile.time_schedule * 100,
-            profile.time_of_respectful_absence_fact / profile.time_schedule * 100,
-            profile.time_of_not_respectful_absence_fact / profile.time_schedule * 100,
+            percent(profile.time_work, profile.time_schedule),
+            percent(profile.time_of_respectful_absence_fact, profile.time_schedule),
+            percent(profile.time_of_not_respectful_absence_fact, profile.time_schedule),
             profile.get_position_display(),
             profile.get_rank_display(),
             profile.user.get_full_name(),
             profile.project,
-            document_name
         )
-
-
-def project_statistic(time_schedule, time_work, real_overtime,
-                      time_of_respectful_absence_fact, time_of_not_respectful_absence_fact,
-                      percent_time_work, percent_time_of_respectful_absence,
-                      percent_time_of_not_respectful_absence,
-                      name, profiles, document_name):
-    """
-    Функция формирует сводный отчет по одному оператору
-
-    :param time_schedule: Время работы по графику (плану)
-    :param time_work: Реальное время работы
-    :param real_overtime: Время переработок
-    :param time_of_respectful_absence_fact: Уважительное время отсутствия
-    :param time_of_not_respectful_absence_fact: Не уважительное время отсутствия
-    :param percent_time_work: Процент рабочего времени
-    :param percent_time_of_respectful_absence: Процент уважительного отсутствия
-    :param percent_time_of_not_respectful_absence: Процент не уважительного отсутствия
-    :param name: Название проекта
-    :param profiles: Сисок профилей пользователя
-    :param document_name: Название докмуента куда сохранять информацию
-    """
-
-    # Переменная для запоминания всех ФИО операторов.
-    str_users = ''
-    document = Document(f'media/docs/{document_name}')
-    document.add_paragraph(f'Отчет по проекту: {str(name)}\n\n',
-                           style='Heading 1')
-
-    if type(profiles) is list:
-        for profile in profiles:
-            str_users += profile['full_name'] + ', '
-    else:
-        for profile in profiles:
-            str_users += profile.user.get_full_name() + ', '
-
-    document.add_paragraph(f'Операторы, которые закреплены за проектом: {str_users[:-2]}\n\n',
-                           style='Heading 1')
-
-    table = document.add_table(rows=1, cols=2)
-
-    table.style = 'Medium List 1 Accent 1'
-
-    hdr_cells = table.rows[0].cells
-    hdr_cells[0].text = 'Название показателя'
-    hdr_cells[1].text = 'Данные'
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время работы по плану '
-    row_cells[1].text = str(time_schedule)
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактической работы '
-    row_cells[1].text = str(time_work)
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактической переработки '
-    row_cells[1].text = str(real_overtime)
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактических уважительных прогулов '
-    row_cells[1].text = str(time_of_respectful_absence_fact)
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Время фактических не уважительных прогулов '
-    row_cells[1].text = str(time_of_not_respectful_absence_fact)
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Процент фактической работы в общем количестве времени '
-    row_cells[1].text = str(percent_time_work)
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Процент уважительных прогулов в общем количестве времени '
-    row_cells[1].text = str(percent_time_of_respectful_absence)
-
-    row_cells = table.add_row().cells
-    row_cells[0].text = 'Процент не уважительных прогулов в общем количестве времени '
-    row_cells[1].text = str(percent_time_of_not_respectful_absence)
-
-    # Разрыв старницы
-    document.add_page_break()
-
-    document.save(f'media/docs/{document_name}')
+    return builder
 
 
 # Функция для получения docx файла по одному проекту
-def project_statistic_report(serializer, document_name):
+def project_statistic_report(serializer):
     """
-    Функция позволяет привести данные к необходимому формату и пересать в функцию
-    по формированию документа по одному проекту.
+    Функция позволяет привести данные к необходимому формату и сформировать документ по одному проекту.
 
     :param serializer: Получаем все данные из сериализатора
-    :param document_name: Название документа
+    :return: Возвращает ReportBuilder с документом
     """
 
-    document = Document()
-    document.save(f'media/docs/{document_name}')
-
-    project_statistic(
+    builder = ReportBuilder()
+    builder.add_project_section(
         serializer['time_schedule'],
         serializer['time_work'],
         serializer['real_overtime'],
@@ -308,36 +438,33 @@ def project_statistic_report(serializer, document_name):
         serializer['percent_time_of_respectful_absence'],
         serializer['percent_time_of_not_respectful_absence'],
         serializer['name'],
-        serializer['profiles'],
-        document_name
+        [profile['full_name'] for profile in serializer['profiles']],
     )
+    return builder
 
 
 # Функция для получения docx файла по всем проектамм
-def projects_statistic_report(queryset, document_name):
+def projects_statistic_report(queryset):
     """
-    Функция отправляет обработанную информацию в функцию,
-    которая формрует сводный отчет по всем проектам
+    Функция формирует сводный отчет по всем проектам в одном документе
 
     :param queryset: Получаем queryset, который содержит все проекты
-    :param document_name: Получаем название документа, куда необходимо сохранить отчет
+    :return: Возвращает ReportBuilder с документом
     """
 
-    document = Document()
-    document.save(f'media/docs/{document_name}')
-    projects = list(queryset)
+    builder = ReportBuilder()
 
-    for project in projects:
-        project_statistic(
+    for project in queryset:
+        builder.add_project_section(
             project.time_schedule,
             project.time_work,
             project.real_overtime,
             project.time_of_respectful_absence_fact,
             project.time_of_not_respectful_absence_fact,
-            project.time_work / project.time_schedule * 100,
-            project.time_of_respectful_absence_fact / project.time_schedule * 100,
-            project.time_of_not_respectful_absence_fact / project.time_schedule * 100,
+            percent(project.time_work, project.time_schedule),
+            percent(project.time_of_respectful_absence_fact, project.time_schedule),
+            percent(project.time_of_not_respectful_absence_fact, project.time_schedule),
             project.name,
-            project.profiles.all(),
-            document_name
+            [profile.user.get_full_name() for profile in project.profiles.all()],
         )
+    return builder
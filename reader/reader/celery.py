@@ -30,4 +30,12 @@ app.conf.beat_schedule = {
         'task': 'readerBd.tasks.recalculation_day',
         'schedule': crontab(hour=23, minute=50),
     },
+    'rebuild_month_statistics': {
+        'task': 'readerBd.tasks.rebuild_month_statistics',
+        'schedule': crontab(hour=0, minute=30, day_of_month=1),
+    },
+    'evict_reports': {
+        'task': 'accountBd.tasks.evict_reports',
+        'schedule': crontab(hour=1, minute=0),
+    },
 }
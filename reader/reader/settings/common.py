@@ -26,7 +26,11 @@ env = environ.Env(
     CORS_ALLOW_ALL_ORIGINS=(bool, True),
     WEB_SOCKET_SERVER_URL=(str, 'ws://127.0.0.1:9000/'),
     REDIS_HOST=(str, '127.0.0.1'),
-    REDIS_PORT=(int, 6379)
+    REDIS_PORT=(int, 6379),
+    RFID_CACHE_TIMEOUT=(int, 300),
+    WEB_SOCKET_PUBLISH_TOKEN=(str, ''),
+    REPORTS_MAX_AGE_DAYS=(int, 30),
+    REPORTS_MAX_SIZE_MB=(int, 500)
 )
 environ.Env.read_env()
 
@@ -121,6 +125,16 @@ CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
 ROOT_URLCONF = 'reader.urls'
 
 WEB_SOCKET_SERVER_URL = env('WEB_SOCKET_SERVER_URL')
+# Токен издателя событий websocket, должен совпадать с переменной окружения сервера ws/server.py
+WEB_SOCKET_PUBLISH_TOKEN = env('WEB_SOCKET_PUBLISH_TOKEN')
+
+# Время жизни (в секундах) записи в кэше RFID-кодов процесса (readerBd.cache)
+RFID_CACHE_TIMEOUT = env('RFID_CACHE_TIMEOUT')
+
+# Сформированные отчеты (media/docs) хранятся не дольше REPORTS_MAX_AGE_DAYS дней, а их общий размер
+# не превышает REPORTS_MAX_SIZE_MB мегабайт (задача accountBd.tasks.evict_reports)
+REPORTS_MAX_AGE_DAYS = env('REPORTS_MAX_AGE_DAYS')
+REPORTS_MAX_SIZE_MB = env('REPORTS_MAX_SIZE_MB')
 
 WSGI_APPLICATION = 'reader.wsgi.application'
 
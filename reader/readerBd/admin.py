@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import ControlTime, Day, ScheduleDuty, ListEvents, OrderOfDuty, Event
+from .models import ControlTime, Day, ScheduleDuty, ListEvents, OrderOfDuty, Event, Presence
 
 
 admin.site.register(ControlTime)
@@ -9,3 +9,4 @@ admin.site.register(Event)
 admin.site.register(ScheduleDuty)
 admin.site.register(ListEvents)
 admin.site.register(OrderOfDuty)
+admin.site.register(Presence)
@@ -5,3 +5,7 @@ class ReaderBdConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'readerBd'
     verbose_name = 'Данные о работе операторов'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (инвалидация кэша RFID-кодов)
+        import readerBd.signals  # noqa: F401
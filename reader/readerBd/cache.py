@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+
+# Информация, необходимая для фиксации RFID-метки: id пользователя, его должность, id текущего дня и сам пользователь
+# (нужен для имени пользователя в изменении control_time, которое отправляется клиентам websocket)
+RfidEntry = namedtuple('RfidEntry', ('user_id', 'position', 'day_id', 'user'))
+
+
+class RfidCache:
+    """
+    Класс реализует кэш в памяти процесса, который сопоставляет RFID-код пользователю и его текущему дню.
+    Записи удаляются при изменении пользователя, профиля или дня (см. readerBd.signals), при смене даты
+    и по истечении RFID_CACHE_TIMEOUT секунд, чтобы изменения, сделанные в других процессах, не жили долго.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._date = None
+        # Код -> (RfidEntry, время истечения записи)
+        self._entries = {}
+        # id пользователя -> код, нужен для удаления записи, когда известен только пользователь
+        self._codes = {}
+
+    def get(self, code, date):
+        with self._lock:
+            # При смене даты все записи устаревают, так как в них хранится id дня
+            if self._date != date:
+                self._date = date
+                self._entries.clear()
+                self._codes.clear()
+                return None
+
+            entry = self._entries.get(code)
+            if not entry:
+                return None
+
+            rfid_entry, expires = entry
+            if expires < time.monotonic():
+                self._pop(code)
+                return None
+            return rfid_entry
+
+    def set(self, code, date, rfid_entry):
+        with self._lock:
+            if self._date != date:
+                self._date = date
+                self._entries.clear()
+                self._codes.clear()
+            self._entries[code] = (rfid_entry, time.monotonic() + settings.RFID_CACHE_TIMEOUT)
+            self._codes[rfid_entry.user_id] = code
+
+    def evict_code(self, code):
+        with self._lock:
+            self._pop(code)
+
+    def evict_user(self, user_id):
+        with self._lock:
+            code = self._codes.get(user_id)
+            if code is not None:
+                self._pop(code)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._codes.clear()
+
+    def _pop(self, code):
+        entry = self._entries.pop(code, None)
+        if entry:
+            self._codes.pop(entry[0].user_id, None)
+
+
+rfid_cache = RfidCache()
+
+
+def resolve_code(code):
+    """
+    Функция позволяет получить пользователя и его текущий день по RFID-коду
+
+    :param code: RFID-код
+    :return: Возвращает RfidEntry или None, если код не зарегистрирован в системе
+    """
+
+    from accountBd.models import User
+    from api.public.readerBd.utils import get_or_create_day
+
+    today = timezone.now().date()
+    rfid_entry = rfid_cache.get(code, today)
+    if rfid_entry:
+        return rfid_entry
+
+    user = User.objects.filter(code=code).select_related('profile').first()
+    if not user:
+        return None
+
+    # Текущий день пользователя ищется по уникальному индексу (user, date), если дня нет, то он создается
+    day, _ = get_or_create_day(user, today)
+    rfid_entry = RfidEntry(user_id=user.id, position=user.profile.position, day_id=day.id, user=user)
+
+    rfid_cache.set(code, today, rfid_entry)
+    return rfid_entry
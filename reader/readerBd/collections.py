@@ -1,5 +1,7 @@
 import datetime
 
+from accountBd.collections import UserPosition
+
 
 class TypeOfDay:
     """
@@ -46,3 +48,30 @@ class Times:
 
     TIME_END_WORK_DAY = datetime.time(hour=23, minute=59)
     TIME_DELAY = datetime.timedelta(minutes=10)
+
+
+class WorkSchedule:
+    """
+    Класс содержит распорядок рабочего дня в виде рабочих промежутков (начало, конец) для каждой должности.
+    Время присутствия вне рабочих промежутков считается переработкой. При изменении распорядка добавляется новая
+    версия с датой начала ее действия, чтобы перерасчет прошлых дней шел по распорядку, который действовал в те дни.
+    """
+
+    OPERATOR = (
+        (Times.TIME_ENTRY_MORNING_OPERATOR, Times.TIME_EXIT_MORNING_OPERATOR),
+        (Times.TIME_ENTRY_EVENING_OPERATOR, Times.TIME_EXIT_EVENING_OPERATOR),
+    )
+    # Время обеда персонал может проводить на рабочем месте, и оно не засчитывается в переработку
+    PERSONAL = (
+        (Times.TIME_ENTRY_MORNING_PERSONAL, Times.TIME_EXIT_EVENING_PERSONAL),
+    )
+
+    # Версии распорядка в порядке возрастания даты начала действия. Ключ None - распорядок для должностей,
+    # которых нет в словаре
+    VERSIONS = (
+        (datetime.date.min, {
+            UserPosition.OPERATOR: OPERATOR,
+            UserPosition.SENIOR_OPERATOR: OPERATOR,
+            None: PERSONAL,
+        }),
+    )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, OuterRef, Subquery
+
+from readerBd.models import ControlTime, Day
+
+
+class Command(BaseCommand):
+    help = 'Проверяет, что пользователь control_time совпадает с пользователем его дня'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Исправить пользователя control_time по его дню')
+
+    def handle(self, *args, **options):
+        mismatched = ControlTime.objects.exclude(user_id=F('day__user_id'))
+        ids = list(mismatched.values_list('id', flat=True))
+
+        if not ids:
+            self.stdout.write(self.style.SUCCESS('Пользователи control_time совпадают с пользователями дней'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'Control_time с пользователем, отличным от пользователя дня: '
+                                             f'{len(ids)} ({", ".join(map(str, ids[:20]))}'
+                                             f'{", ..." if len(ids) > 20 else ""})'))
+
+        if options['fix']:
+            count = ControlTime.objects.filter(id__in=ids).update(
+                user_id=Subquery(Day.objects.filter(id=OuterRef('day_id')).values('user_id')[:1]))
+            self.stdout.write(self.style.SUCCESS(f'Исправлено control_time: {count}'))
@@ -0,0 +1,83 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from readerBd.collections import TypeOfDay
+from readerBd.models import ControlTime, Day
+
+# Индексы миграции 0008_hot_query_indexes, без которых строятся планы запросов при сравнении (--compare)
+HOT_QUERY_INDEXES = ('control_time_open_code_idx', 'control_time_day_entry_idx', 'day_project_date_idx',
+                     'control_time_entry_date_idx')
+
+
+class Command(BaseCommand):
+    help = 'Выводит планы выполнения (EXPLAIN) частых запросов к control_time и дням'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compare', action='store_true',
+                            help='Вывести также планы без индексов миграции 0008_hot_query_indexes '
+                                 '(индексы удаляются в транзакции, которая затем откатывается). '
+                                 'Требует --i-know-this-locks')
+        parser.add_argument('--i-know-this-locks', action='store_true', dest='allow_locks',
+                            help='Разрешить --compare: удаление индексов блокирует таблицы control_time и дней '
+                                 '(ACCESS EXCLUSIVE в PostgreSQL) до отката транзакции, поэтому запускать '
+                                 'только на копии БД, а не на рабочей')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Выполнить запросы и вывести фактическое время (EXPLAIN ANALYZE, только PostgreSQL)')
+
+    def handle(self, *args, **options):
+        options_explain = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+
+        if options['compare'] and not options['allow_locks']:
+            raise CommandError('--compare удаляет индексы и блокирует таблицы control_time и дней до окончания '
+                               'сравнения. Запускайте его только на копии БД с флагом --i-know-this-locks')
+
+        if options['compare']:
+            self.stdout.write(self.style.MIGRATE_HEADING('Без индексов'))
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for name in HOT_QUERY_INDEXES:
+                        cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(name)}')
+                self.explain(options_explain)
+                transaction.set_rollback(True)
+            self.stdout.write(self.style.MIGRATE_HEADING('С индексами'))
+
+        self.explain(options_explain)
+
+    def explain(self, options_explain):
+        for name, queryset in self.hot_queries():
+            self.stdout.write(self.style.SUCCESS(name))
+            self.stdout.write(queryset.explain(**options_explain))
+            self.stdout.write('')
+
+    @staticmethod
+    def hot_queries():
+        """
+        Метод возвращает частые запросы с параметрами из существующих данных
+        """
+
+        today = timezone.now().date()
+        control_time = ControlTime.objects.order_by('-id').first()
+        day = Day.objects.exclude(project=None).order_by('-id').first()
+        code = control_time.code if control_time else ''
+        day_id = control_time.day_id if control_time else 0
+        user_id = day.user_id if day else 0
+        project_id = day.project_id if day else 0
+
+        return (
+            # Фиксация RFID-метки: открытый control_time по коду
+            ('Открытый control_time по коду', ControlTime.objects.filter(
+                code=code, time_exit__isnull=True).order_by('time_entry')[:1]),
+            # Задача close_day
+            ('Открытые control_time', ControlTime.objects.filter(time_exit__isnull=True)),
+            ('Control_time дня', ControlTime.objects.filter(day_id=day_id).order_by('time_entry')),
+            # Последние метки пользователей за текущий день (Presence.refresh)
+            ('Control_time за текущую дату', ControlTime.objects.filter(time_entry__date=today)),
+            ('День пользователя на дату', Day.objects.filter(user_id=user_id, date=today)),
+            ('Дни проекта за период', Day.objects.filter(
+                project_id=project_id, date__range=(today - datetime.timedelta(days=30), today))),
+            # Журнал инструктажа
+            ('Рабочие дни на дату', Day.objects.filter(date=today, type_of_day=TypeOfDay.WORK)),
+        )
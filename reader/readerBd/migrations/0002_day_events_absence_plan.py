@@ -0,0 +1,49 @@
+# Generated by Django 3.1.7 on 2026-10-18 17:48
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_events_absence_plan(apps, schema_editor):
+    Day = apps.get_model('readerBd', 'Day')
+
+    days = list(Day.objects.annotate(
+        events_count=Count('event'),
+        respectful=Sum('event__time_plan', filter=Q(event__respectful_absence=True)),
+        not_respectful=Sum('event__time_plan', filter=Q(event__respectful_absence=False)),
+    ).filter(events_count__gt=0))
+
+    for day in days:
+        day.time_of_respectful_absence_plan = day.respectful or datetime.timedelta(0)
+        day.time_of_not_respectful_absence_plan = day.not_respectful or datetime.timedelta(0)
+
+    Day.objects.bulk_update(days, ['time_of_respectful_absence_plan', 'time_of_not_respectful_absence_plan'],
+                            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readerBd', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='day',
+            name='time_of_not_respectful_absence_plan',
+            field=models.DurationField(blank=True, null=True, verbose_name='Время не уважительных событий (планируемое)'),
+        ),
+        migrations.AddField(
+            model_name='day',
+            name='time_of_respectful_absence_plan',
+            field=models.DurationField(blank=True, null=True, verbose_name='Время уважительных событий (планируемое)'),
+        ),
+        migrations.AlterField(
+            model_name='day',
+            name='type_of_day',
+            field=models.CharField(choices=[('work', 'Рабочий день'), ('duty', 'Наряд'), ('hospital', 'Госпиталь'), ('business_trip', 'Командировка'), ('holiday', 'Отпуск'), ('output', 'Выходной')], default='work', max_length=20, verbose_name='Тип дня'),
+        ),
+        migrations.RunPython(fill_events_absence_plan, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.7 on 2026-10-18 17:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def fill_presence(apps, schema_editor):
+    ControlTime = apps.get_model('readerBd', 'ControlTime')
+    Presence = apps.get_model('readerBd', 'Presence')
+
+    today = timezone.now().date()
+    latest = {}
+    for control_time_id, user_id in ControlTime.objects.filter(time_entry__date=today).order_by(
+            'time_entry', 'id').values_list('id', 'day__user_id'):
+        latest[user_id] = control_time_id
+
+    Presence.objects.bulk_create([Presence(user_id=user_id, control_time_id=control_time_id, date=today)
+                                  for user_id, control_time_id in latest.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('readerBd', '0002_day_events_absence_plan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Presence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Дата')),
+                ('control_time', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presence', to='readerBd.controltime', verbose_name='Последняя метка')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='presence', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Присутствие',
+                'verbose_name_plural': 'Присутствие',
+            },
+        ),
+        migrations.RunPython(fill_presence, migrations.RunPython.noop),
+    ]
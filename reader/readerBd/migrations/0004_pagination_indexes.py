@@ -0,0 +1,21 @@
+# Generated by Django 3.1.7 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readerBd', '0003_presence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='controltime',
+            index=models.Index(fields=['time_entry', 'id'], name='control_time_entry_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='day',
+            index=models.Index(fields=['date', 'id'], name='day_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def fill_month_statistics(apps, schema_editor):
+    Day = apps.get_model('readerBd', 'Day')
+
+    # Собираем статистику за все закрытые месяцы (до текущего месяца)
+    current_month = timezone.now().date().replace(day=1)
+    for model_name, field in (('UserMonthStatistic', 'user_id'), ('ProjectMonthStatistic', 'project_id')):
+        model = apps.get_model('readerBd', model_name)
+        rows = Day.objects.filter(date__lt=current_month, **{f'{field}__isnull': False}).annotate(
+            month=TruncMonth('date')).order_by().values(field, 'month').annotate(
+            plan_working_hours_sum=Sum('plan_working_hours'),
+            real_working_hours_sum=Sum('real_working_hours'),
+            real_overtime_sum=Sum('real_overtime'),
+            time_of_respectful_absence_fact_sum=Sum('time_of_respectful_absence_fact'),
+            time_of_not_respectful_absence_fact_sum=Sum('time_of_not_respectful_absence_fact'),
+        )
+        model.objects.bulk_create([model(**{
+            field: row[field],
+            'month': row['month'],
+            'plan_working_hours': row['plan_working_hours_sum'],
+            'real_working_hours': row['real_working_hours_sum'],
+            'real_overtime': row['real_overtime_sum'],
+            'time_of_respectful_absence_fact': row['time_of_respectful_absence_fact_sum'],
+            'time_of_not_respectful_absence_fact': row['time_of_not_respectful_absence_fact_sum'],
+        }) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accountBd', '0001_initial'),
+        ('readerBd', '0004_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserMonthStatistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, verbose_name='Месяц (первое число)')),
+                ('plan_working_hours', models.DurationField(blank=True, null=True, verbose_name='Запланированное количество часов для работы')),
+                ('real_working_hours', models.DurationField(blank=True, null=True, verbose_name='Количество фактически отработанного времени')),
+                ('real_overtime', models.DurationField(blank=True, null=True, verbose_name='Количество переработанного времени')),
+                ('time_of_respectful_absence_fact', models.DurationField(blank=True, null=True, verbose_name='Время уважительного отсутствия')),
+                ('time_of_not_respectful_absence_fact', models.DurationField(blank=True, null=True, verbose_name='Время не уважительных прогулов (фактическое)')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='month_statistics', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Статистика пользователя за месяц',
+                'verbose_name_plural': 'Статистика пользователей за месяц',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProjectMonthStatistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, verbose_name='Месяц (первое число)')),
+                ('plan_working_hours', models.DurationField(blank=True, null=True, verbose_name='Запланированное количество часов для работы')),
+                ('real_working_hours', models.DurationField(blank=True, null=True, verbose_name='Количество фактически отработанного времени')),
+                ('real_overtime', models.DurationField(blank=True, null=True, verbose_name='Количество переработанного времени')),
+                ('time_of_respectful_absence_fact', models.DurationField(blank=True, null=True, verbose_name='Время уважительного отсутствия')),
+                ('time_of_not_respectful_absence_fact', models.DurationField(blank=True, null=True, verbose_name='Время не уважительных прогулов (фактическое)')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='month_statistics', to='accountBd.project')),
+            ],
+            options={
+                'verbose_name': 'Статистика проекта за месяц',
+                'verbose_name_plural': 'Статистика проектов за месяц',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usermonthstatistic',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='user_month_statistic_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='projectmonthstatistic',
+            constraint=models.UniqueConstraint(fields=('project', 'month'), name='project_month_statistic_unique'),
+        ),
+        migrations.RunPython(fill_month_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:11
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readerBd', '0005_month_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='controltime',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Время изменения'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='day',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Время изменения'),
+            preserve_default=False,
+        ),
+    ]
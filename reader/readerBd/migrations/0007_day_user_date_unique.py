@@ -0,0 +1,52 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:40
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_days(apps, schema_editor):
+    """
+    Дни пользователя с одинаковой датой объединяются в день с наименьшим id: к нему переносятся control_time
+    и события, а время работы и переработки суммируется. Время отсутствия объединенных дней и помесячная
+    статистика уточняются задачами recalculation_day и rebuild_month_statistics
+    """
+
+    Day = apps.get_model('readerBd', 'Day')
+    ControlTime = apps.get_model('readerBd', 'ControlTime')
+
+    duplicates = Day.objects.order_by().values('user_id', 'date').annotate(
+        count=Count('id'), keep_id=Min('id')).filter(count__gt=1)
+    for row in duplicates:
+        day = Day.objects.get(id=row['keep_id'])
+        others = list(Day.objects.filter(user_id=row['user_id'], date=row['date']).exclude(id=day.id))
+
+        for other in others:
+            day.real_working_hours = (day.real_working_hours or timedelta(0)) + (other.real_working_hours or timedelta(0))
+            day.real_overtime = (day.real_overtime or timedelta(0)) + (other.real_overtime or timedelta(0))
+            day.event.add(*other.event.all())
+
+        ControlTime.objects.filter(day__in=others).update(day=day)
+        day.save()
+        Day.objects.filter(id__in=[other.id for other in others]).delete()
+
+
+class Migration(migrations.Migration):
+    # Объединение дней выполняется в отдельной транзакции: в PostgreSQL изменение таблицы в транзакции, в которой
+    # уже изменены строки с отложенной проверкой внешних ключей, завершается ошибкой
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('readerBd', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_days, migrations.RunPython.noop, atomic=True),
+        migrations.AddConstraint(
+            model_name='day',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='day_user_date_unique'),
+        ),
+    ]
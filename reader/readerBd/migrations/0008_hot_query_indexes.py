@@ -0,0 +1,47 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Индекс по дате времени входа для фильтра time_entry__date (Presence.refresh). Django 3.1 не поддерживает
+# индексы по выражениям, поэтому индекс создается SQL-запросом. Выражение строится так же, как в запросах Django
+# (с переводом в часовой пояс TIME_ZONE), иначе PostgreSQL не будет использовать индекс
+CONTROL_TIME_ENTRY_DATE_INDEX = 'control_time_entry_date_idx'
+
+
+def create_entry_date_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    expression = schema_editor.connection.ops.datetime_cast_date_sql(
+        schema_editor.quote_name('time_entry'), settings.TIME_ZONE)
+    schema_editor.execute(f'CREATE INDEX {schema_editor.quote_name(CONTROL_TIME_ENTRY_DATE_INDEX)} '
+                          f'ON {schema_editor.quote_name("readerBd_controltime")} (({expression}))')
+
+
+def drop_entry_date_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(CONTROL_TIME_ENTRY_DATE_INDEX)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readerBd', '0007_day_user_date_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='controltime',
+            index=models.Index(condition=models.Q(time_exit__isnull=True), fields=['code', 'time_entry'], name='control_time_open_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='controltime',
+            index=models.Index(fields=['day', 'time_entry'], name='control_time_day_entry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='day',
+            index=models.Index(fields=['project', 'date'], name='day_project_date_idx'),
+        ),
+        migrations.RunPython(create_entry_date_index, drop_entry_date_index),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:30
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_control_time_user(apps, schema_editor):
+    ControlTime = apps.get_model('readerBd', 'ControlTime')
+    Day = apps.get_model('readerBd', 'Day')
+
+    ControlTime.objects.update(user_id=Subquery(Day.objects.filter(id=OuterRef('day_id')).values('user_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('readerBd', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='controltime',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='control_times', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.RunPython(fill_control_time_user, migrations.RunPython.noop),
+    ]
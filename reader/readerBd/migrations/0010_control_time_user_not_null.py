@@ -0,0 +1,27 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Поле становится обязательным в отдельной миграции (транзакции): в PostgreSQL изменение таблицы в транзакции,
+    # в которой уже изменены строки с отложенной проверкой внешних ключей, завершается ошибкой
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('readerBd', '0009_control_time_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='controltime',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='control_times', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddIndex(
+            model_name='controltime',
+            index=models.Index(fields=['user', 'time_entry'], name='control_time_user_entry_idx'),
+        ),
+    ]
@@ -1,12 +1,32 @@
 from datetime import timedelta
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.duration import duration_string
 
 from accountBd.collections import NumberAppeal
 from accountBd.models import Project
 from readerBd.collections import TypeOfDay, Times
-from ws.utils import send_event
+from ws.utils import send_delta
+
+
+class UpdatedAtQuerySet(models.QuerySet):
+    """
+    Класс обновляет время изменения (updated_at) объектов при сохранении через update и bulk_update,
+    которые не вызывают save() и не обновляют поля auto_now
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        return super().bulk_update(objs, [*fields, 'updated_at'], batch_size=batch_size)
 
 
 class ListEvents(models.Model):
@@ -69,14 +89,43 @@ class Day(models.Model):
                                                                blank=True, default=timedelta(0))
     real_overtime = models.DurationField('Количество переработанного времени',
                                          blank=True, default=timedelta(0))
+    # Суммарное плановое время уважительных и не уважительных событий дня. Пересчитывается только при изменении
+    # событий дня (см. readerBd.signals), пустое значение означает, что у дня нет событий
+    time_of_respectful_absence_plan = models.DurationField('Время уважительных событий (планируемое)',
+                                                           blank=True, null=True)
+    time_of_not_respectful_absence_plan = models.DurationField('Время не уважительных событий (планируемое)',
+                                                               blank=True, null=True)
+    # Время последнего изменения, по нему определяется версия данных отчетов (docs.statistic_docx.data_version)
+    updated_at = models.DateTimeField('Время изменения', auto_now=True, db_index=True)
+
+    objects = UpdatedAtQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'День'
         verbose_name_plural = 'Дни'
+        indexes = [
+            # Индекс для постраничного вывода дней (DayCursorPagination)
+            models.Index(fields=['date', 'id'], name='day_date_id_idx'),
+            # Индекс для дней проекта за период (статистика и отчеты по проектам). Дни пользователя на дату
+            # ищутся по уникальному индексу day_user_date_unique
+            models.Index(fields=['project', 'date'], name='day_project_date_idx'),
+        ]
+        constraints = [
+            # У пользователя может быть только один день на дату
+            models.UniqueConstraint(fields=['user', 'date'], name='day_user_date_unique'),
+        ]
 
     def __str__(self):
         return f'{self.user} {self.date}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем пользователя, проект и дату, чтобы при их изменении пересчитать статистику прежнего месяца
+        instance._loaded_statistic_key = (instance.__dict__.get('user_id'), instance.__dict__.get('project_id'),
+                                          instance.__dict__.get('date'))
+        return instance
+
 
 class ControlTime(models.Model):
     """
@@ -85,6 +134,10 @@ class ControlTime(models.Model):
     """
 
     day = models.ForeignKey(Day, on_delete=models.CASCADE, verbose_name='День', related_name='control_times')
+    # Пользователь дня. Хранится в control_time, чтобы списки и присутствие получали пользователя без соединения
+    # с днями. Должен совпадать с day.user (проверка - команда check_control_time_users)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='Пользователь',
+                             related_name='control_times')
     code = models.CharField('Код', max_length=150)
     time_entry = models.DateTimeField('Время входа')  # Время входа в лабораторию
     time_exit = models.DateTimeField('Время выхода', null=True, blank=True)  # Время выхода из лаборатории
@@ -93,19 +146,187 @@ class ControlTime(models.Model):
                                            blank=True, default=timedelta(0))
     overtime = models.DurationField('Время переработки', null=True,
                                     blank=True, default=timedelta(0))  # Время переработки
+    # Время последнего изменения (см. Day.updated_at)
+    updated_at = models.DateTimeField('Время изменения', auto_now=True, db_index=True)
+
+    objects = UpdatedAtQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Код'
         verbose_name_plural = 'Коды'
+        indexes = [
+            # Индекс для постраничного вывода control_time (ControlTimeCursorPagination)
+            models.Index(fields=['time_entry', 'id'], name='control_time_entry_id_idx'),
+            # Частичный индекс открытых control_time (без времени выхода) для поиска открытого control_time
+            # по RFID-коду и для задачи close_day. Открытых control_time немного, поэтому индекс небольшой
+            models.Index(fields=['code', 'time_entry'], condition=models.Q(time_exit__isnull=True),
+                         name='control_time_open_code_idx'),
+            # Индекс для control_time дня в порядке времени входа
+            models.Index(fields=['day', 'time_entry'], name='control_time_day_entry_idx'),
+            # Индекс для истории control_time пользователя и последних меток пользователей (Presence.refresh)
+            models.Index(fields=['user', 'time_entry'], name='control_time_user_entry_idx'),
+        ]
 
     def __str__(self):
         return self.code
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем время входа, чтобы при сохранении обновлять присутствие только при его изменении
+        instance._loaded_time_entry = instance.__dict__.get('time_entry')
+        return instance
+
     def save(self, *args, **kwargs):
+        if self.user_id is None:
+            self.user_id = self.day.user_id
+
+        refresh_presence = self._state.adding or self.time_entry != getattr(self, '_loaded_time_entry', None)
         super().save(*args, **kwargs)
+        self._loaded_time_entry = self.time_entry
+
+        # Присутствие и клиенты websocket обновляются только после фиксации транзакции, чтобы при ее откате
+        # клиенты не получили изменение, которого нет в БД
+        user_id = self.user_id
+        data = self.delta_data()
+
+        # Последняя метка пользователя за день меняется только при создании control_time или изменении времени входа
+        if refresh_presence:
+            transaction.on_commit(lambda: Presence.refresh([user_id]))
+
+        # функция необходима для работы websocket, клиентам отправляется измененный control_time
+        transaction.on_commit(lambda: send_delta('control_time', data, key=f'control_time:{data["id"]}'))
+
+    def delete(self, *args, **kwargs):
+        control_time_id = self.id
+        result = super().delete(*args, **kwargs)
+
+        # Присутствие обновляется в readerBd.signals при любом удалении control_time (в том числе каскадном)
+        transaction.on_commit(lambda: send_delta('control_time_delete', {'id': control_time_id},
+                                                 key=f'control_time:{control_time_id}'))
+        return result
+
+    def delta_data(self):
+        """
+        Метод возвращает control_time в том же виде, что и ControlTimeSerializer, для отправки изменения клиентам
+        websocket. Имя берется у пользователя control_time, поэтому при частых сохранениях пользователь должен быть
+        уже загружен (select_related или присвоенный объект пользователя)
+        """
+
+        return {
+            'id': self.id,
+            'id_user': self.user_id,
+            'full_name': self.user.get_full_name(),
+            'time_entry': _format_datetime(self.time_entry),
+            'time_exit': _format_datetime(self.time_exit),
+            'time_difference': duration_string(self.time_difference) if self.time_difference is not None else None,
+            'overtime': duration_string(self.overtime) if self.overtime is not None else None,
+        }
+
+
+def _format_datetime(value):
+    # Время выводится в текущем часовом поясе в формате ControlTimeSerializer
+    return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S') if value is not None else None
+
+
+class Presence(models.Model):
+    """
+    Класс предназначен для хранения последней метки каждого пользователя за текущий день (кто сейчас находится
+    в лаборатории). Записи обновляются при создании, изменении времени входа и удалении control_time (в том числе
+    при удалении запросом и каскадном удалении вместе с днем или пользователем).
+    """
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='presence',
+                                verbose_name='Пользователь')
+    control_time = models.ForeignKey(ControlTime, on_delete=models.CASCADE, related_name='presence',
+                                     verbose_name='Последняя метка')
+    date = models.DateField('Дата', db_index=True)
+
+    class Meta:
+        verbose_name = 'Присутствие'
+        verbose_name_plural = 'Присутствие'
+
+    def __str__(self):
+        return f'{self.user} {self.date}'
+
+    @classmethod
+    def refresh(cls, user_ids):
+        """
+        Метод пересчитывает последние метки пользователей за текущий день
+
+        :param user_ids: Список id пользователей
+        """
 
-        # функция необходима для работы websocket
-        send_event(message='update')
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+
+        # Текущий день определяется так же, как в списке control_time за текущую дату
+        today = timezone.now().date()
+        latest = {}
+        for control_time_id, user_id in ControlTime.objects.filter(
+                user_id__in=user_ids, time_entry__date=today).order_by('time_entry', 'id').values_list(
+                'id', 'user_id'):
+            latest[user_id] = control_time_id
+
+        with transaction.atomic():
+            cls.objects.filter(user_id__in=user_ids).delete()
+            cls.objects.bulk_create([cls(user_id=user_id, control_time_id=control_time_id, date=today)
+                                     for user_id, control_time_id in latest.items()], ignore_conflicts=True)
+
+
+class MonthStatistic(models.Model):
+    """
+    Класс предназначен для хранения сумм показателей дней за закрытый месяц (предыдущие месяцы). Статистика
+    за период складывается из сумм по целым месяцам и показателей дней текущего месяца и неполных месяцев периода.
+    """
+
+    month = models.DateField('Месяц (первое число)', db_index=True)
+    plan_working_hours = models.DurationField('Запланированное количество часов для работы', null=True, blank=True)
+    real_working_hours = models.DurationField('Количество фактически отработанного времени', null=True, blank=True)
+    real_overtime = models.DurationField('Количество переработанного времени', null=True, blank=True)
+    time_of_respectful_absence_fact = models.DurationField('Время уважительного отсутствия', null=True, blank=True)
+    time_of_not_respectful_absence_fact = models.DurationField('Время не уважительных прогулов (фактическое)',
+                                                               null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+
+class UserMonthStatistic(MonthStatistic):
+    """
+    Класс предназначен для хранения статистики пользователя за месяц
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='month_statistics')
+
+    class Meta:
+        verbose_name = 'Статистика пользователя за месяц'
+        verbose_name_plural = 'Статистика пользователей за месяц'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='user_month_statistic_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.month:%Y-%m}'
+
+
+class ProjectMonthStatistic(MonthStatistic):
+    """
+    Класс предназначен для хранения статистики проекта за месяц
+    """
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='month_statistics')
+
+    class Meta:
+        verbose_name = 'Статистика проекта за месяц'
+        verbose_name_plural = 'Статистика проектов за месяц'
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'month'], name='project_month_statistic_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.project} {self.month:%Y-%m}'
 
 
 class ScheduleDuty(models.Model):
@@ -0,0 +1,96 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from accountBd.models import User, Profile
+from readerBd.cache import rfid_cache
+from readerBd.models import Day, Event, ControlTime, Presence
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_user_rfid(sender, instance, **kwargs):
+    # Код пользователя мог измениться, поэтому удаляем запись и по новому коду, и по id пользователя
+    rfid_cache.evict_code(instance.code)
+    rfid_cache.evict_user(instance.id)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def evict_related_rfid(sender, instance, **kwargs):
+    rfid_cache.evict_user(instance.user_id)
+
+
+@receiver(post_save, sender=Day)
+@receiver(post_delete, sender=Day)
+def update_day_dependencies(sender, instance, signal, **kwargs):
+    from api.public.readerBd.utils import update_month_statistics
+
+    # Все зависимые от дня данные обновляются в одном обработчике, так как все они сравниваются с загруженным
+    # ключом дня, который обновляется в конце
+    key = (instance.user_id, instance.project_id, instance.date)
+    loaded_key = getattr(instance, '_loaded_statistic_key', None)
+
+    # Запись кэша RFID-кодов содержит id дня, поэтому удаляем ее только при создании и удалении дня или при изменении
+    # его пользователя или даты. Показатели дня изменяются почти при каждой метке и на кэш не влияют
+    if signal is post_delete or not loaded_key or (loaded_key[0], loaded_key[2]) != (key[0], key[2]):
+        rfid_cache.evict_user(instance.user_id)
+        if loaded_key:
+            rfid_cache.evict_user(loaded_key[0])
+
+    # Пользователь хранится и в control_time дня, поэтому при смене пользователя дня обновляем control_time
+    # (при удалении дня control_time удаляются вместе с ним)
+    if signal is post_save and loaded_key and loaded_key[0] != instance.user_id:
+        ControlTime.objects.filter(day=instance).update(user_id=instance.user_id)
+
+    # Пересчитываем статистику месяца дня, а если у дня изменились пользователь, проект или дата,
+    # то и статистику прежнего месяца
+    update_month_statistics({key, loaded_key} if loaded_key else {key})
+    instance._loaded_statistic_key = key
+
+
+@receiver(post_delete, sender=ControlTime)
+def refresh_deleted_control_time_presence(sender, instance, **kwargs):
+    # Обработчик вызывается и при удалении control_time запросом, и при каскадном удалении вместе с днем
+    # или пользователем. Последняя метка пользователя пересчитывается после фиксации транзакции
+    user_id = instance.user_id
+    transaction.on_commit(lambda: Presence.refresh([user_id]))
+
+
+@receiver(m2m_changed, sender=Day.event.through)
+def update_day_events(sender, instance, action, reverse, pk_set, **kwargs):
+    # Время событий дня пересчитывается только при изменении списка событий дня
+    from api.public.readerBd.utils import update_days_events
+
+    if action == 'pre_clear' and reverse:
+        # При очистке дней у события pk_set не передается, поэтому запоминаем дни заранее
+        instance._cleared_day_ids = list(instance.days.values_list('id', flat=True))
+
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            update_days_events([instance.id])
+        elif action == 'post_clear':
+            update_days_events(getattr(instance, '_cleared_day_ids', []))
+        else:
+            update_days_events(pk_set)
+
+
+@receiver(post_save, sender=Event)
+def update_event_days(sender, instance, created, **kwargs):
+    from api.public.readerBd.utils import update_days_events
+
+    # У нового события еще нет дней
+    if not created:
+        update_days_events(instance.days.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Event)
+def remember_event_days(sender, instance, **kwargs):
+    instance._deleted_day_ids = list(instance.days.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Event)
+def update_deleted_event_days(sender, instance, **kwargs):
+    from api.public.readerBd.utils import update_days_events
+
+    update_days_events(getattr(instance, '_deleted_day_ids', []))
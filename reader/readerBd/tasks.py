@@ -1,8 +1,8 @@
 import logging
 import datetime
 
+from django.db import transaction
 from django.utils import timezone
-from django.utils.timezone import utc
 
 from reader.celery import app
 
@@ -10,64 +10,29 @@ logger = logging.getLogger(__name__)
 
 
 @app.task
-def add_day():
+def add_day(horizon=7):
     """
     Функция которая автоматически создает дни для всех пользователей системы
 
-    :return: Список объектов типа Day для каждого пользователя на неделю
+    :param horizon: Количество дней, начиная с текущей даты, на которые создаются дни (по умолчанию неделя)
+    :return: Количество созданных объектов типа Day
     """
 
-    from readerBd.collections import TypeOfDay, Times
-    from readerBd.models import Day
     from accountBd.models import User
-    from accountBd.collections import UserPosition
     from accountBd.collections import UserStatus
+    from api.public.readerBd.utils import create_days
 
-    # Ищем пользователей, у которых статус не демобилизиван
-    users = list(User.objects.exclude(profile__status=UserStatus.DEMOB))
-
-    # Переменная необходимая для запоминания созданных объетов
-    day_list = []
-
-    # Запускаем цикл который создаст 7 дней
-    for days_week in range(0, 6):
-        for user in users:
-            # Запоминаем текущий день, когда запущен скрипт и прибавляем к нему по 1 дню в каждой итерации цикла
-            date_days_week = timezone.now().date() + datetime.timedelta(days=days_week)
-
-            # Перед созданием объекта мы проверяем, создан ли для данного пользователя день с текущей датой.
-            # Если такого дня нет, создаем его
-            try:
-                day = Day.objects.get(date=date_days_week, user_id=user.id)
-            except Day.DoesNotExist:
-                # Если текущий день попадает на субботу или воскресенье, то создаем объект с типом output (выходной)
-                if datetime.datetime.weekday(date_days_week) in (5, 6):
-                    day_list.append(Day(
-                        user_id=user.id,
-                        project=user.profile.project,
-                        date=date_days_week,
-                        type_of_day=TypeOfDay.OUTPUT,
-                        real_working_hours=datetime.timedelta(0),
-                        plan_working_hours=datetime.timedelta(0)
-                    ))
-                else:
-                    # Проверяем статус пользователя и запоминаем его плановое количество рабочего времени
-                    if user.profile.position in (UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR):
-                        plan_working_hours = Times.TIME_WORK_OPERATOR
-                    else:
-                        plan_working_hours = Times.TIME_WORK_PERSONAL
-
-                    day_list.append(Day(
-                        user_id=user.id,
-                        project=user.profile.project,
-                        date=date_days_week,
-                        type_of_day=TypeOfDay.WORK,
-                        real_working_hours=datetime.timedelta(0),
-                        plan_working_hours=plan_working_hours
-                    ))
-
-    if day_list:
-        Day.objects.bulk_create(day_list)
+    # Ищем пользователей, у которых статус не демобилизиван, вместе с профилем
+    users = list(User.objects.filter(profile__isnull=False).exclude(
+        profile__status=UserStatus.DEMOB).select_related('profile'))
+
+    dates = [timezone.now().date() + datetime.timedelta(days=number) for number in range(horizon)]
+
+    # Дни, которые уже созданы на эти даты, проверяются одним запросом, остальные создаются одним запросом.
+    # Для субботы и воскресенья создается выходной день
+    count = create_days((user, date) for date in dates for user in users)
+    logger.info(f'Создано дней на {horizon} дней вперед: {count}')
+    return count
 
 
 @app.task
@@ -76,72 +41,152 @@ def close_day():
     Функция по закрытию control_time, где отсутсвует время выхода
 
     :return: Добавляет время выхода в те объекты ControlTime, которые без time_exit, рассчитывает time_difference
-    и overtime. Обновляет базу данных.
+    и overtime и изменяет на них показатели дней. Обновляет базу данных одним запросом на control_time и одним
+    на дни и отправляет одно событие websocket.
     """
 
-    from accountBd.collections import UserPosition
-    from readerBd.models import ControlTime
-    from api.public.readerBd.utils import overtime_calculation
-    from readerBd.collections import Times, TypeOfDay
+    from readerBd.models import ControlTime, Day, Presence
+    from api.public.readerBd.utils import overtime_calculation, work_windows, increment_time_variable, \
+        update_month_statistics
+    from readerBd.collections import TypeOfDay
+    from ws.utils import send_event
+
+    # control_time и их дни блокируются до конца транзакции, чтобы одновременная метка выхода не закрыла
+    # тот же control_time и изменения показателей дней не терялись
+    with transaction.atomic():
+        # Получаем список всех control_time где нет времени выхода вместе с пользователем и его профилем
+        control_times = list(ControlTime.objects.select_for_update(of=('self',)).filter(
+            time_exit__isnull=True).select_related('user__profile'))
+        days = {day.id: day for day in Day.objects.select_for_update().filter(
+            id__in={control_time.day_id for control_time in control_times})}
+
+        for control_time in control_times:
+            day = control_time.day = days[control_time.day_id]
+            position = control_time.user.profile.position
+            old_time_difference = control_time.time_difference or datetime.timedelta(0)
+            old_overtime = control_time.overtime or datetime.timedelta(0)
+
+            # Время окончания рабочего дня по распорядку (конец последнего рабочего промежутка)
+            time_end_work = work_windows(control_time.time_entry.date(), position)[-1][1]
+
+            # Проверяем что время входа больше чем время окончания рабочего дня по распорядку (то есть, оператор
+            # работает после 17:00, а персонал после 18:00), то мы во время выхода записываем время входа + 5 минут.
+            if control_time.time_entry > time_end_work:
+                control_time.time_exit = control_time.time_entry + datetime.timedelta(minutes=5)
+            else:
+                control_time.time_exit = time_end_work
 
-    # Получаем список всех control_time где нет времени выхода
-    control_times = list(ControlTime.objects.filter(time_exit__isnull=True))
+            # Устанавливаем общее время нахождения в лаборатории
+            control_time.time_difference = control_time.time_exit - control_time.time_entry
 
-    for control_time in control_times:
+            # Рассчитываем время переработки
+            if day.type_of_day == TypeOfDay.WORK:
+                control_time.overtime = overtime_calculation(control_time.time_entry,
+                                                             control_time.time_exit,
+                                                             position,
+                                                             day)
+            else:
+                control_time.overtime = control_time.time_difference
 
-        # Текущая дата и время выхода по графику.
-        today_time_operator = datetime.datetime.combine(control_time.time_entry.date(),
-                                                        Times.TIME_EXIT_EVENING_OPERATOR, tzinfo=utc)
+            # Показатели дня изменяются на разницу показателей control_time, так же как при метке выхода
+            increment_time_variable(day, control_time.time_difference - old_time_difference,
+                                    control_time.overtime - old_overtime)
 
-        today_time_personal = datetime.datetime.combine(control_time.time_entry.date(),
-                                                        Times.TIME_EXIT_EVENING_PERSONAL, tzinfo=utc)
+        # bulk_update не вызывает save(), поэтому событие websocket отправляется один раз на все control_time
+        if control_times:
+            ControlTime.objects.bulk_update(control_times, ['time_exit', 'time_difference', 'overtime'],
+                                            batch_size=500)
+            Day.objects.bulk_update(days.values(), ['real_working_hours', 'real_overtime',
+                                                    'time_of_respectful_absence_fact',
+                                                    'time_of_not_respectful_absence_fact'], batch_size=500)
+            update_month_statistics((day.user_id, day.project_id, day.date) for day in days.values())
 
-        # Проверяем если оператор, и проверяем что время входа больше чем время выхода с работы по графику (то есть,
-        # оператор работает после 17:00, а персонал после 18:00, то мы во время выхода записываем время  входа +
-        # 5 минут.
-        if control_time.day.user.profile.position in (UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR):
+    if control_times:
+        # Закрытые control_time остаются последними метками пользователей, обновляем присутствие для списка
+        # за текущую дату
+        Presence.refresh({control_time.user_id for control_time in control_times})
+        send_event(message='update')
 
-            if control_time.time_entry > today_time_operator:
-                control_time.time_exit = control_time.time_entry + datetime.timedelta(minutes=5)
-            else:
-                control_time.time_exit = today_time_operator
+    logger.info(f'Закрыто control_time: {len(control_times)}')
 
-        else:
 
-            if control_time.time_entry > today_time_personal:
-                control_time.time_exit = control_time.time_entry + datetime.timedelta(minutes=5)
-            else:
-                control_time.time_exit = today_time_personal
+@app.task
+def recalculation_day(date_from=None, date_to=None):
+    """
+    Функция по перерасчету данных в объектах Day за период (по умолчанию за текущую дату)
+
+    :param date_from: Начальная дата периода в формате YYYY-MM-DD
+    :param date_to: Конечная дата периода в формате YYYY-MM-DD
+    :return: Добавляет в объекты Day значения в поля real_working_hours, real_overtime
+    time_of_respectful_absence_fact и time_of_not_respectful_absence_fact
+    """
 
-        # Устанавливаем общее время нахождения в лаборатории
-        control_time.time_difference = control_time.time_exit - control_time.time_entry
+    from api.public.readerBd.utils import recalculation_days
 
-        # Рассчитываем время переработки
-        if control_time.day.type_of_day == TypeOfDay.WORK:
-            control_time.overtime = overtime_calculation(control_time.time_entry,
-                                                         control_time.time_exit,
-                                                         control_time.day.user,
-                                                         control_time.day)
-        else:
-            control_time.overtime = control_time.time_difference
+    today = timezone.now().date()
+    date_from = datetime.date.fromisoformat(date_from) if date_from else today
+    date_to = datetime.date.fromisoformat(date_to) if date_to else date_from
 
-        control_time.save()
+    count = recalculation_days(date_from, date_to)
+    logger.info(f'Пересчитано дней с {date_from} по {date_to}: {count}')
 
 
 @app.task
-def recalculation_day():
+def recalculation_overtime(date_from, date_to):
     """
-    Функция по перерасчету данных в объекте Day
+    Функция по перерасчету времени переработки control_time и показателей дней за период, например после изменения
+    распорядка рабочего дня в readerBd.collections.Times
 
-    :return: Добавляет в объект Day значения в поля real_working_hours, real_overtime
-    time_of_respectful_absence_fact и time_of_not_respectful_absence_fact
+    :param date_from: Начальная дата периода в формате YYYY-MM-DD
+    :param date_to: Конечная дата периода в формате YYYY-MM-DD
+    """
+
+    from api.public.readerBd.overtime import recalculation_overtime as recalculation
+
+    date_from = datetime.date.fromisoformat(date_from)
+    date_to = datetime.date.fromisoformat(date_to)
+
+    count = recalculation(date_from, date_to)
+    logger.info(f'Изменено время переработки control_time с {date_from} по {date_to}: {count}')
+
+
+@app.task
+def rebuild_month_statistics(month=None):
+    """
+    Функция по сбору помесячной статистики пользователей и проектов за закрытый месяц (по умолчанию
+    за предыдущий месяц и за закрытые месяцы, статистика за которые не собрана, например, из-за пропущенного
+    запуска). Запускается в начале каждого месяца
+
+    :param month: Любая дата месяца в формате YYYY-MM-DD
+    """
+
+    from api.public.readerBd.utils import rebuild_month_statistics as rebuild, month_start, missing_month_statistics
+
+    if month:
+        months = {month_start(datetime.date.fromisoformat(month))}
+    else:
+        months = missing_month_statistics()
+        months.add(month_start(month_start(timezone.now().date()) - datetime.timedelta(days=1)))
+
+    rebuild(months)
+    logger.info(f'Собрана помесячная статистика за {", ".join(f"{month:%Y-%m}" for month in sorted(months))}')
+
+
+@app.task
+def journal_report(document_name, date=None):
+    """
+    Функция формирует журнал инструктажа операторов в формате .docx (по умолчанию на текущую дату)
+
+    :param document_name: Название документа
+    :param date: Дата журнала в формате YYYY-MM-DD
+    :return: id объекта FileRepository со сформированным журналом
     """
 
-    from api.public.readerBd.utils import calculation_time_variable
-    from readerBd.models import Day
+    from api.public.readerBd.utils import journal_users
+    from docs.statistic_docx import journal
 
-    days = list(Day.objects.filter(date=timezone.now().date()))
+    date = datetime.date.fromisoformat(date) if date else timezone.now().date()
 
-    for day in days:
-        rec_day = calculation_time_variable(day)
-        rec_day.save()
+    file_repository = journal(journal_users(date)).save_report(document_name)
+    logger.info(f'Сформирован журнал инструктажа {document_name}')
+    return file_repository.id
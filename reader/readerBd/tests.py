@@ -1,7 +1,1014 @@
-from django.test import TestCase
+import collections
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.timezone import utc
+from rest_framework.test import APIRequestFactory, force_authenticate
 
+from accountBd.collections import UserPosition
+from accountBd.models import User, Project, Profile, FileRepository
+from accountBd.tasks import users_statistic_report
+from api.public.accountBd.mixins import user_statistic_queryset
+from api.public.accountBd.views import UsersStatisticUserViewSet, ReportStatusAPIView
+from api.public.readerBd.duty import DutyScheduler
+from api.public.readerBd.overtime import overtime_array
+from api.public.readerBd.serializers import ControlTimeSerializer
+from api.public.readerBd.utils import (overtime_calculation, AppealRotation, calculation_time_variable,
+                                      month_statistics_months, change_count_duty)
+from api.public.readerBd.views import ControlTimeViewSet, ControlTimeTodayList, DayViewSet, ScheduleDutyViewSet
+from docs.statistic_docx import report_name, cached_report, evict_reports
+from readerBd.cache import rfid_cache, resolve_code
+from readerBd.collections import TypeOfDay
+from readerBd.models import Day, ControlTime, Event, OrderOfDuty, Presence, ScheduleDuty, UserMonthStatistic
+from readerBd.tasks import add_day, close_day, rebuild_month_statistics
+from ws.server import WSServer, Client
 
 
+class OvertimeCalculationTestCase(SimpleTestCase):
+    """
+    Проверка расчета времени переработки по рабочим промежуткам распорядка дня
+    """
 
+    date = datetime.date(2021, 6, 1)
+
+    def overtime(self, entry, exit_, position=UserPosition.OPERATOR, type_of_day=TypeOfDay.WORK):
+        time_entry = datetime.datetime.combine(self.date, entry, tzinfo=utc)
+        time_exit = datetime.datetime.combine(self.date, exit_, tzinfo=utc)
+        return overtime_calculation(time_entry, time_exit, position, Day(type_of_day=type_of_day))
+
+    def test_operator(self):
+        # Приход до начала и уход после окончания рабочего дня, обед засчитывается в переработку
+        self.assertEqual(self.overtime(datetime.time(5), datetime.time(15)), datetime.timedelta(hours=4))
+        # Присутствие только во время обеда
+        self.assertEqual(self.overtime(datetime.time(10, 30), datetime.time(11, 30)), datetime.timedelta(hours=1))
+        # Присутствие в рабочее время
+        self.assertEqual(self.overtime(datetime.time(6), datetime.time(10)), datetime.timedelta(0))
+
+    def test_personal(self):
+        # Обед персонала не засчитывается в переработку
+        self.assertEqual(self.overtime(datetime.time(5), datetime.time(16), UserPosition.ENGINEER),
+                         datetime.timedelta(hours=2))
+        # Присутствие после окончания рабочего дня засчитывается полностью
+        self.assertEqual(self.overtime(datetime.time(16), datetime.time(17), UserPosition.ENGINEER),
+                         datetime.timedelta(hours=1))
+
+    def test_time_delay(self):
+        # Отрезки вне рабочего времени не больше 10 минут не учитываются
+        self.assertEqual(self.overtime(datetime.time(5, 50), datetime.time(14, 10)), datetime.timedelta(hours=2))
+        self.assertEqual(self.overtime(datetime.time(5, 49), datetime.time(14, 11)),
+                         datetime.timedelta(hours=2, minutes=22))
+
+    def test_not_work_day(self):
+        self.assertEqual(self.overtime(datetime.time(7), datetime.time(9), type_of_day=TypeOfDay.DUTY),
+                         datetime.timedelta(hours=2))
+
+
+class OvertimeArrayTestCase(SimpleTestCase):
+    """
+    Проверка совпадения векторного расчета времени переработки (overtime_array) с overtime_calculation
+    """
+
+    positions = (UserPosition.OPERATOR, UserPosition.SENIOR_OPERATOR, UserPosition.ENGINEER, UserPosition.EMPLOYEE)
+    types_of_day = (TypeOfDay.WORK, TypeOfDay.DUTY, TypeOfDay.OUTPUT)
+    date = datetime.date(2021, 6, 1)
+
+    def assert_parity(self, intervals):
+        rows = [(time_entry, time_exit, position, type_of_day)
+                for time_entry, time_exit in intervals
+                for position in self.positions
+                for type_of_day in self.types_of_day]
+
+        result = overtime_array([int(row[0].timestamp()) for row in rows],
+                                [int(row[1].timestamp()) for row in rows],
+                                [row[2] for row in rows],
+                                [row[3] for row in rows])
+
+        for (time_entry, time_exit, position, type_of_day), seconds in zip(rows, result.tolist()):
+            expected = overtime_calculation(time_entry, time_exit, position, Day(type_of_day=type_of_day))
+            self.assertEqual(datetime.timedelta(seconds=seconds), expected,
+                             f'{time_entry} - {time_exit}, {position}, {type_of_day}')
+
+    def test_schedule_boundaries(self):
+        # Все пары моментов вокруг границ распорядка (с учетом резерва времени в 10 минут)
+        start = datetime.datetime.combine(self.date, datetime.time(0), tzinfo=utc)
+        moments = sorted({start + datetime.timedelta(hours=hour, minutes=minute)
+                          for hour in range(4, 18)
+                          for minute in (-11, -10, -9, -1, 0, 1, 9, 10, 11)})
+        self.assert_parity([(time_entry, time_exit) for time_entry in moments for time_exit in moments
+                            if time_entry <= time_exit])
+
+    def test_random_intervals(self):
+        generator = random.Random(0)
+        start = datetime.datetime.combine(self.date, datetime.time(0), tzinfo=utc)
+        intervals = []
+        for _ in range(2000):
+            time_entry = start + datetime.timedelta(seconds=generator.randrange(24 * 60 * 60))
+            time_exit = time_entry + datetime.timedelta(seconds=generator.randrange(20 * 60 * 60))
+            intervals.append((time_entry, time_exit))
+        self.assert_parity(intervals)
+
+    def test_several_dates(self):
+        start = datetime.datetime.combine(self.date, datetime.time(20), tzinfo=utc)
+        self.assert_parity([(start, start + datetime.timedelta(hours=hours)) for hours in range(0, 60, 3)])
+
+    def test_empty(self):
+        self.assertEqual(len(overtime_array([], [], [], [])), 0)
+
+
+class BatchSwipesTestCase(TestCase):
+    """
+    Проверка фиксации пакета RFID-меток
+    """
+
+    date = datetime.date(2021, 6, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'user-{number}', code=f'code-{number}') for number in range(6)]
+
+    def timestamp(self, hour, minute=0):
+        return datetime.datetime.combine(self.date, datetime.time(hour, minute), tzinfo=utc).isoformat()
+
+    def batch(self, swipes):
+        request = APIRequestFactory().post('/', [{'code': code, 'timestamp': timestamp} for code, timestamp in swipes],
+                                           format='json')
+        force_authenticate(request, user=self.users[0])
+        response = ControlTimeViewSet.as_view({'post': 'batch'})(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def assert_day_totals(self, user):
+        day = Day.objects.get(user=user, date=self.date)
+        expected = calculation_time_variable(Day.objects.get(id=day.id))
+        self.assertEqual((day.real_working_hours, day.real_overtime),
+                         (expected.real_working_hours, expected.real_overtime))
+        return day
+
+    def test_mixed_batch(self):
+        # Метки обрабатываются в порядке пакета: первая метка кода - вход, следующая - выход
+        data = self.batch([
+            ('code-0', self.timestamp(8)),
+            ('code-1', self.timestamp(8, 5)),
+            ('code-0', self.timestamp(12)),
+            ('unknown', self.timestamp(12)),
+            ('code-0', self.timestamp(13)),
+            ('code-0', self.timestamp(20)),
+            ('code-1', self.timestamp(17)),
+        ])
+
+        self.assertEqual((data['created'], data['closed']), (3, 3))
+        self.assertEqual([swipe['code'] for swipe in data['rejected']], ['unknown'])
+        self.assertEqual(list(ControlTime.objects.filter(user=self.users[0]).order_by('time_entry').values_list(
+            'time_difference', flat=True)), [datetime.timedelta(hours=4), datetime.timedelta(hours=7)])
+        day = self.assert_day_totals(self.users[0])
+        self.assertEqual(day.real_working_hours + day.real_overtime, datetime.timedelta(hours=11))
+        self.assert_day_totals(self.users[1])
+
+    def test_exit_before_entry(self):
+        self.batch([('code-0', self.timestamp(10))])
+
+        # Метка раньше времени входа отклоняется, а control_time остается открытым до следующей метки
+        data = self.batch([('code-0', self.timestamp(9)), ('code-0', self.timestamp(11))])
+
+        self.assertEqual((data['created'], data['closed']), (0, 1))
+        self.assertEqual([swipe['code'] for swipe in data['rejected']], ['code-0'])
+        control_time = ControlTime.objects.get()
+        self.assertEqual(control_time.time_difference, datetime.timedelta(hours=1))
+        day = self.assert_day_totals(self.users[0])
+        self.assertEqual(day.real_working_hours + day.real_overtime, datetime.timedelta(hours=1))
+
+    def test_queries(self):
+        # Количество запросов не зависит от количества меток и пользователей в пакете
+        counts = []
+        for hour, users in ((8, self.users[:2]), (12, self.users)):
+            swipes = [(user.code, self.timestamp(hour, minute)) for minute in (0, 30) for user in users]
+            with CaptureQueriesContext(connection) as queries:
+                self.batch(swipes)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class ListQueriesTestCase(TestCase):
+    """
+    Проверка того, что количество запросов к БД при получении списков control_time и дней
+    не зависит от количества объектов
+    """
+
+    date = datetime.date(2021, 6, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = Project.objects.create(name='Проект')
+        cls.user = User.objects.create(username='user', code='code')
+
+    def create_days(self, count):
+        for _ in range(count):
+            number = User.objects.count()
+            user = User.objects.create(username=f'user-{number}', code=f'code-{number}')
+            day = Day.objects.create(user=user, project=self.project, date=self.date)
+            day.event.add(Event.objects.create(time_plan=datetime.timedelta(hours=1)))
+            time_entry = datetime.datetime.combine(self.date, datetime.time(6), tzinfo=utc)
+            ControlTime.objects.bulk_create([ControlTime(day=day, user=user, code=user.code, time_entry=time_entry,
+                                                         time_exit=time_entry + datetime.timedelta(hours=1))
+                                             for _ in range(2)])
+
+    def assert_list_queries(self, viewset, count):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.user)
+        view = viewset.as_view({'get': 'list'})
+
+        self.create_days(2)
+        with self.assertNumQueries(count):
+            response = view(request)
+            response.render()
+        self.create_days(5)
+        with self.assertNumQueries(count):
+            response = view(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_control_time_list(self):
+        response = self.assert_list_queries(ControlTimeViewSet, 1)
+        self.assertEqual(len(response.data['results']), 14)
+
+    def test_day_list(self):
+        # Дни вместе с пользователями и проектами и отдельный запрос событий дней
+        response = self.assert_list_queries(DayViewSet, 2)
+        self.assertEqual(len(response.data['results']), 7)
+
+
+class KeysetPaginationTestCase(TestCase):
+    """
+    Проверка постраничного вывода дней по ключу (дата, id), в том числе для дней с одинаковой датой
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', code='code')
+        users = [User.objects.create(username=f'user-{number}', code=f'code-{number}') for number in range(4)]
+        Day.objects.bulk_create([Day(user=user, date=datetime.date(2021, 6, 1) + datetime.timedelta(days=number))
+                                 for number in range(5) for user in users])
+        cls.expected = list(Day.objects.order_by('-date', '-id').values_list('id', flat=True))
+
+    def get_page(self, url):
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, user=self.user)
+        response = DayViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages(self):
+        # Проходим все страницы вперед, а затем назад
+        pages = []
+        data = self.get_page('/days/?page_size=3')
+        while True:
+            pages.append([day['id'] for day in data['results']])
+            if not data['next']:
+                break
+            data = self.get_page(data['next'])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        while data['previous']:
+            data = self.get_page(data['previous'])
+            pages.pop()
+            self.assertEqual([day['id'] for day in data['results']], pages[-1])
+        self.assertEqual(len(pages), 1)
+
+    def test_invalid_cursor(self):
+        request = APIRequestFactory().get('/days/?cursor=invalid')
+        force_authenticate(request, user=self.user)
+        self.assertEqual(DayViewSet.as_view({'get': 'list'})(request).status_code, 404)
+
+
+class AddDayTestCase(TestCase):
+    """
+    Проверка создания дней на несколько дней вперед задачей add_day
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'user-{number}', code=f'code-{number}') for number in range(3)]
+
+    def test_horizon(self):
+        # Пользователи, проверка созданных дней и вставка дней
+        with self.assertNumQueries(3):
+            self.assertEqual(add_day(horizon=14), 42)
+
+        today = timezone.now().date()
+        dates = set(Day.objects.values_list('date', flat=True))
+        self.assertEqual(dates, {today + datetime.timedelta(days=number) for number in range(14)})
+        self.assertFalse(Day.objects.filter(date__week_day__in=(1, 7)).exclude(type_of_day=TypeOfDay.OUTPUT).exists())
+
+    def test_existing_days(self):
+        Day.objects.create(user=self.users[0], date=timezone.now().date(), type_of_day=TypeOfDay.HOSPITAL)
+        self.assertEqual(add_day(), 20)
+        self.assertEqual(add_day(), 0)
+        self.assertEqual(Day.objects.count(), 21)
+        self.assertEqual(Day.objects.get(user=self.users[0], date=timezone.now().date()).type_of_day,
+                         TypeOfDay.HOSPITAL)
+
+
+class DutySchedulerTestCase(TestCase):
+    """
+    Проверка формирования графика дежурств
+    """
+
+    # Понедельник
+    date_start = datetime.date(2021, 3, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'user-{number}', code=f'code-{number}', last_name=name)
+                     for number, name in enumerate('ABCD')]
+        Profile.objects.update(year_appeal=2020, number_appeal=1)
+        cls.priority_duty = OrderOfDuty(year_appeal=2020, number_appeal=1)
+        cls.priority_duty.save()
+
+    def schedule(self, horizon):
+        scheduler = DutyScheduler(self.priority_duty, self.date_start, horizon)
+        scheduler.load()
+        schedule_list = scheduler.solve()
+        scheduler.save()
+        return [(schedule.date, schedule.user_id) for schedule in schedule_list]
+
+    def test_rotation(self):
+        ScheduleDuty.objects.create(user=self.users[3], date=self.date_start + datetime.timedelta(days=1))
+
+        # Уже назначенные дежурства, профили, дни пользователей, вставка дежурств и обновление количества нарядов
+        # (и точка сохранения транзакции)
+        with self.assertNumQueries(7):
+            schedule = self.schedule(horizon=7)
+
+        self.assertEqual(schedule, [
+            (self.date_start, self.users[0].id),
+            (self.date_start + datetime.timedelta(days=2), self.users[1].id),
+            (self.date_start + datetime.timedelta(days=3), self.users[2].id),
+            (self.date_start + datetime.timedelta(days=4), self.users[3].id),
+        ])
+        self.assertEqual(list(Profile.objects.values_list('count_duty', flat=True)), [1, 1, 1, 1])
+
+
+class AppealRotationTestCase(TestCase):
+    """
+    Проверка смены дежурного призыва
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for number, (year_appeal, number_appeal) in enumerate(((2020, 2), (2021, 1))):
+            user = User.objects.create(username=f'user-{number}', code=f'code-{number}')
+            Profile.objects.filter(user=user).update(year_appeal=year_appeal, number_appeal=number_appeal)
+
+    def test_rotation(self):
+        appeal_rotation = AppealRotation()
+        priority_duty = OrderOfDuty(year_appeal=2020, number_appeal=2)
+
+        # Границы призывов считаются одним запросом на все смены призыва
+        with self.assertNumQueries(1):
+            appeal_rotation.change(priority_duty)
+            self.assertEqual((priority_duty.year_appeal, priority_duty.number_appeal), (2020, 1))
+            appeal_rotation.change(priority_duty)
+            self.assertEqual((priority_duty.year_appeal, priority_duty.number_appeal), (2020, 2))
+
+    def test_new_run(self):
+        appeal_rotation = AppealRotation()
+        appeal_rotation.bounds()
+
+        # Границы запоминаются на одно формирование графика, а новый объект читает изменения призывов
+        Profile.objects.filter(year_appeal=2020).update(year_appeal=2019)
+        with self.assertNumQueries(0):
+            self.assertEqual(appeal_rotation.bounds()['min_year'], 2020)
+        with self.assertNumQueries(1):
+            self.assertEqual(AppealRotation().bounds()['min_year'], 2019)
+
+
+class DayUserTestCase(TestCase):
+    """
+    Проверка переноса пользователя дня в его control_time
+    """
+
+    def test_change_user(self):
+        users = [User.objects.create(username=f'user-{number}', code=f'code-{number}') for number in range(2)]
+        day = Day.objects.create(user=users[0], date=datetime.date(2021, 6, 1))
+        ControlTime.objects.create(day=day, code=users[0].code,
+                                   time_entry=datetime.datetime(2021, 6, 1, 8, tzinfo=utc))
+
+        day = Day.objects.get(id=day.id)
+        day.user = users[1]
+        day.save()
+        self.assertEqual(ControlTime.objects.get().user_id, users[1].id)
+
+
+class RfidCacheTestCase(TestCase):
+    """
+    Проверка кэша RFID-кодов
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', code='code')
+
+    def setUp(self):
+        rfid_cache.clear()
+        self.rfid_entry = resolve_code('code')
+
+    def assert_cached(self, cached=True):
+        if cached:
+            with self.assertNumQueries(0):
+                self.assertEqual(resolve_code('code'), self.rfid_entry)
+        else:
+            self.assertIsNone(rfid_cache.get('code', timezone.now().date()))
+
+    def test_hit(self):
+        self.assertEqual(self.rfid_entry.user_id, self.user.id)
+        self.assertEqual(self.rfid_entry.day_id, Day.objects.get(user=self.user, date=timezone.now().date()).id)
+        self.assert_cached()
+
+    def test_date_rollover(self):
+        tomorrow = timezone.now().date() + datetime.timedelta(days=1)
+        self.assertIsNone(rfid_cache.get('code', tomorrow))
+        self.assertIsNone(rfid_cache.get('code', timezone.now().date()))
+
+    def test_day_totals(self):
+        # Изменение показателей дня не удаляет запись кэша
+        day = Day.objects.get(id=self.rfid_entry.day_id)
+        day.real_working_hours = datetime.timedelta(hours=1)
+        day.save()
+        self.assert_cached()
+
+    def test_day_delete(self):
+        Day.objects.get(id=self.rfid_entry.day_id).delete()
+        self.assert_cached(False)
+        self.assertNotEqual(resolve_code('code').day_id, self.rfid_entry.day_id)
+
+    def test_day_date(self):
+        day = Day.objects.get(id=self.rfid_entry.day_id)
+        day.date -= datetime.timedelta(days=1)
+        day.save()
+        self.assert_cached(False)
+
+    def test_profile(self):
+        self.user.profile.position = UserPosition.ENGINEER
+        self.user.profile.save()
+        self.assert_cached(False)
+        self.assertEqual(resolve_code('code').position, UserPosition.ENGINEER)
+
+    def test_user_code(self):
+        self.user.code = 'new-code'
+        self.user.save()
+        self.assertIsNone(resolve_code('code'))
+        self.assertEqual(resolve_code('new-code').user_id, self.user.id)
+
+
+class ControlTimeDayTotalsTestCase(TestCase):
+    """
+    Проверка пересчета показателей дня при создании, изменении и удалении control_time
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', code='code', is_staff=True)
+
+    def setUp(self):
+        rfid_cache.clear()
+
+    def request(self, actions, method, data=None, pk=None):
+        request = getattr(APIRequestFactory(), method)('/', data, format='json')
+        force_authenticate(request, user=self.user)
+        response = ControlTimeViewSet.as_view(actions)(request, pk=pk)
+        response.render()
+        return response
+
+    def timestamp(self, hour, minute=0):
+        return datetime.datetime.combine(timezone.now().date(), datetime.time(hour, minute), tzinfo=utc)
+
+    def assert_day_totals(self):
+        day = Day.objects.get(user=self.user)
+        expected = calculation_time_variable(Day.objects.get(id=day.id))
+        for field in ('real_working_hours', 'real_overtime', 'time_of_respectful_absence_fact',
+                      'time_of_not_respectful_absence_fact'):
+            self.assertEqual(getattr(day, field), getattr(expected, field), field)
+        return day
+
+    def test_create_update_delete(self):
+        # Вход и выход по RFID-метке
+        for _ in range(2):
+            self.assertEqual(self.request({'post': 'create'}, 'post', {'code': 'code'}).status_code, 201)
+        control_time = ControlTime.objects.get()
+        self.assertIsNotNone(control_time.time_exit)
+        day = self.assert_day_totals()
+        day.event.add(Event.objects.create(time_plan=datetime.timedelta(hours=1), respectful_absence=True))
+
+        response = self.request({'put': 'update'}, 'put', {
+            'time_entry': self.timestamp(7).isoformat(), 'time_exit': self.timestamp(19, 30).isoformat()},
+            pk=control_time.id)
+        self.assertEqual(response.status_code, 200)
+        control_time.refresh_from_db()
+        self.assertEqual(control_time.time_difference, datetime.timedelta(hours=12, minutes=30))
+        day = self.assert_day_totals()
+        self.assertEqual(day.real_working_hours + day.real_overtime, datetime.timedelta(hours=12, minutes=30))
+
+        self.assertEqual(self.request({'delete': 'destroy'}, 'delete', pk=control_time.id).status_code, 204)
+        day = self.assert_day_totals()
+        self.assertEqual(day.real_working_hours + day.real_overtime, datetime.timedelta(0))
+
+    def test_close_day(self):
+        # Открытые control_time прошлых дат закрываются вместе с изменением показателей их дней
+        for date in (datetime.date(2021, 6, 1), datetime.date(2021, 6, 5)):
+            day = Day.objects.create(user=self.user, date=date, type_of_day=TypeOfDay.WORK)
+            ControlTime.objects.create(day=day, code='code',
+                                       time_entry=datetime.datetime.combine(date, datetime.time(8), tzinfo=utc))
+        close_day()
+
+        self.assertFalse(ControlTime.objects.filter(time_exit__isnull=True).exists())
+        for day in Day.objects.all():
+            expected = calculation_time_variable(Day.objects.get(id=day.id))
+            self.assertEqual((day.real_working_hours, day.real_overtime),
+                             (expected.real_working_hours, expected.real_overtime))
+            self.assertGreater(day.real_working_hours, datetime.timedelta(0))
+
+    def test_update_validation(self):
+        day = Day.objects.create(user=self.user, date=timezone.now().date())
+        control_time = ControlTime.objects.create(day=day, code='code', time_entry=self.timestamp(8),
+                                                  time_exit=self.timestamp(9),
+                                                  time_difference=datetime.timedelta(hours=1),
+                                                  overtime=datetime.timedelta(0))
+
+        for time_entry, time_exit in ((self.timestamp(8) - datetime.timedelta(days=1), self.timestamp(9)),
+                                      (self.timestamp(10), self.timestamp(9))):
+            response = self.request({'put': 'update'}, 'put', {
+                'time_entry': time_entry.isoformat(), 'time_exit': time_exit.isoformat()}, pk=control_time.id)
+            self.assertEqual(response.status_code, 400)
+
+        # Частичное изменение берет недостающее время из control_time
+        response = self.request({'patch': 'partial_update'}, 'patch', {'time_exit': self.timestamp(10).isoformat()},
+                                pk=control_time.id)
+        self.assertEqual(response.status_code, 200)
+        control_time.refresh_from_db()
+        self.assertEqual(control_time.time_difference, datetime.timedelta(hours=2))
+
+
+class ControlTimeDeltaTestCase(TransactionTestCase):
+    """
+    Проверка отправки изменений control_time клиентам websocket
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='user', code='code', first_name='Иван', last_name='Иванов')
+        self.day = Day.objects.create(user=self.user, date=datetime.date(2021, 6, 1))
+
+    def create_control_time(self):
+        return ControlTime.objects.create(day=self.day, user=self.user, code='code',
+                                          time_entry=datetime.datetime(2021, 6, 1, 8, tzinfo=utc),
+                                          time_exit=datetime.datetime(2021, 6, 1, 17, 30, tzinfo=utc),
+                                          time_difference=datetime.timedelta(hours=9, minutes=30))
+
+    def test_data(self):
+        # Изменение отправляется в том же виде, что и в списке control_time
+        with mock.patch('readerBd.models.send_delta') as send_delta:
+            control_time = self.create_control_time()
+        send_delta.assert_called_once_with('control_time', ControlTimeSerializer(control_time).data,
+                                           key=f'control_time:{control_time.id}')
+
+    def test_rollback(self):
+        # Изменение не отправляется, если транзакция откатилась
+        with mock.patch('readerBd.models.send_delta') as send_delta:
+            with transaction.atomic():
+                control_time = self.create_control_time()
+                control_time.delete()
+                send_delta.assert_not_called()
+                transaction.set_rollback(True)
+        send_delta.assert_not_called()
+
+        with mock.patch('readerBd.models.send_delta') as send_delta:
+            with transaction.atomic():
+                control_time = self.create_control_time()
+            control_time.delete()
+        self.assertEqual([call.args[0] for call in send_delta.call_args_list], ['control_time', 'control_time_delete'])
+
+
+class WSServerTestCase(SimpleTestCase):
+    """
+    Проверка номеров сообщений, продолжения получения после переподключения и переполнения очереди клиента
+    """
+
+    def setUp(self):
+        self.server = WSServer()
+        self.server.clients = {}
+        self.server.history = collections.deque(maxlen=3)
+        self.server.epoch = 100
+        self.server.seq = 0
+
+    def send(self, *keys):
+        for key in keys:
+            self.server.send_to_clients(json.dumps({'type': 'control_time', 'key': key, 'data': {}}))
+
+    def resume(self, **query):
+        client = Client(None)
+        self.server.resume(client, {key: [str(value)] for key, value in query.items()})
+        return [json.loads(message.text) for message in client.messages]
+
+    def test_seq(self):
+        self.send('a', 'b')
+        self.server.send_to_clients('not json')
+
+        # Сообщения получают возрастающие номера в пределах запуска сервера, не json сообщение становится reset
+        messages = [json.loads(message.text) for message in self.server.history]
+        self.assertEqual([(message['seq'], message['epoch'], message['type']) for message in messages],
+                         [(1, 100, 'control_time'), (2, 100, 'control_time'), (3, 100, 'reset')])
+
+    def test_resume(self):
+        self.send('a', 'b', 'c', 'd')
+
+        self.assertEqual([message['seq'] for message in self.resume(epoch=100, since=2)], [3, 4])
+        self.assertEqual(self.resume(epoch=100, since=4), [])
+        # Сообщение 2 уже удалено из истории, другой запуск сервера или первое подключение
+        for query in ({'epoch': 100, 'since': 0}, {'epoch': 99, 'since': 3}, {}):
+            messages = self.resume(**query)
+            self.assertEqual([(message['type'], message['seq']) for message in messages], [('reset', 4)])
+
+    def test_queue(self):
+        client = Client(None, max_size=2)
+        self.server.clients['client'] = client
+
+        # Сообщение с тем же ключом заменяет неотправленное
+        self.send('a', 'b', 'a')
+        self.assertEqual([message.seq for message in client.messages], [2, 3])
+
+        # При переполнении очереди клиенту отправляется reset
+        self.send('c')
+        self.assertEqual([(message.is_reset, message.seq) for message in client.messages], [(True, 4)])
+
+
+class PresenceTestCase(TransactionTestCase):
+    """
+    Проверка таблицы присутствия (последних меток пользователей за текущий день)
+    """
+
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user-{number}', code=f'code-{number}', is_staff=True)
+                      for number in range(2)]
+        self.days = [Day.objects.create(user=user, date=timezone.now().date()) for user in self.users]
+
+    def create_control_time(self, day, hour, time_exit=True):
+        time_entry = datetime.datetime.combine(day.date, datetime.time(hour), tzinfo=utc)
+        return ControlTime.objects.create(day=day, code=day.user.code, time_entry=time_entry,
+                                          time_exit=time_entry + datetime.timedelta(minutes=30) if time_exit else None)
+
+    def today_list(self):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.users[0])
+        response = ControlTimeTodayList.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return {control_time['id_user']: control_time for control_time in response.data}
+
+    def assert_presence(self, expected):
+        self.assertEqual({user_id: control_time['id'] for user_id, control_time in self.today_list().items()},
+                         expected)
+
+    def test_latest(self):
+        first = self.create_control_time(self.days[0], 1)
+        latest = self.create_control_time(self.days[0], 2)
+        other = self.create_control_time(self.days[1], 1)
+        self.assert_presence({self.users[0].id: latest.id, self.users[1].id: other.id})
+
+        # Удаление запросом возвращает предыдущую метку пользователя
+        ControlTime.objects.filter(id=latest.id).delete()
+        self.assert_presence({self.users[0].id: first.id, self.users[1].id: other.id})
+
+        # Каскадное удаление вместе с днем и пользователем
+        self.days[0].delete()
+        self.assert_presence({self.users[1].id: other.id})
+        self.users[1].delete()
+        self.assert_presence({})
+        self.assertFalse(Presence.objects.exists())
+
+    def test_close_day(self):
+        control_time = self.create_control_time(self.days[0], 1, time_exit=False)
+        self.assertIsNone(self.today_list()[self.users[0].id]['time_exit'])
+
+        close_day()
+        self.assertIsNotNone(self.today_list()[self.users[0].id]['time_exit'])
+        self.assertEqual(Presence.objects.get().control_time_id, control_time.id)
+
+
+class MonthStatisticTestCase(TestCase):
+    """
+    Проверка сложения помесячной статистики и дней неполных месяцев
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', code='code')
+        date = datetime.date(2021, 1, 20)
+        days = []
+        while date <= datetime.date(2021, 4, 10):
+            days.append(Day(user=cls.user, date=date,
+                            real_working_hours=datetime.timedelta(minutes=date.toordinal() % 97)))
+            date += datetime.timedelta(days=1)
+        Day.objects.bulk_create(days)
+
+    def time_work(self, date_from, date_to):
+        return user_statistic_queryset(Profile.objects.filter(user=self.user), date_from, date_to).get().time_work
+
+    def days_time_work(self, date_from, date_to):
+        days = Day.objects.filter(user=self.user, date__range=(date_from, date_to))
+        return sum((day.real_working_hours for day in days), datetime.timedelta(0))
+
+    def test_rollup_split(self):
+        rebuild_month_statistics('2021-02-01')
+        rebuild_month_statistics('2021-03-01')
+        date_from, date_to = datetime.date(2021, 1, 25), datetime.date(2021, 4, 5)
+        self.assertEqual(self.time_work(date_from, date_to), self.days_time_work(date_from, date_to))
+
+        # Целые месяцы берутся из помесячной статистики, а дни неполных месяцев - из дней
+        UserMonthStatistic.objects.filter(month=datetime.date(2021, 2, 1)).update(
+            real_working_hours=datetime.timedelta(hours=1000))
+        self.assertEqual(self.time_work(date_from, date_to),
+                         datetime.timedelta(hours=1000) + self.days_time_work(date_from, datetime.date(2021, 1, 31))
+                         + self.days_time_work(datetime.date(2021, 3, 1), date_to))
+
+    def test_missed_month(self):
+        # Статистика за февраль не собрана, поэтому февраль считается по дням
+        rebuild_month_statistics('2021-01-01')
+        rebuild_month_statistics('2021-03-01')
+        date_from, date_to = datetime.date(2021, 1, 1), datetime.date(2021, 3, 31)
+        self.assertEqual(self.time_work(date_from, date_to), self.days_time_work(date_from, date_to))
+        self.assertEqual(self.time_work(None, None), self.days_time_work(date_from, datetime.date(2021, 4, 30)))
+
+        # Изменение дня месяца без статистики не создает статистику месяца
+        day = Day.objects.get(user=self.user, date=datetime.date(2021, 2, 10))
+        day.real_working_hours = datetime.timedelta(hours=5)
+        day.save()
+        self.assertEqual(month_statistics_months(), {datetime.date(2021, 1, 1), datetime.date(2021, 3, 1)})
+        self.assertEqual(self.time_work(date_from, date_to), self.days_time_work(date_from, date_to))
+
+    def test_missing_months_task(self):
+        rebuild_month_statistics('2021-02-01')
+        rebuild_month_statistics()
+        self.assertTrue({datetime.date(2021, month, 1) for month in range(1, 5)} <= month_statistics_months())
+        self.assertEqual(UserMonthStatistic.objects.get(month=datetime.date(2021, 3, 1)).real_working_hours,
+                         self.days_time_work(datetime.date(2021, 3, 1), datetime.date(2021, 3, 31)))
+
+
+class ReportCacheTestCase(TestCase):
+    """
+    Проверка названий, поиска и удаления сформированных отчетов
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        patcher = mock.patch('docs.statistic_docx.REPORTS_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_report(self, name, size=10, age=datetime.timedelta(0), record=True, file=True):
+        if file:
+            path = os.path.join(self.path, name)
+            with open(path, 'wb') as report:
+                report.write(b'0' * size)
+            modified = (timezone.now() - age).timestamp()
+            os.utime(path, (modified, modified))
+        if record:
+            FileRepository.objects.create(name=name, file=f'docs/{name}', created_at=timezone.now() - age)
+
+    def test_report_name(self):
+        user = User.objects.create(username='user', code='code')
+        project = Project.objects.create(name='project')
+        day = Day.objects.create(user=user, date=datetime.date(2021, 6, 1))
+        params = {'date_from': datetime.date(2021, 6, 1), 'date_to': datetime.date(2021, 6, 30)}
+        name = report_name('users_statistic', **params)
+        self.assertEqual(report_name('users_statistic', **params), name)
+        self.assertNotEqual(report_name('users_statistic', **{**params, 'date_from': datetime.date(2021, 6, 2)}), name)
+
+        # Вход пользователя, метка входа, изменение количества нарядов и дни вне периода не влияют на отчет
+        unchanged = (
+            lambda: user.save(update_fields=['last_login']),
+            lambda: ControlTime.objects.create(day=day, code='code', time_entry=datetime.datetime(
+                2021, 6, 1, 8, tzinfo=utc)),
+            lambda: change_count_duty({user.id: 1}),
+            lambda: Day.objects.create(user=user, date=datetime.date(2021, 7, 1)),
+        )
+        for change in unchanged:
+            change()
+            self.assertEqual(report_name('users_statistic', **params), name)
+
+        # Изменения дней периода, пользователей, профилей и проектов меняют название отчета
+        profile = Profile.objects.get(user=user)
+        changes = (
+            lambda: Day.objects.filter(id=day.id).update(real_working_hours=datetime.timedelta(hours=1)),
+            lambda: Day.objects.create(user=user, date=datetime.date(2021, 6, 2)),
+            lambda: Day.objects.filter(id=day.id).delete(),
+            lambda: setattr(user, 'last_name', 'last_name') or user.save(),
+            lambda: setattr(profile, 'project', project) or profile.save(),
+            lambda: setattr(project, 'name', 'new project') or project.save(),
+        )
+        for change in changes:
+            time.sleep(0.001)
+            change()
+            new_name = report_name('users_statistic', **params)
+            self.assertNotEqual(new_name, name)
+            name = new_name
+
+    def test_cached_report(self):
+        self.add_report('report.docx')
+        self.add_report('no-file.docx', file=False)
+        self.add_report('no-record.docx', record=False)
+        self.assertEqual(cached_report('report.docx').name, 'report.docx')
+        self.assertIsNone(cached_report('no-file.docx'))
+        self.assertIsNone(cached_report('no-record.docx'))
+
+    def test_evict_reports(self):
+        self.add_report('old.docx', age=datetime.timedelta(days=10))
+        self.add_report('middle.docx', age=datetime.timedelta(days=2))
+        self.add_report('new.docx', age=datetime.timedelta(days=1))
+        self.add_report('no-file.docx', file=False, age=datetime.timedelta(hours=1))
+        self.add_report('no-record.docx', record=False, age=datetime.timedelta(hours=1))
+
+        # Удаляются старые отчеты и файлы без записей, а также записи без файлов
+        self.assertEqual(evict_reports(max_age=datetime.timedelta(days=5), max_size=100), 2)
+        self.assertEqual(sorted(os.listdir(self.path)), ['middle.docx', 'new.docx'])
+        self.assertEqual(set(FileRepository.objects.values_list('name', flat=True)), {'middle.docx', 'new.docx'})
+
+        # При превышении общего размера удаляются самые старые отчеты
+        self.assertEqual(evict_reports(max_age=datetime.timedelta(days=5), max_size=15), 1)
+        self.assertEqual(os.listdir(self.path), ['new.docx'])
+        self.assertEqual(list(FileRepository.objects.values_list('name', flat=True)), ['new.docx'])
+
+    def test_evict_saving_reports(self):
+        # Отчет, который сохраняется во время очистки: файл уже записан, а запись еще не создана,
+        # или запись создана после начала очистки
+        self.add_report('saving.docx', record=False)
+        self.add_report('saved.docx', file=False, age=-datetime.timedelta(minutes=1))
+
+        self.assertEqual(evict_reports(max_age=datetime.timedelta(days=5), max_size=0), 0)
+        self.assertEqual(os.listdir(self.path), ['saving.docx'])
+        self.assertTrue(FileRepository.objects.filter(name='saved.docx').exists())
+
+
+class ReportJobTestCase(TestCase):
+    """
+    Проверка формирования отчета в задаче celery: номер задачи, состояние задачи и скачивание отчета
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', code='admin', is_staff=True)
+        for number in range(2):
+            user = User.objects.create(username=f'user-{number}', code=f'code-{number}')
+            Day.objects.create(user=user, date=datetime.date(2021, 6, 1),
+                               real_working_hours=datetime.timedelta(hours=8))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        patcher = mock.patch('docs.statistic_docx.REPORTS_PATH', os.path.join(directory.name, 'docs'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, view, path, user=None, **kwargs):
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=user or self.admin)
+        return view(request, **kwargs)
+
+    @staticmethod
+    def report_view():
+        # Параметры действия (разрешения) передаются так же, как при подключении через router
+        return UsersStatisticUserViewSet.as_view({'get': 'report'}, **UsersStatisticUserViewSet.report.kwargs)
+
+    def report(self, download=False):
+        return self.get(self.report_view(),
+                        '/?time_entry=2021-06-01&time_exit=2021-06-30' + ('&download=1' if download else ''))
+
+    def status(self, result, download=False, user=None):
+        with mock.patch('api.public.accountBd.views.app.AsyncResult', return_value=result):
+            return self.get(ReportStatusAPIView.as_view(), '/?download=1' if download else '/', user=user,
+                            job_id='job')
+
+    def test_report_job(self):
+        # Задача выполняется сразу, как это сделал бы worker
+        with mock.patch.object(users_statistic_report, 'delay',
+                               side_effect=lambda *args: mock.Mock(id='job', result=users_statistic_report(*args))) \
+                as delay:
+            response = self.report()
+        self.assertEqual((response.status_code, response.data), (202, {'job_id': 'job'}))
+        document_name, profile_ids, time_entry, time_exit = delay.call_args.args
+        self.assertEqual(profile_ids, list(Profile.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual((time_entry, time_exit), ('2021-06-01', '2021-06-30'))
+
+        file_repository = FileRepository.objects.get(name=document_name)
+        result = mock.Mock(state='SUCCESS', result=file_repository.id,
+                           **{'failed.return_value': False, 'successful.return_value': True})
+        response = self.status(result)
+        self.assertEqual(response.data, {'status': 'SUCCESS', 'url': file_repository.file.url})
+
+        response = self.status(result, download=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(document_name, response['Content-Disposition'])
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'PK')
+        response.close()
+
+        # Повторный запрос с теми же параметрами получает уже сформированный отчет без новой задачи
+        with mock.patch.object(users_statistic_report, 'delay') as delay:
+            response = self.report()
+        delay.assert_not_called()
+        self.assertEqual(response.data, {'status': 'SUCCESS', 'url': file_repository.file.url})
+
+    def test_report_download(self):
+        # При указании download отчет формируется сразу и возвращается файлом без сохранения
+        with mock.patch.object(users_statistic_report, 'delay') as delay:
+            response = self.report(download=True)
+        delay.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'PK')
+        self.assertFalse(FileRepository.objects.exists())
+
+    def test_pending(self):
+        result = mock.Mock(state='PENDING', **{'failed.return_value': False, 'successful.return_value': False})
+        self.assertEqual(self.status(result).data, {'status': 'PENDING'})
+
+    def test_failure(self):
+        result = mock.Mock(state='FAILURE', **{'failed.return_value': True, 'successful.return_value': False})
+        self.assertEqual(self.status(result).data, {'status': 'FAILURE', 'message': 'Не удалось сформировать отчет'})
+
+    def test_permission(self):
+        # Состояние задачи и отчет доступны только тем, кто может формировать отчеты
+        user = User.objects.get(username='user-0')
+        result = mock.Mock(state='PENDING', **{'failed.return_value': False, 'successful.return_value': False})
+        self.assertEqual(self.status(result, user=user).status_code, 403)
+        with mock.patch.object(users_statistic_report, 'delay') as delay:
+            response = self.get(self.report_view(), '/', user=user)
+        self.assertEqual(response.status_code, 403)
+        delay.assert_not_called()
+
+
+class CountDutyTestCase(TestCase):
+    """
+    Проверка изменения количества нарядов пользователей при изменении расписания дежурств
+    """
+
+    date = datetime.date(2021, 6, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'user-{number}', code=f'code-{number}', is_staff=True)
+                     for number in range(3)]
+
+    def count_duty(self):
+        return list(Profile.objects.order_by('user_id').values_list('count_duty', flat=True))
+
+    def request(self, method, data, pk=None):
+        request = getattr(APIRequestFactory(), method)('/', data, format='json')
+        force_authenticate(request, user=self.users[0])
+        actions = {'post': 'create', 'put': 'update', 'patch': 'partial_update'}
+        response = ScheduleDutyViewSet.as_view({method: actions[method]})(request, pk=pk)
+        self.assertIn(response.status_code, (200, 201), response.data)
+        return response
+
+    def test_change_count_duty(self):
+        # Пользователи с одинаковым изменением обновляются одним запросом, нулевые изменения пропускаются
+        with self.assertNumQueries(2):
+            change_count_duty({self.users[0].id: 1, self.users[1].id: 1, self.users[2].id: -2})
+        self.assertEqual(self.count_duty(), [1, 1, -2])
+        with self.assertNumQueries(0):
+            change_count_duty({self.users[0].id: 0})
+
+    def test_create(self):
+        # Дежурство на свободную дату не изменяет количество нарядов
+        self.request('post', {'user': self.users[0].id, 'date': self.date})
+        self.assertEqual(self.count_duty(), [0, 0, 0])
+
+        # При добавлении дежурства на занятую дату наряд засчитывается уже назначенному пользователю
+        self.request('post', {'user': self.users[1].id, 'date': self.date})
+        self.assertEqual(self.count_duty(), [1, 0, 0])
+
+    def test_update(self):
+        duty = ScheduleDuty.objects.create(user=self.users[0], date=self.date)
+
+        # Наряд переходит от прежнего дежурного к новому
+        self.request('put', {'user': self.users[1].id, 'date': self.date}, pk=duty.id)
+        self.assertEqual(self.count_duty(), [-1, 1, 0])
+
+        # Частичное изменение без пользователя оставляет дежурного и количество нарядов
+        self.request('patch', {'date': self.date}, pk=duty.id)
+        self.assertEqual(self.count_duty(), [-1, 1, 0])
+        self.assertEqual(ScheduleDuty.objects.get().user_id, self.users[1].id)
+
+        # Частичное изменение без даты берет дату дежурства
+        self.request('patch', {'user': self.users[2].id}, pk=duty.id)
+        self.assertEqual(self.count_duty(), [-1, 0, 1])
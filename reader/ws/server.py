@@ -1,66 +1,221 @@
 import asyncio
+import collections
+import json
 import logging
+import os
+import time
+from urllib.parse import urlparse, parse_qs
 
 import websockets
 
 
 logging.basicConfig(level='DEBUG')
 
+# Путь, по которому подключается издатель событий (Django, celery). Сообщения остальных клиентов не рассылаются
+PUBLISH_PATH = '/publish'
+# Токен издателя событий, если не указан, то проверка не выполняется
+PUBLISH_TOKEN = os.environ.get('WEB_SOCKET_PUBLISH_TOKEN', '')
+# Максимальное количество сообщений в очереди отправки одного клиента
+CLIENT_QUEUE_SIZE = int(os.environ.get('WEB_SOCKET_CLIENT_QUEUE_SIZE', 100))
+# Количество последних сообщений, которые хранит сервер для продолжения получения после переподключения
+HISTORY_SIZE = int(os.environ.get('WEB_SOCKET_HISTORY_SIZE', 1000))
+
+
+class Message:
+    """
+    Класс содержит сообщение, которое уже сериализовано для отправки клиентам.
+    Сообщение получает порядковый номер seq, который возрастает в пределах запуска сервера (epoch).
+    """
+
+    __slots__ = ('seq', 'epoch', 'key', 'is_reset', 'text')
+
+    def __init__(self, data: dict, seq: int, epoch: int) -> None:
+        data['seq'] = seq
+        data['epoch'] = epoch
+        self.seq = seq
+        self.epoch = epoch
+        self.key = data.get('key')
+        self.is_reset = data.get('type') == 'reset'
+        # Сообщение сериализуется один раз для всех клиентов
+        self.text = json.dumps(data)
+
+    @classmethod
+    def reset(cls, seq: int, epoch: int) -> 'Message':
+        """
+        Метод создает сообщение, по которому клиент должен заново получить все данные
+        """
+
+        return cls({'type': 'reset', 'message': 'update'}, seq, epoch)
+
+    def as_reset(self) -> 'Message':
+        return self if self.is_reset else self.reset(self.seq, self.epoch)
+
+
+class Client:
+    """
+    Класс содержит соединение клиента и очередь сообщений на отправку. Неотправленное сообщение с тем же ключом
+    (например, об изменении того же control_time) заменяется новым. Сообщение reset заменяет всю очередь, так как
+    клиент все равно заново получит все данные. При переполнении очереди клиенту отправляется reset.
+    """
+
+    def __init__(self, web_socket: websockets.WebSocketServerProtocol, max_size: int = CLIENT_QUEUE_SIZE) -> None:
+        self.web_socket = web_socket
+        self.max_size = max_size
+        self.messages = collections.deque()
+        self.ready = asyncio.Event()
+
+    def put(self, message: Message) -> None:
+        """
+        Метод ставит сообщение в очередь клиента без ожидания отправки
+        """
+
+        if message.is_reset:
+            self.messages.clear()
+        elif message.key is not None:
+            for queued in self.messages:
+                if queued.key == message.key:
+                    self.messages.remove(queued)
+                    break
+
+        if len(self.messages) >= self.max_size:
+            self.messages.clear()
+            message = message.as_reset()
+        self.messages.append(message)
+        self.ready.set()
+
+    async def get(self) -> str:
+        while not self.messages:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.messages.popleft().text
+
 
 class WSServer:
     """
     Класс реализует сервер обработки соединений по websocket
     """
 
-    clients = set()
+    clients = {}
+    # Последние отправленные сообщения
+    history = collections.deque(maxlen=HISTORY_SIZE)
+    # Номер запуска сервера, после перезапуска номера сообщений начинаются заново
+    epoch = int(time.time())
+    seq = 0
 
-    async def register(self, web_socket: websockets.WebSocketServerProtocol) -> None:
+    async def register(self, web_socket: websockets.WebSocketServerProtocol) -> Client:
         """
         Метод для регистрации нового соединения
         """
 
-        self.clients.add(web_socket)
+        client = Client(web_socket)
+        self.clients[web_socket] = client
         logging.debug(f'{web_socket.remote_address} connects.')
+        return client
 
     async def unregister(self, web_socket: websockets.WebSocketServerProtocol) -> None:
         """
         Метод для отмены регистрации соединения
         """
 
-        self.clients.remove(web_socket)
+        self.clients.pop(web_socket, None)
         logging.debug(f'{web_socket.remote_address} disconnects.')
 
-    async def send_to_clients(self, message: str) -> None:
+    def send_to_clients(self, message: str) -> None:
+        """
+        Метод для отправки сообщения через все активные соединения. Сообщение только ставится в очереди клиентов,
+        поэтому медленный клиент не задерживает отправку остальным
+        """
+
+        try:
+            data = json.loads(message)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            data = {'type': 'reset', 'message': message}
+
+        self.seq += 1
+        message = Message(data, self.seq, self.epoch)
+        self.history.append(message)
+        for client in self.clients.values():
+            client.put(message)
+
+    def resume(self, client: Client, query: dict) -> None:
+        """
+        Метод ставит в очередь клиента сообщения, которые клиент пропустил. Если клиент подключился впервые,
+        после перезапуска сервера или пропущенных сообщений уже нет в истории, то клиенту отправляется reset
+
+        :param client: Клиент
+        :param query: Параметры подключения (epoch и since - номер последнего полученного клиентом сообщения)
+        """
+
+        try:
+            epoch = int(query['epoch'][0])
+            since = int(query['since'][0])
+        except (KeyError, ValueError):
+            epoch = since = None
+
+        oldest = self.history[0].seq if self.history else self.seq + 1
+        if epoch != self.epoch or since is None or not oldest - 1 <= since <= self.seq:
+            client.put(Message.reset(self.seq, self.epoch))
+            return
+
+        for message in self.history:
+            if message.seq > since:
+                client.put(message)
+
+    @staticmethod
+    async def send_from_queue(client: Client) -> None:
         """
-        Метод для отправки сообщения через все активные соединения
+        Метод отправляет клиенту сообщения из его очереди
         """
 
-        if self.clients:
-            await asyncio.wait([client.send(message) for client in self.clients])
+        while True:
+            message = await client.get()
+            await client.web_socket.send(message)
 
     async def distribute(self, web_socket: websockets.WebSocketServerProtocol) -> None:
         """
-        Метод для отправки всех сообщений
+        Метод для отправки всех сообщений издателя событий
         """
 
         async for message in web_socket:
-            await self.send_to_clients(message)
+            self.send_to_clients(message)
 
-    async def websocket_handler(self, web_socket: websockets.WebSocketServerProtocol, uri: str) -> None:
+    async def listen(self, web_socket: websockets.WebSocketServerProtocol, query: dict) -> None:
         """
-        Метод обработчик события создания нового соединения
+        Метод для обработки соединения клиента. Сообщения клиентов (например, ping) не рассылаются
         """
 
-        await self.register(web_socket)
+        client = await self.register(web_socket)
+        self.resume(client, query)
+        sender = asyncio.ensure_future(self.send_from_queue(client))
         try:
-            await self.distribute(web_socket)
+            async for _ in web_socket:
+                pass
         finally:
+            sender.cancel()
             await self.unregister(web_socket)
 
+    async def websocket_handler(self, web_socket: websockets.WebSocketServerProtocol, uri: str) -> None:
+        """
+        Метод обработчик события создания нового соединения
+        """
+
+        url = urlparse(uri)
+        query = parse_qs(url.query)
+        if url.path.rstrip('/').endswith(PUBLISH_PATH):
+            if PUBLISH_TOKEN and query.get('token', [''])[0] != PUBLISH_TOKEN:
+                logging.warning(f'{web_socket.remote_address} publisher token is invalid.')
+                await web_socket.close(code=1008)
+                return
+            await self.distribute(web_socket)
+        else:
+            await self.listen(web_socket, query)
 
-ws_server = WSServer()
-server = websockets.serve(ws_server.websocket_handler, '0.0.0.0', 9000)
-loop = asyncio.get_event_loop()
-loop.run_until_complete(server)
-loop.run_forever()
 
+if __name__ == '__main__':
+    ws_server = WSServer()
+    server = websockets.serve(ws_server.websocket_handler, '0.0.0.0', 9000)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server)
+    loop.run_forever()
@@ -1,6 +1,11 @@
 import asyncio
+import atexit
+import itertools
 import json
 import logging
+import os
+import threading
+from urllib.parse import urljoin, urlencode
 
 import websockets
 from django.conf import settings
@@ -9,23 +14,158 @@ from django.conf import settings
 logger = logging.getLogger(__name__)
 
 
-async def produce_message(message: str, address: str) -> None:
+class EventPublisher:
+    """
+    Класс отправляет события на сервер websocket в фоновом потоке через одно постоянное соединение.
+    Метод publish только ставит событие в очередь и сразу возвращает управление. События, которые пришли
+    в течение coalesce_delay секунд, отправляются пачкой, при этом события с одинаковым ключом объединяются
+    (отправляется последнее из них).
+    """
+
+    # Время накопления пачки событий (в секундах)
+    coalesce_delay = 0.1
+    # Максимальное количество событий в очереди, при переполнении удаляются самые старые события
+    max_pending = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._pending = {}
+        self._wakeup = None
+        self._send_lock = None
+        self._web_socket = None
+        self._counter = itertools.count()
+
+    def publish(self, message: dict, key=None) -> None:
+        """
+        Метод ставит событие в очередь на отправку
+
+        :param message: Событие, которое будет отправлено в формате json
+        :param key: Ключ для объединения событий. События без ключа не объединяются
+        """
+
+        loop = self._ensure_started()
+        loop.call_soon_threadsafe(self._put, key, json.dumps(message))
+
+    def flush(self, timeout: float = 2) -> None:
+        """
+        Метод отправляет все накопленные события, не дожидаясь окончания времени накопления пачки
+        """
+
+        if self._loop is None or self._pid != os.getpid():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._send_pending(), self._loop).result(timeout)
+        except Exception as e:
+            logger.warning(f'Не удалось отправить события websocket: {e}')
+
+    def _ensure_started(self):
+        with self._lock:
+            # После fork (gunicorn, celery) поток публикации в дочернем процессе отсутствует, поэтому запускаем новый
+            if self._loop is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending = {}
+                self._web_socket = None
+                self._loop = asyncio.new_event_loop()
+                started = threading.Event()
+                threading.Thread(target=self._run, args=(self._loop, started), name='ws-publisher',
+                                 daemon=True).start()
+                started.wait()
+            return self._loop
+
+    def _run(self, loop, started):
+        asyncio.set_event_loop(loop)
+        self._wakeup = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        started.set()
+        loop.run_until_complete(self._main())
+
+    def _put(self, key, message):
+        if key is None:
+            key = next(self._counter)
+        # Повторное событие с тем же ключом заменяет предыдущее
+        self._pending[key] = message
+        if len(self._pending) > self.max_pending:
+            self._pending.pop(next(iter(self._pending)))
+        self._wakeup.set()
+
+    async def _main(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.coalesce_delay)
+            await self._send_pending()
+
+    async def _send_pending(self):
+        # Пачки отправляются по очереди (отправка может быть вызвана и из flush)
+        async with self._send_lock:
+            await self._send_messages()
 
-    try:
-        async with websockets.connect(address) as web_socket:
-            json_message = json.dumps({
-                'message': message,
-            })
-            await web_socket.send(json_message)
-            await web_socket.recv()
+    async def _send_messages(self):
+        self._wakeup.clear()
+        messages = list(self._pending.values())
+        self._pending.clear()
+        if not messages:
+            return
 
-    except ConnectionRefusedError as e:
-        logger.warning(str(e))
+        address = publish_address()
+        # Если соединение было разорвано, то переподключаемся один раз, иначе пачка событий отбрасывается
+        for attempt in range(2):
+            try:
+                if self._web_socket is None or self._web_socket.closed:
+                    self._web_socket = await websockets.connect(address)
+                    asyncio.ensure_future(self._drain(self._web_socket))
+                for message in messages:
+                    await self._web_socket.send(message)
+                return
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                self._web_socket = None
+                if attempt:
+                    logger.warning(str(e))
 
+    @staticmethod
+    async def _drain(web_socket):
+        # Сервер может присылать сообщения в ответ, читаем их, чтобы не переполнялся буфер соединения
+        try:
+            async for _ in web_socket:
+                pass
+        except websockets.exceptions.WebSocketException:
+            pass
 
-def send_event(message: str = '', host: str = '127.0.0.1', port: int = 9000):
+
+def publish_address() -> str:
+    """
+    Функция возвращает адрес канала издателя событий на сервере websocket
     """
-    Функция для отправки сообщения по всем активным соединениям WebSocket
+
+    address = settings.WEB_SOCKET_SERVER_URL if settings.WEB_SOCKET_SERVER_URL else 'ws://127.0.0.1:9000/'
+    address = urljoin(address, 'publish')
+    if settings.WEB_SOCKET_PUBLISH_TOKEN:
+        address = f'{address}?{urlencode({"token": settings.WEB_SOCKET_PUBLISH_TOKEN})}'
+    return address
+
+
+publisher = EventPublisher()
+atexit.register(publisher.flush)
+
+
+def send_event(message: str = ''):
+    """
+    Функция для отправки сообщения по всем активным соединениям WebSocket. Сообщение ставится в очередь
+    и отправляется в фоновом потоке, одинаковые сообщения, отправленные подряд, объединяются в одно.
+    Клиенты, получив такое сообщение (type reset), заново запрашивают все данные.
+    """
+    publisher.publish({'type': 'reset', 'message': message}, key=message)
+
+
+def send_delta(type_: str, data: dict, key: str):
+    """
+    Функция для отправки изменения одного объекта по всем активным соединениям WebSocket. Клиенты применяют
+    изменение к уже полученным данным без повторного запроса.
+
+    :param type_: Тип изменения (например, control_time или control_time_delete)
+    :param data: Сериализованный объект
+    :param key: Ключ объекта, несколько изменений одного объекта объединяются в последнее
     """
-    address = settings.WEB_SOCKET_SERVER_URL if settings.WEB_SOCKET_SERVER_URL else f'ws://{host}:{port}/'
-    asyncio.run(produce_message(message=message, address=address))
+    # Поле message оставлено для совместимости с клиентами, которые обновляют все данные по любому сообщению
+    publisher.publish({'type': type_, 'key': key, 'data': data, 'message': 'update'}, key=key)